@@ -0,0 +1,233 @@
+"""
+Measure how the busiest endpoints scale with the size of the store.
+
+A synthetic store is made for each size (see synthetic.py) and the search
+page, document editing, /docdata and optionally create_archive are run
+through the flask test client. Latency percentiles and SQL statements per
+request are printed and saved as JSON named after the current commit, give
+an earlier file with --compare to see what changed.
+
+    python benchmarks/bench_endpoints.py --documents 1000 --documents 10000
+    python benchmarks/bench_endpoints.py --compare benchmarks/results/abc1234.json
+"""
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from sqlalchemy import event, select
+
+from duckstore.app import create_app
+from duckstore.database import db_session
+from duckstore.database.models import Document, Source, Tag
+from duckstore.util.sevenzip import create_archive
+
+from synthetic import make_store
+
+results_folder = Path(__file__).parent / "results"
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "after_cursor_execute", self.add)
+
+    def add(self, *args):
+        self.count += 1
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def summarise(timings, queries):
+    return {
+        "requests": len(timings),
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "p50_ms": percentile(timings, 0.5) * 1000,
+        "p90_ms": percentile(timings, 0.9) * 1000,
+        "p99_ms": percentile(timings, 0.99) * 1000,
+        "queries": statistics.fmean(queries),
+    }
+
+
+def request_cases(rng, doc_ids, tags, sources):
+    # Each case gives the arguments for one client call
+    words = ["invoice", "statement", "insurance", "payment", "tax"]
+    return {
+        "search": lambda: ("get", "/", {}),
+        "search_text": lambda: ("get", f"/?query={rng.choice(words)}", {}),
+        "search_tags": lambda: (
+            "get",
+            f"/?tags={rng.choice(tags[:5])}&source={rng.choice(sources[:5])}",
+            {},
+        ),
+        "edit_form": lambda: ("get", f"/edit?doc_id={rng.choice(doc_ids)}", {}),
+        "edit_save": lambda: (
+            "post",
+            "/edit",
+            {
+                "data": {
+                    "title": "Benchmark letter",
+                    "date_received": "2022-03-01",
+                    "tags": rng.sample(tags[:20], 2),
+                    "sources": [rng.choice(sources)],
+                    "files": (BytesIO(b"letter " * 100), "letter.txt"),
+                }
+            },
+        ),
+        "docdata": lambda: (
+            "post",
+            "/docdata",
+            {"data": {"docid": rng.choice(doc_ids)}},
+        ),
+    }
+
+
+def run_size(documents, requests, seed, archive):
+    rng = random.Random(seed)
+    results = {}
+    with TemporaryDirectory() as folder:
+        make_store(folder, documents, seed, write_files=archive)
+        # Served without reformatting the HTML, as with duckstore --serve
+        app = create_app(
+            folder, SECRET_KEY="bench", WTF_CSRF_ENABLED=False, PRETTIFY=False
+        )
+        engine = db_session.get_bind()
+        counter = QueryCounter(engine)
+
+        doc_ids = db_session.execute(select(Document.id)).scalars().all()
+        tags = db_session.execute(select(Tag.name).order_by(Tag.id)).scalars().all()
+        sources = (
+            db_session.execute(select(Source.name).order_by(Source.id)).scalars().all()
+        )
+        db_session.remove()
+
+        with app.test_client() as client:
+            for name, case in request_cases(rng, doc_ids, tags, sources).items():
+                timings, queries = [], []
+                # The first request fills the caches, it isn't counted
+                for i in range(requests + 1):
+                    method, url, kwargs = case()
+                    before = counter.count
+                    start = time.perf_counter()
+                    response = getattr(client, method)(url, **kwargs)
+                    response.get_data()
+                    elapsed = time.perf_counter() - start
+                    if response.status_code >= 400:
+                        raise RuntimeError(f"{name} failed: {response.status_code}")
+                    if i:
+                        timings.append(elapsed)
+                        queries.append(counter.count - before)
+                results[name] = summarise(timings, queries)
+
+        if archive:
+            with TemporaryDirectory() as archive_folder:
+                start = time.perf_counter()
+                create_archive(folder, Path(archive_folder, "bench.7z"))
+                elapsed = time.perf_counter() - start
+            results["create_archive"] = summarise([elapsed], [0])
+
+        db_session.remove()
+        app.extensions["duckstore_compression"].shutdown()
+        app.extensions["duckstore_thumbnails"].shutdown()
+        app.extensions["duckstore_text"].shutdown()
+        engine.dispose()
+    return results
+
+
+def current_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def print_results(results, previous=None):
+    print(
+        f"{'documents':>10} {'endpoint':<16}{'p50 ms':>9}{'p90 ms':>9}"
+        f"{'p99 ms':>9}{'queries':>9}{'p50 change':>12}"
+    )
+    for size, endpoints in results.items():
+        for name, stats in endpoints.items():
+            change = ""
+            old = (previous or {}).get(size, {}).get(name)
+            if old:
+                change = f"{(stats['p50_ms'] / old['p50_ms'] - 1) * 100:+.0f}%"
+            print(
+                f"{size:>10} {name:<16}{stats['p50_ms']:>9.2f}{stats['p90_ms']:>9.2f}"
+                f"{stats['p99_ms']:>9.2f}{stats['queries']:>9.1f}{change:>12}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--documents",
+        type=int,
+        action="append",
+        help="Store sizes to test, defaults to 1000, 10000 and 100000",
+    )
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--archive", action="store_true", help="Also time create_archive"
+    )
+    parser.add_argument(
+        "--output", type=Path, help="Results file, defaults to results/<commit>.json"
+    )
+    parser.add_argument("--compare", type=Path, help="Earlier results to compare to")
+    args = parser.parse_args()
+
+    commit = current_commit()
+    results = {}
+    for documents in args.documents or [1000, 10000, 100000]:
+        print(f"Testing {documents} documents")
+        results[str(documents)] = run_size(
+            documents, args.requests, args.seed, args.archive
+        )
+
+    previous = None
+    if args.compare:
+        previous = json.loads(args.compare.read_text())["results"]
+    print_results(results, previous)
+
+    output = args.output or results_folder / f"{commit}.json"
+    output.parent.mkdir(exist_ok=True)
+    output.write_text(
+        json.dumps(
+            {
+                "commit": commit,
+                "date": datetime.now().isoformat(timespec="seconds"),
+                "requests": args.requests,
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
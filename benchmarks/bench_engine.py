@@ -0,0 +1,133 @@
+"""
+Compare database throughput of the engine profiles under concurrent load.
+
+A number of reader threads run searches while writer threads add documents,
+the way the threaded server handles several requests at once. Each profile
+gets a fresh database with the same starting documents.
+
+    python benchmarks/bench_engine.py --documents 5000 --readers 8 --seconds 10
+"""
+import argparse
+import threading
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from duckstore.config import db_name
+from duckstore.database.database import create_db, get_engine, engine_profiles
+from duckstore.database.models import Document, Tag
+from duckstore.database.search import search_documents
+
+search_words = ["invoice", "insurance", "letter", "receipt", "tax", "car"]
+
+
+def fill_database(session_factory, documents):
+    with session_factory() as session:
+        tags = [Tag(name=word) for word in search_words]
+        session.add_all(tags)
+        start = date(2000, 1, 1)
+        for i in range(documents):
+            word = search_words[i % len(search_words)]
+            session.add(
+                Document(
+                    title=f"{word} {i}",
+                    description=f"Example {word} number {i}",
+                    date_received=start + timedelta(days=i % 5000),
+                    date_added=start,
+                    tags=[tags[i % len(tags)]],
+                )
+            )
+        session.commit()
+
+
+def reader(session_factory, stop, counts, errors):
+    i = 0
+    while not stop.is_set():
+        try:
+            with session_factory() as session:
+                search_documents(session, search_words[i % len(search_words)], limit=50)
+            counts.append(1)
+        except OperationalError:
+            errors.append(1)
+        i += 1
+
+
+def writer(session_factory, stop, counts, errors):
+    i = 0
+    while not stop.is_set():
+        try:
+            with session_factory() as session:
+                session.add(
+                    Document(
+                        title=f"new document {i}",
+                        date_received=date.today(),
+                        date_added=date.today(),
+                    )
+                )
+                session.commit()
+            counts.append(1)
+        except OperationalError:
+            errors.append(1)
+        i += 1
+
+
+def run_profile(profile, documents, readers, writers, seconds):
+    with TemporaryDirectory() as folder:
+        db_path = Path(folder, db_name)
+        create_db(db_path)
+        engine = get_engine(db_path, profile=profile)
+        session_factory = sessionmaker(bind=engine)
+        fill_database(session_factory, documents)
+
+        stop = threading.Event()
+        reads, writes, errors = [], [], []
+        threads = [
+            threading.Thread(target=reader, args=(session_factory, stop, reads, errors))
+            for _ in range(readers)
+        ]
+        threads.extend(
+            threading.Thread(
+                target=writer, args=(session_factory, stop, writes, errors)
+            )
+            for _ in range(writers)
+        )
+
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+    return len(reads) / seconds, len(writes) / seconds, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=5000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument(
+        "--profile",
+        action="append",
+        choices=list(engine_profiles),
+        help="Profiles to compare, defaults to all of them",
+    )
+    args = parser.parse_args()
+
+    print(f"{'profile':<10}{'reads/s':>10}{'writes/s':>10}{'errors':>8}")
+    for profile in args.profile or engine_profiles:
+        reads, writes, errors = run_profile(
+            profile, args.documents, args.readers, args.writers, args.seconds
+        )
+        print(f"{profile:<10}{reads:>10.1f}{writes:>10.1f}{errors:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Compare serialising documents through the ORM with the bulk serialiser.
+
+For each store size the same pages of document ids are turned into JSON with
+Document.to_dict (relationships loaded with selectinload, as the app did
+before) and with serialize.document_dicts, then the whole store is written
+through the catalogue export. Times are the best of a few runs.
+
+    python benchmarks/bench_serialize.py --documents 1000 --documents 10000
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload, sessionmaker
+
+from duckstore.catalogue import export_catalogue, jsonl_lines
+from duckstore.config import db_name
+from duckstore.database.database import get_engine
+from duckstore.database.models import Document
+from duckstore.database.serialize import document_dicts
+
+from synthetic import make_store
+
+
+def orm_json(session, ids):
+    query = (
+        select(Document)
+        .where(Document.id.in_(ids))
+        .options(
+            selectinload(Document.files),
+            selectinload(Document.sources),
+            selectinload(Document.tags),
+        )
+    )
+    return [
+        json.dumps(document.to_dict()) for document in session.execute(query).scalars()
+    ]
+
+
+def bulk_json(session, ids):
+    return [json.dumps(data) for data in document_dicts(session, ids).values()]
+
+
+def export_json(session):
+    for _ in jsonl_lines(export_catalogue(session)):
+        pass
+
+
+def best_time(session, func, repeats):
+    times = []
+    for _ in range(repeats):
+        # Start from an empty identity map each time, as a new request would
+        session.expunge_all()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_size(documents, page_size, repeats, seed):
+    with TemporaryDirectory() as folder:
+        make_store(folder, documents, seed, write_files=False)
+        engine = get_engine(Path(folder, db_name))
+        with sessionmaker(bind=engine)() as session:
+            ids = session.execute(select(Document.id)).scalars().all()
+            pages = [ids[i : i + page_size] for i in range(0, len(ids), page_size)]
+
+            def serialise_pages(serialiser):
+                return lambda: [serialiser(session, page) for page in pages]
+
+            orm = best_time(session, serialise_pages(orm_json), repeats)
+            bulk = best_time(session, serialise_pages(bulk_json), repeats)
+            export = best_time(session, lambda: export_json(session), repeats)
+        engine.dispose()
+
+    print(
+        f"{documents:>10}{orm * 1000:>12.1f}{bulk * 1000:>12.1f}"
+        f"{orm / bulk:>10.1f}x{export * 1000:>12.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--documents",
+        type=int,
+        action="append",
+        help="Store sizes to test, defaults to 1000 and 10000",
+    )
+    parser.add_argument(
+        "--page-size", type=int, default=500, help="Document ids per call"
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'documents':>10}{'to_dict ms':>12}{'bulk ms':>12}{'speedup':>11}"
+        f"{'export ms':>12}"
+    )
+    for documents in args.documents or [1000, 10000]:
+        run_size(documents, args.page_size, args.repeats, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Load test the flask development server against waitress.
+
+A store is filled with documents and a stored file, then each server is
+started in turn and hit by concurrent clients running searches and
+downloads. Needs waitress installed (pip install duckstore[serve]).
+
+    python benchmarks/bench_serve.py --clients 16 --seconds 10
+"""
+import argparse
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from sqlalchemy.orm import sessionmaker
+
+from duckstore.config import db_name, store_name
+from duckstore.database.database import create_db, get_engine
+from duckstore.database.models import Document, File
+
+from bench_engine import fill_database
+
+
+def make_store(folder, documents, file_size):
+    create_db(Path(folder, db_name))
+    engine = get_engine(Path(folder, db_name))
+    session_factory = sessionmaker(bind=engine)
+    fill_database(session_factory, documents)
+
+    Path(folder, store_name).mkdir()
+    Path(folder, store_name, "scan.pdf").write_bytes(b"%PDF" * (file_size // 4))
+    with session_factory() as session:
+        document = Document(title="Scan")
+        document.files.append(File(path="scan.pdf", original_name="scan.pdf"))
+        session.add(document)
+        session.commit()
+        file_id = document.files[0].id
+    engine.dispose()
+    return file_id
+
+
+def wait_for(url, timeout=30):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            urllib.request.urlopen(url).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"Server at {url} didn't start")
+
+
+def client(urls, stop, counts, errors):
+    i = 0
+    while not stop.is_set():
+        try:
+            urllib.request.urlopen(urls[i % len(urls)]).read()
+            counts.append(1)
+        except OSError:
+            errors.append(1)
+        i += 1
+
+
+def run_server(folder, args, port, clients, seconds, urls):
+    command = [
+        sys.executable,
+        "-m",
+        "duckstore.scripts.cli",
+        "--folder",
+        folder,
+        "--port",
+        str(port),
+        *args,
+    ]
+    server = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        base = f"http://127.0.0.1:{port}"
+        wait_for(base + "/")
+        full_urls = [base + url for url in urls]
+
+        stop = threading.Event()
+        counts, errors = [], []
+        threads = [
+            threading.Thread(target=client, args=(full_urls, stop, counts, errors))
+            for _ in range(clients)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    return len(counts) / seconds, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=5000)
+    parser.add_argument("--file-size", type=int, default=5 * 1024**2)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=5123)
+    args = parser.parse_args()
+
+    servers = {
+        "flask": [],
+        "waitress": ["--serve", "--threads", str(args.threads)],
+    }
+
+    with TemporaryDirectory() as folder:
+        file_id = make_store(folder, args.documents, args.file_size)
+        urls = [
+            "/?query=invoice",
+            "/?tags=tax",
+            f"/download?file_id={file_id}",
+            "/api/choices",
+        ]
+
+        print(f"{'server':<10}{'requests/s':>12}{'errors':>8}")
+        for name, server_args in servers.items():
+            rate, errors = run_server(
+                folder, server_args, args.port, args.clients, args.seconds, urls
+            )
+            print(f"{name:<10}{rate:>12.1f}{errors:>8}")
+
+
+if __name__ == "__main__":
+    main()
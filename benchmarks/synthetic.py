@@ -0,0 +1,200 @@
+"""
+Generate synthetic stores for benchmarks.
+
+Tags and sources follow a Zipf-like distribution, a few are on most documents
+and there is a long tail used only a handful of times, the way a real store
+builds up. Most documents have one file, file sizes are log-normal around a
+typical scanned letter and can be scaled down to keep the store small.
+
+    python benchmarks/synthetic.py path/to/folder --documents 10000
+"""
+import argparse
+import random
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy.orm import sessionmaker
+
+from duckstore.catalogue import import_catalogue
+from duckstore.config import db_name, store_name
+from duckstore.database.database import create_db, get_engine
+
+kinds = [
+    "invoice",
+    "statement",
+    "letter",
+    "receipt",
+    "policy",
+    "payslip",
+    "contract",
+    "reminder",
+    "certificate",
+    "report",
+]
+words = [
+    "account",
+    "balance",
+    "payment",
+    "renewal",
+    "annual",
+    "summary",
+    "insurance",
+    "council",
+    "tax",
+    "water",
+    "energy",
+    "mortgage",
+    "pension",
+    "vehicle",
+    "medical",
+    "school",
+    "broadband",
+    "refund",
+    "overdue",
+    "reference",
+]
+file_suffixes = [".pdf"] * 8 + [".jpg", ".txt"]
+
+# Median file size in bytes before scaling, a few pages of scanned PDF
+median_file_size = 300 * 1024
+max_file_size = 20 * 1024**2
+
+
+def zipf_weights(count, exponent=1.1):
+    return [1 / (rank**exponent) for rank in range(1, count + 1)]
+
+
+def pick(rng, population, weights, count):
+    # Distinct picks from a weighted population
+    chosen = set()
+    while len(chosen) < min(count, len(population)):
+        chosen.add(rng.choices(population, weights)[0])
+    return sorted(chosen)
+
+
+def synthetic_records(documents, seed=0, file_scale=0.01):
+    """
+    Catalogue records for a synthetic store
+
+    :param documents: number of documents
+    :param seed: random seed, the same seed gives the same store
+    :param file_scale: multiplier for the file sizes
+    :return: generator of (record, {path: size}) for each document
+    """
+    rng = random.Random(seed)
+    tag_names = [f"{words[i % len(words)]}-{i}" for i in range(20 + documents // 50)]
+    source_names = [f"Company {i}" for i in range(10 + documents // 100)]
+    tag_weights = zipf_weights(len(tag_names))
+    source_weights = zipf_weights(len(source_names))
+
+    start = date(2010, 1, 1)
+    file_id = 0
+    for doc_id in range(1, documents + 1):
+        kind = rng.choice(kinds)
+        sources = pick(
+            rng, source_names, source_weights, rng.choices([0, 1, 2], [5, 80, 15])[0]
+        )
+        received = start + timedelta(days=rng.randrange(15 * 365))
+        title = f"{sources[0] if sources else 'Unknown'} {kind} {received:%B %Y}"
+        text = " ".join(rng.choices(words, k=rng.randrange(20, 200)))
+
+        files, sizes = [], {}
+        for _ in range(rng.choices([0, 1, 2, 3], [5, 75, 15, 5])[0]):
+            file_id += 1
+            suffix = rng.choice(file_suffixes)
+            path = f"{kind}_{file_id}{suffix}"
+            size = min(rng.lognormvariate(0, 1) * median_file_size, max_file_size)
+            sizes[path] = max(int(size * file_scale), 1)
+            files.append(
+                {
+                    "id": file_id,
+                    "path": path,
+                    "original_name": f"{kind}{suffix}",
+                    "sha256": rng.randbytes(32).hex(),
+                    "text": text if suffix != ".jpg" else None,
+                }
+            )
+
+        record = {
+            "id": doc_id,
+            "title": title,
+            "description": f"{kind} about {rng.choice(words)}" if doc_id % 3 else None,
+            "location": "Filing cabinet" if doc_id % 10 == 0 else None,
+            "date_added": datetime.combine(received, datetime.min.time())
+            + timedelta(days=rng.randrange(30)),
+            "date_received": received,
+            "tags": pick(
+                rng,
+                tag_names,
+                tag_weights,
+                rng.choices([0, 1, 2, 3, 4], [20, 35, 25, 12, 8])[0],
+            ),
+            "sources": sources,
+            "files": files,
+        }
+        yield record, sizes
+
+
+def make_store(folder, documents, seed=0, file_scale=0.01, write_files=True):
+    """
+    Create a store filled with synthetic documents
+
+    :param folder: folder for the new store
+    :param documents: number of documents
+    :param seed: random seed
+    :param file_scale: multiplier for the file sizes
+    :param write_files: write the files, otherwise only the database is filled
+    :return: (total bytes of files, number of files)
+    """
+    folder = Path(folder)
+    store_folder = folder / store_name
+    store_folder.mkdir(parents=True, exist_ok=True)
+    db_path = folder / db_name
+    create_db(db_path)
+
+    engine = get_engine(db_path)
+    session_factory = sessionmaker(bind=engine)
+    rng = random.Random(seed)
+    total_bytes = file_count = 0
+
+    def records():
+        nonlocal total_bytes, file_count
+        for record, sizes in synthetic_records(documents, seed, file_scale):
+            for path, size in sizes.items():
+                if write_files:
+                    (store_folder / path).write_bytes(rng.randbytes(size))
+                total_bytes += size
+                file_count += 1
+            yield record
+
+    with session_factory() as session:
+        import_catalogue(session, records(), batch_size=2000)
+    engine.dispose()
+    return total_bytes, file_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("folder", type=Path)
+    parser.add_argument("--documents", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--file-scale",
+        type=float,
+        default=0.01,
+        help="Multiplier for the file sizes, 1 for full size files",
+    )
+    parser.add_argument("--no-files", action="store_true")
+    args = parser.parse_args()
+
+    total_bytes, file_count = make_store(
+        args.folder, args.documents, args.seed, args.file_scale, not args.no_files
+    )
+    print(
+        f"Created {args.documents} documents with {file_count} files "
+        f"({total_bytes / 1024**2:.1f} MB) in {args.folder}"
+    )
+
+
+if __name__ == "__main__":
+    main()
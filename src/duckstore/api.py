@@ -0,0 +1,194 @@
+"""
+JSON endpoints intended for scripts rather than the web interface
+"""
+import json
+
+from flask import (
+    Blueprint,
+    Response,
+    jsonify,
+    request,
+    stream_with_context,
+    url_for,
+)
+
+from .cache import get_choices, generation_etag
+from .catalogue import catalogue_format, export_catalogue, stream_catalogue
+from .database import db_session
+from .exceptions import CatalogueFormatError
+from .jobs import get_compression_queue
+from .uploads import (
+    create_upload,
+    upload_info,
+    append_upload,
+    UploadNotFoundError,
+    UploadOffsetError,
+    UploadTooLargeError,
+)
+from .database.search import (
+    iter_document_ids,
+    decode_cursor,
+    make_match_expression,
+)
+from .database.serialize import document_dicts
+
+api = Blueprint("api", __name__, url_prefix="/api")
+
+
+def _getlist(name):
+    # Repeated query argument without empty values, None if there are none
+    return [value for value in request.args.getlist(name) if value] or None
+
+
+@api.route("/documents")
+def list_documents():
+    """
+    Stream every document matching the search as newline delimited JSON
+
+    Takes the same query, source, tags, any_tags and exclude_tags arguments
+    as the search page and an optional cursor to resume from.
+    """
+    search_text = request.args.get("query") or None
+    sources = _getlist("source")
+    tags = _getlist("tags")
+    any_tags = _getlist("any_tags")
+    exclude_tags = _getlist("exclude_tags")
+    cursor = request.args.get("cursor") or None
+
+    if cursor:
+        # Check the cursor before starting the response
+        try:
+            decode_cursor(cursor, make_match_expression(search_text) is not None)
+        except ValueError:
+            return "Invalid cursor", 400
+
+    def generate():
+        batches = iter_document_ids(
+            db_session,
+            search_text,
+            sources,
+            tags,
+            any_tags=any_tags,
+            exclude_tags=exclude_tags,
+            cursor=cursor,
+        )
+        for ids in batches:
+            documents = document_dicts(db_session, ids)
+            for doc_id in ids:
+                # Deleted since its id was found
+                document = documents.get(doc_id)
+                if document is not None:
+                    yield json.dumps(document) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@api.route("/export")
+def export_documents():
+    """
+    Stream the whole catalogue, format=jsonl (the default) or format=parquet
+
+    Each record is a document with its tag and source names and its files,
+    see catalogue.document_records.
+    """
+    filename = f"duckstore_catalogue.{request.args.get('format', 'jsonl')}"
+    try:
+        fmt = catalogue_format(filename)
+    except CatalogueFormatError as exc:
+        return str(exc), 400
+
+    mimetype = "application/x-ndjson" if fmt == "jsonl" else "application/octet-stream"
+    response = Response(
+        stream_with_context(stream_catalogue(export_catalogue(db_session), fmt)),
+        mimetype=mimetype,
+    )
+    response.headers.set("Content-Disposition", "attachment", filename=filename)
+    return response
+
+
+@api.route("/choices")
+def list_choices():
+    """
+    Sorted tag and source names, ETags let the browser reuse its copy until
+    the tags or sources change
+    """
+    choices, generation = get_choices(db_session)
+    response = jsonify(choices)
+    response.set_etag(generation_etag(generation))
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@api.route("/jobs")
+def job_status():
+    """
+    Compression status of the files given by file_id arguments
+
+    Files without a known job are left out of the result.
+    """
+    compression = get_compression_queue()
+    statuses = {}
+    for file_id in request.args.getlist("file_id", type=int):
+        status = compression.status(file_id)
+        if status:
+            statuses[file_id] = status
+    return jsonify(statuses)
+
+
+@api.route("/uploads", methods=["POST"])
+def start_upload():
+    """
+    Start a resumable upload, takes the original filename as the filename argument
+    and optionally the size of the file in bytes as the size argument
+
+    Send the file in chunks with PATCH requests to the returned location, each
+    with an Upload-Offset header giving the position of the chunk in the file.
+    """
+    filename = request.form.get("filename") or request.args.get("filename")
+    if not filename:
+        return "filename is required", 400
+
+    size = request.values.get("size", type=int)
+    try:
+        upload_id = create_upload(filename, size)
+    except UploadTooLargeError as exc:
+        return str(exc), 413
+    response = jsonify({"id": upload_id, "offset": 0})
+    response.status_code = 201
+    response.headers["Location"] = url_for(".upload_status", upload_id=upload_id)
+    return response
+
+
+@api.route("/uploads/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    """
+    Current size of a resumable upload, a client resumes from this offset
+    """
+    try:
+        info = upload_info(upload_id)
+    except UploadNotFoundError:
+        return "Upload not found", 404
+    return jsonify({"id": upload_id, **info})
+
+
+@api.route("/uploads/<upload_id>", methods=["PATCH"])
+def upload_chunk(upload_id):
+    """
+    Append a chunk to a resumable upload
+    """
+    offset = request.headers.get("Upload-Offset", type=int)
+    if offset is None:
+        return "Upload-Offset header is required", 400
+
+    try:
+        new_offset = append_upload(upload_id, offset, request.stream)
+    except UploadNotFoundError:
+        return "Upload not found", 404
+    except UploadOffsetError as exc:
+        response = jsonify({"id": upload_id, "offset": exc.offset})
+        response.status_code = 409
+        return response
+    except UploadTooLargeError as exc:
+        return str(exc), 413
+
+    return jsonify({"id": upload_id, "offset": new_offset})
@@ -1,46 +1,101 @@
+from functools import partial
 from pathlib import Path
 
 from flask import Flask
 from flask_bootstrap import Bootstrap4
 from flask_pretty import Prettify
 
-from .config import make_config, db_name
-from .database import bind_session, cleanup_session, create_db
+from .cache import (
+    DiskBackend,
+    GenerationCache,
+    KeyedGenerationCache,
+    MemoryBackend,
+    ResultCache,
+    build_choices,
+    build_facets,
+)
+from .config import make_config, db_name, result_cache_name
+from .uploads import UploadRequest, clean_uploads, upload_folder_name
+from .jobs import CompressionQueue, TextExtractionQueue, update_file_hash
+from .previews import ThumbnailCache, thumbnail_folder_name
+from .metrics import init_metrics
+from .database import bind_session, cleanup_session, create_db, upgrade_db
 
 
-def create_app(folder_path=".", create=False):
+def create_app(folder_path=".", create=False, **config_overrides):
     """
     Create an application instance from a duckstore folder
 
     :param folder_path: Path to duckstore folder
     :param create: Create a new store in the folder
+    :param config_overrides: Config values to replace the defaults
     :return: flask app
     """
 
     folder_path = Path(folder_path).resolve()
-    config = make_config("AppConfig", folder_path)
+    config = make_config("AppConfig", folder_path, **config_overrides)
     app = Flask(__name__)
+    app.request_class = UploadRequest
     app.config.from_object(config)
 
     # Set up the session
     db_path = folder_path / db_name
     store_path = folder_path / config.STORE_NAME
     store_path.mkdir(exist_ok=True)
+    upload_path = folder_path / upload_folder_name
+    upload_path.mkdir(exist_ok=True)
+    clean_uploads(upload_path)
     if not db_path.exists():
         if create:
             create_db(db_path)
 
         else:
             raise FileNotFoundError("Database duckstore.db file not found in database")
+    else:
+        upgrade_db(db_path)
 
-    bind_session(db_path)
+    engine = bind_session(
+        db_path,
+        profile=app.config["DB_ENGINE_PROFILE"],
+        pool_size=app.config["DB_POOL_SIZE"],
+    )
+
+    app.extensions["duckstore_choices"] = GenerationCache(build_choices)
+    app.extensions["duckstore_facets"] = KeyedGenerationCache(build_facets)
+    if app.config["RESULT_CACHE_SHARED"]:
+        result_backend = DiskBackend(
+            folder_path / result_cache_name, maxsize=app.config["RESULT_CACHE_SIZE"]
+        )
+    else:
+        result_backend = MemoryBackend(maxsize=app.config["RESULT_CACHE_SIZE"])
+    results = app.extensions["duckstore_results"] = ResultCache(result_backend)
+
+    text_queue = app.extensions["duckstore_text"] = TextExtractionQueue(
+        store_path,
+        workers=app.config["TEXT_WORKERS"],
+        max_queued=app.config["TEXT_QUEUE_SIZE"],
+        ocr=app.config["OCR_ENABLED"],
+    )
+    app.extensions["duckstore_compression"] = CompressionQueue(
+        workers=app.config["COMPRESS_WORKERS"],
+        on_replace=partial(
+            update_file_hash, store_path, results=results, text_queue=text_queue
+        ),
+    )
+    app.extensions["duckstore_thumbnails"] = ThumbnailCache(
+        folder_path / thumbnail_folder_name,
+        max_bytes=app.config["THUMBNAIL_CACHE_SIZE"],
+        width=app.config["THUMBNAIL_WIDTH"],
+    )
 
     Bootstrap4(app)
     Prettify(app)
+    init_metrics(app, engine)
 
-    from . import views
+    from . import views, api
 
     app.register_blueprint(views.duckstore)
+    app.register_blueprint(api.api)
 
     app.teardown_appcontext(cleanup_session)
 
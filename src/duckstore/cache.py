@@ -0,0 +1,454 @@
+"""
+In-process caches for data that is expensive to rebuild on every request.
+
+Cached values are tied to the write generation of the store, a counter in the
+database that triggers bump on any change to documents, files, tags or sources,
+whichever process makes it. A value built under an older generation is stale
+and gets rebuilt on the next request. Each app keeps its own caches.
+
+Search results and the JSON of each document are kept in a ResultCache. The
+ids found by a search belong to a generation like everything else, document
+JSON is kept until that document is changed so it survives unrelated writes.
+The result cache is held in memory by default or in a file that every process
+serving the same store shares, the file is emptied whenever it is opened as
+changes made while nothing had it open can't be seen.
+"""
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import select
+
+# Distinguishes this process so generations from before a restart don't match
+_instance = secrets.token_hex(4)
+
+
+def current_generation(session):
+    """
+    Get the write generation of the store
+
+    Reading it starts the session's transaction, so anything read afterwards
+    in the same transaction is from that generation or later.
+
+    :param session: database session
+    :return: int
+    """
+    from .database.models import write_generation
+
+    return session.execute(select(write_generation.c.value)).scalar_one()
+
+
+def generation_etag(generation):
+    """
+    ETag for a response built from data of the given generation
+    """
+    return f"{_instance}-{generation}"
+
+
+class GenerationCache:
+    """
+    Cache a single value that is rebuilt when the write generation changes
+
+    :param builder: function that builds the value, called with a database
+                    session and the other arguments given to get
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+        self._lock = threading.Lock()
+        self._generation = None
+        self._value = None
+
+    def get(self, session, *args, **kwargs):
+        """
+        Get the cached value, building it if it's stale
+
+        :param session: database session
+        :return: (value, generation) tuple
+        """
+        # Take the generation before building so a write during the build
+        # leaves the value marked as stale
+        generation = current_generation(session)
+        with self._lock:
+            if self._generation == generation:
+                return self._value, generation
+
+        value = self.builder(session, *args, **kwargs)
+        with self._lock:
+            self._value, self._generation = value, generation
+        return value, generation
+
+    def clear(self):
+        with self._lock:
+            self._value, self._generation = None, None
+
+
+class KeyedGenerationCache:
+    """
+    Cache values by key, all of them are dropped when the write generation changes
+
+    :param builder: function that builds the value, called with a database
+                    session and the other arguments given to get
+    :param maxsize: number of values to keep, the least recently used go first
+    """
+
+    def __init__(self, builder, maxsize=256):
+        self.builder = builder
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._generation = None
+        self._values = OrderedDict()
+
+    def get(self, key, session, *args, **kwargs):
+        """
+        Get the cached value for a key, building it if it's missing or stale
+
+        :param key: hashable key identifying the value
+        :param session: database session
+        :return: (value, generation) tuple
+        """
+        generation = current_generation(session)
+        with self._lock:
+            if self._generation != generation:
+                self._values.clear()
+                self._generation = generation
+            elif key in self._values:
+                self._values.move_to_end(key)
+                return self._values[key], generation
+
+        value = self.builder(session, *args, **kwargs)
+        with self._lock:
+            # Don't store it if a write happened during the build
+            if self._generation == generation:
+                self._values[key] = value
+                while len(self._values) > self.maxsize:
+                    self._values.popitem(last=False)
+        return value, generation
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._generation = None
+
+
+# noinspection PyUnresolvedReferences
+def build_choices(session):
+    from .database.models import Tag, Source
+
+    tags = session.execute(select(Tag.name).order_by(Tag.name)).scalars().all()
+    sources = session.execute(select(Source.name).order_by(Source.name))
+    return {"tags": tags, "sources": sources.scalars().all()}
+
+
+def get_choices(session):
+    """
+    Get the sorted tag and source names used to fill in the form selections
+
+    :param session: database session
+    :return: ({"tags": [...], "sources": [...]}, generation) tuple
+    """
+    return current_app.extensions["duckstore_choices"].get(session)
+
+
+def build_facets(session, **search):
+    from .database.search import facet_counts
+
+    return facet_counts(session, **search)
+
+
+def get_facets(
+    session,
+    search_text=None,
+    sources=None,
+    tags=None,
+    any_tags=None,
+    exclude_tags=None,
+):
+    """
+    Get the number of matching documents for each tag and source
+
+    Counts are cached by the search criteria, searches that only differ in
+    the order of the names or the case and punctuation of the text share an entry.
+
+    :param session: database session
+    :param search_text: text to match against the search index
+    :param sources: names of sources, documents must come from at least one
+    :param tags: names of tags the documents must all have
+    :param any_tags: names of tags, documents must have at least one
+    :param exclude_tags: names of tags the documents must not have
+    :return: ({"tags": {name: count}, "sources": {name: count}}, generation) tuple
+    """
+    key, filters = _search_key(search_text, sources, tags, any_tags, exclude_tags)
+    facet_cache = current_app.extensions["duckstore_facets"]
+    return facet_cache.get(key, session, search_text=search_text, **filters)
+
+
+def _search_key(search_text, sources, tags, any_tags, exclude_tags):
+    # Key that is the same for searches giving the same results,
+    # and the filters with the names in a set order
+    from .database.search import make_match_expression
+
+    def names(values):
+        return tuple(sorted(set(values))) if values else None
+
+    filters = {
+        "sources": names(sources),
+        "tags": names(tags),
+        "any_tags": names(any_tags),
+        "exclude_tags": names(exclude_tags),
+    }
+    # The search index ignores case so the key can too
+    match = make_match_expression(search_text)
+    return (match and match.lower(), *filters.values()), filters
+
+
+class MemoryBackend:
+    """
+    Result cache storage in this process, least recently used entries go first
+
+    :param maxsize: number of entries to keep
+    """
+
+    shared = False
+
+    def __init__(self, maxsize=2000):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._values = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            value = self._values.get(key)
+            if value is not None:
+                self._values.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            while len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class DiskBackend:
+    """
+    Result cache storage in an SQLite file shared by every process using it
+
+    Entries are removed when the backend is opened, a process starting up
+    can't know what changed in the store (or which snapshot was restored)
+    since they were written.
+
+    :param path: path of the cache file
+    :param maxsize: number of entries to keep, the least recently used go first
+    """
+
+    shared = True
+
+    def __init__(self, path, maxsize=20000):
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()
+        self._sets = 0
+
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entry "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, used REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_entry_used ON entry (used)"
+            )
+            connection.execute("DELETE FROM entry")
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT value FROM entry WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        with connection:
+            connection.execute(
+                "UPDATE entry SET used = ? WHERE key = ?", (time.time(), key)
+            )
+        return row[0]
+
+    def set(self, key, value):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entry (key, value, used) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            # Trimming scans the table so only do it every so often
+            self._sets += 1
+            if self._sets % 100 == 0:
+                connection.execute(
+                    "DELETE FROM entry WHERE key IN (SELECT key FROM entry "
+                    "ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    (self.maxsize,),
+                )
+
+    def delete(self, keys):
+        with self._connection() as connection:
+            connection.executemany(
+                "DELETE FROM entry WHERE key = ?", [(key,) for key in keys]
+            )
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM entry")
+
+
+class ResultCache:
+    """
+    Cache search results and the JSON of documents
+
+    :param backend: MemoryBackend or DiskBackend to keep the entries in
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        self._lock = threading.Lock()
+        self._invalidated = 0  # Count of invalidations, to spot a change mid-build
+
+    def search(self, key, generation, builder):
+        """
+        Get the ids of a page of search results
+
+        :param key: JSON serialisable key identifying the search and page
+        :param generation: write generation the results are built from, read
+                           before building so a write meanwhile leaves it stale
+        :param builder: function returning a ResultPage of ids if not cached
+        :return: (ids, next_cursor) tuple
+        """
+        cache_key = f"search:{generation}:{json.dumps(key)}"
+        value = self.backend.get(cache_key)
+        if value is not None:
+            ids, next_cursor = json.loads(value)
+            return ids, next_cursor
+
+        ids, next_cursor = builder()
+        self.backend.set(cache_key, json.dumps([ids, next_cursor]))
+        return ids, next_cursor
+
+    def documents(self, ids, loader):
+        """
+        Get the JSON of documents
+
+        :param ids: document ids
+        :param loader: function called with the ids that aren't cached,
+                       returning {id: json}
+        :return: list of JSON strings in the order of ids, ids of documents
+                 that no longer exist are left out
+        """
+        found = {doc_id: self.backend.get(f"doc:{doc_id}") for doc_id in ids}
+        missing = [doc_id for doc_id, value in found.items() if value is None]
+        if missing:
+            with self._lock:
+                invalidated = self._invalidated
+            loaded = loader(missing)
+            found.update(loaded)
+            with self._lock:
+                # Don't keep anything read before a change to it was committed
+                if self._invalidated == invalidated:
+                    for doc_id, value in loaded.items():
+                        self.backend.set(f"doc:{doc_id}", value)
+        return [found[doc_id] for doc_id in ids if found[doc_id] is not None]
+
+    def invalidate_documents(self, ids):
+        """
+        Drop the cached JSON of documents, call this after committing a change
+
+        :param ids: ids of the documents that were changed or deleted
+        """
+        with self._lock:
+            self._invalidated += 1
+            self.backend.delete([f"doc:{doc_id}" for doc_id in ids])
+
+    def clear(self):
+        with self._lock:
+            self._invalidated += 1
+            self.backend.clear()
+
+
+def get_result_cache():
+    """
+    Get the result cache for the current app
+    """
+    return current_app.extensions["duckstore_results"]
+
+
+def _load_documents(session, ids):
+    from .database.serialize import document_dicts
+
+    return {
+        doc_id: json.dumps(data)
+        for doc_id, data in document_dicts(session, ids).items()
+    }
+
+
+def get_document_data(session, ids):
+    """
+    Get the to_dict JSON of documents from the result cache, loading any missing
+
+    :param session: database session
+    :param ids: document ids
+    :return: list of JSON strings in the order of ids, missing documents left out
+    """
+    return get_result_cache().documents(
+        ids, lambda missing: _load_documents(session, missing)
+    )
+
+
+def get_search_ids(
+    session,
+    search_text=None,
+    sources=None,
+    tags=None,
+    any_tags=None,
+    exclude_tags=None,
+    *,
+    cursor=None,
+    limit=None,
+):
+    """
+    Get the ids of a page of search results from the result cache
+
+    Takes the same arguments as search_documents.
+
+    :return: (ids, next_cursor) tuple
+    :raises ValueError: if the cursor is malformed
+    """
+    from .database.search import search_ids
+
+    key, filters = _search_key(search_text, sources, tags, any_tags, exclude_tags)
+    return get_result_cache().search(
+        [*key, cursor, limit],
+        current_generation(session),
+        lambda: search_ids(session, search_text, **filters, cursor=cursor, limit=limit),
+    )
@@ -0,0 +1,412 @@
+"""
+Export the whole catalogue, and load it back, as JSON Lines or Parquet.
+
+Each record is one document with the names of its tags and sources and the
+details of its files, including their extracted text. The files themselves
+aren't included, copy the store folder (or take a snapshot) alongside.
+
+Documents are read in batches so memory use stays the same however large the
+store is. Parquet needs pyarrow (pip install duckstore[parquet]).
+"""
+import json
+from collections import namedtuple
+from datetime import date, datetime
+from pathlib import Path
+
+from sqlalchemy import insert, select
+
+from .database.models import (
+    Document,
+    File,
+    Source,
+    Tag,
+    associate_document_source,
+    associate_document_tag,
+    get_or_create_named,
+)
+from .database.serialize import file_rows, named_rows
+from .exceptions import CatalogueFormatError
+from .util.zipstream import ChunkWriter
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+formats = {".jsonl": "jsonl", ".ndjson": "jsonl", ".parquet": "parquet"}
+
+CatalogueResult = namedtuple("CatalogueResult", ["imported", "skipped"])
+
+
+def catalogue_format(path, fmt=None):
+    """
+    Work out the format of a catalogue file from its suffix
+
+    :param path: path to the catalogue file
+    :param fmt: format to use instead of guessing, "jsonl" or "parquet"
+    :return: "jsonl" or "parquet"
+    :raises CatalogueFormatError: if the format is unknown or pyarrow is missing
+    """
+    fmt = fmt or formats.get(Path(path).suffix.lower())
+    if fmt not in formats.values():
+        raise CatalogueFormatError(f"Unknown catalogue format for {path}")
+    if fmt == "parquet" and pa is None:
+        raise CatalogueFormatError("pyarrow is needed for Parquet catalogues")
+    return fmt
+
+
+def document_records(session, ids):
+    """
+    Catalogue records of documents with their files, tags and sources
+
+    :param session: database session
+    :param ids: document ids
+    :return: list of dict in the order of ids
+    """
+    query = select(
+        Document.id,
+        Document.title,
+        Document.description,
+        Document.location,
+        Document.date_added,
+        Document.date_received,
+    ).where(Document.id.in_(ids))
+    rows = {row.id: row for row in session.execute(query)}
+
+    tags = named_rows(session, associate_document_tag, Tag, ids)
+    sources = named_rows(session, associate_document_source, Source, ids)
+    files = file_rows(session, ids, text=True)
+    return [
+        {
+            "id": row.id,
+            "title": row.title,
+            "description": row.description,
+            "location": row.location,
+            "date_added": row.date_added,
+            "date_received": row.date_received,
+            "tags": [name for _, name in tags[row.id]],
+            "sources": [name for _, name in sources[row.id]],
+            "files": files[row.id],
+        }
+        for row in (rows[doc_id] for doc_id in ids if doc_id in rows)
+    ]
+
+
+def export_catalogue(session, batch_size=500):
+    """
+    Iterate over a record for every document in the store
+
+    Documents are read a batch of ids at a time with flat queries rather than
+    through the ORM, so memory use stays the same however large the store is.
+
+    :param session: database session
+    :param batch_size: number of documents loaded at a time
+    :return: generator of dict, see document_records
+    """
+    last_id = 0
+    while True:
+        query = (
+            select(Document.id)
+            .where(Document.id > last_id)
+            .order_by(Document.id)
+            .limit(batch_size)
+        )
+        ids = session.execute(query).scalars().all()
+        if not ids:
+            break
+        yield from document_records(session, ids)
+        last_id = ids[-1]
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def jsonl_lines(records):
+    """
+    Encode records as JSON Lines
+
+    :param records: iterable of dict
+    :return: generator of str, one line per record
+    """
+    for record in records:
+        yield json.dumps(record, default=_json_default) + "\n"
+
+
+def _parquet_schema():
+    file_type = pa.struct(
+        [
+            ("id", pa.int64()),
+            ("path", pa.string()),
+            ("original_name", pa.string()),
+            ("sha256", pa.string()),
+            ("text", pa.string()),
+        ]
+    )
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("title", pa.string()),
+            ("description", pa.string()),
+            ("location", pa.string()),
+            ("date_added", pa.timestamp("us")),
+            ("date_received", pa.date32()),
+            ("tags", pa.list_(pa.string())),
+            ("sources", pa.list_(pa.string())),
+            ("files", pa.list_(file_type)),
+        ]
+    )
+
+
+def _batched(records, batch_size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_catalogue(records, path, fmt=None, batch_size=500):
+    """
+    Write records to a catalogue file
+
+    :param records: iterable of dict, see document_records
+    :param path: path of the file to write
+    :param fmt: "jsonl" or "parquet", guessed from the suffix if not given
+    :param batch_size: number of records in each Parquet row group
+    :return: number of records written
+    """
+    fmt = catalogue_format(path, fmt)
+    count = 0
+    if fmt == "parquet":
+        schema = _parquet_schema()
+        with pq.ParquetWriter(path, schema) as writer:
+            for batch in _batched(records, batch_size):
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                count += len(batch)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            for line in jsonl_lines(records):
+                f.write(line)
+                count += 1
+    return count
+
+
+def stream_catalogue(records, fmt="jsonl", batch_size=500):
+    """
+    Generate a catalogue file as it is written, for sending in a response
+
+    :param records: iterable of dict, see document_records
+    :param fmt: "jsonl" or "parquet"
+    :param batch_size: number of records in each Parquet row group
+    :return: generator of str for JSON Lines or bytes for Parquet
+    """
+    if fmt != "parquet":
+        yield from jsonl_lines(records)
+        return
+
+    output = ChunkWriter()
+    schema = _parquet_schema()
+    with pq.ParquetWriter(output, schema) as writer:
+        for batch in _batched(records, batch_size):
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            yield output.collect()
+    # The footer is written on close
+    yield output.collect()
+
+
+def read_catalogue(path, fmt=None, batch_size=500):
+    """
+    Iterate over the records in a catalogue file
+
+    :param path: path of the file to read
+    :param fmt: "jsonl" or "parquet", guessed from the suffix if not given
+    :param batch_size: number of Parquet rows read at a time
+    :return: generator of dict
+    """
+    fmt = catalogue_format(path, fmt)
+    if fmt == "parquet":
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            yield from batch.to_pylist()
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _as_date(value, kind):
+    # JSON Lines has ISO strings, Parquet gives dates and datetimes back
+    if not isinstance(value, str):
+        return value
+    return kind.fromisoformat(value)
+
+
+def import_catalogue(session, records, *, keep_ids=True, batch_size=500):
+    """
+    Add the documents from catalogue records to the store
+
+    Each batch is added in one transaction with a few bulk inserts. Records
+    that are already in the store are skipped, so an import that was
+    interrupted can be run again: with keep_ids documents whose id or any of
+    whose file ids are taken, otherwise documents with files whose contents
+    (or paths, for files without a hash) are all in the store already, or
+    without files but with the same title and dates as one in the store.
+
+    :param session: database session
+    :param records: iterable of dict, see document_records
+    :param keep_ids: keep the document and file ids from the records, for
+                     moving a store, otherwise new ids are given
+    :param batch_size: number of documents added in each transaction
+    :return: CatalogueResult with the number of documents imported and skipped
+    """
+    imported = skipped = 0
+    for batch in _batched(records, batch_size):
+        new_records = _new_records(session, batch, keep_ids)
+        skipped += len(batch) - len(new_records)
+        if new_records:
+            try:
+                _insert_records(session, new_records, keep_ids)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            imported += len(new_records)
+
+    return CatalogueResult(imported, skipped)
+
+
+def _new_records(session, batch, keep_ids):
+    # Leave out the records that are already in the store
+    if keep_ids:
+        # A file id can be taken even if the document id is free,
+        # inserting it would fail part way through the batch
+        ids = [record["id"] for record in batch]
+        query = select(Document.id).where(Document.id.in_(ids))
+        existing = set(session.execute(query).scalars())
+        file_ids = [file["id"] for record in batch for file in record["files"]]
+        query = select(File.id).where(File.id.in_(file_ids))
+        existing_files = set(session.execute(query).scalars())
+        return [
+            record
+            for record in batch
+            if record["id"] not in existing
+            and not any(file["id"] in existing_files for file in record["files"])
+        ]
+
+    # Files are matched on their contents, or on their path if they have no hash
+    def file_key(file):
+        return ("sha256", file["sha256"]) if file["sha256"] else ("path", file["path"])
+
+    keys = {file_key(file) for record in batch for file in record["files"]}
+    hashes = [value for kind, value in keys if kind == "sha256"]
+    paths = [value for kind, value in keys if kind == "path"]
+    query = select(File.sha256).where(File.sha256.in_(hashes))
+    existing = {("sha256", value) for value in session.execute(query).scalars()}
+    query = select(File.path).where(File.sha256.is_(None), File.path.in_(paths))
+    existing.update(("path", value) for value in session.execute(query).scalars())
+
+    # Documents without files are matched on their title and dates
+    def document_key(record):
+        return (
+            record["title"],
+            _as_date(record["date_added"], datetime),
+            _as_date(record["date_received"], date),
+        )
+
+    titles = {record["title"] for record in batch if not record["files"]}
+    query = select(Document.title, Document.date_added, Document.date_received).where(
+        Document.title.in_(titles), ~Document.files.any()
+    )
+    existing_documents = {tuple(row) for row in session.execute(query)}
+
+    new_records = []
+    for record in batch:
+        if record["files"]:
+            record_keys = {file_key(file) for file in record["files"]}
+            if record_keys <= existing:
+                continue
+            existing.update(record_keys)
+        else:
+            key = document_key(record)
+            if key in existing_documents:
+                continue
+            existing_documents.add(key)
+        new_records.append(record)
+    return new_records
+
+
+def _lookup_ids(named, names):
+    # Ids for a list of names, without blanks or repeats
+    return dict.fromkeys(named[name.strip()] for name in names if name.strip())
+
+
+def _insert_records(session, records, keep_ids):
+    tags = {
+        tag.name: tag.id
+        for tag in get_or_create_named(
+            session, Tag, {name for record in records for name in record["tags"]}
+        )
+    }
+    sources = {
+        source.name: source.id
+        for source in get_or_create_named(
+            session, Source, {name for record in records for name in record["sources"]}
+        )
+    }
+
+    document_rows = []
+    for record in records:
+        row = {
+            "title": record["title"],
+            "description": record["description"],
+            "location": record["location"],
+            "date_added": _as_date(record["date_added"], datetime),
+            "date_received": _as_date(record["date_received"], date),
+        }
+        if keep_ids:
+            row["id"] = record["id"]
+        document_rows.append(row)
+
+    if keep_ids:
+        session.execute(insert(Document), document_rows)
+        document_ids = [record["id"] for record in records]
+    else:
+        document_ids = session.scalars(
+            insert(Document).returning(Document.id, sort_by_parameter_order=True),
+            document_rows,
+        ).all()
+
+    tag_rows, source_rows, file_rows = [], [], []
+    for document_id, record in zip(document_ids, records):
+        for tag_id in _lookup_ids(tags, record["tags"]):
+            tag_rows.append({"document_id": document_id, "tag_id": tag_id})
+        for source_id in _lookup_ids(sources, record["sources"]):
+            source_rows.append({"document_id": document_id, "source_id": source_id})
+        for file in record["files"]:
+            row = {
+                "document_id": document_id,
+                "path": file["path"],
+                "original_name": file["original_name"],
+                "sha256": file["sha256"],
+                "text": file["text"],
+                # The text came with the file, it doesn't need extracting again
+                "text_sha256": file["sha256"] if file["text"] is not None else None,
+            }
+            if keep_ids:
+                row["id"] = file["id"]
+            file_rows.append(row)
+
+    if tag_rows:
+        session.execute(insert(associate_document_tag), tag_rows)
+    if source_rows:
+        session.execute(insert(associate_document_source), source_rows)
+    if file_rows:
+        session.execute(insert(File), file_rows)
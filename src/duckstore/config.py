@@ -5,6 +5,7 @@ from pathlib import Path
 secrets_file = (Path(__file__).parents[2] / ".secrets").resolve()
 db_name = "duckstore.db"
 store_name = "store"
+result_cache_name = ".results.db"
 
 
 class Config:
@@ -19,11 +20,33 @@ class Config:
     STORE_NAME = store_name
     DB_NAME = db_name
     MAX_CONTENT_LENGTH = 100 * 1024**2
+    MAX_UPLOAD_SIZE = (
+        2 * 1024**3
+    )  # Largest file sent through the resumable upload API
     WTF_CSRF_ENABLED = True
     PRETTIFY = True
-
-
-def make_config(configname, store_path):
-    new_config = type(configname, (Config,), {"STORE_PATH": store_path})
+    RESULTS_PER_PAGE = 50
+    CONTENT_ADDRESSED = False  # Store new files by hash so duplicates are kept once
+    DB_ENGINE_PROFILE = "tuned"  # See duckstore.database.database.engine_profiles
+    DB_POOL_SIZE = 10  # Should cover the number of server threads
+    COMPRESS_WORKERS = 2  # Number of PDFs compressed at the same time
+    TEXT_WORKERS = 2  # Number of files having their text extracted at the same time
+    TEXT_QUEUE_SIZE = 100  # Files waiting for text extraction before uploads wait
+    OCR_ENABLED = True  # Read scans and images with tesseract, if it is installed
+    THUMBNAIL_WIDTH = 200  # Pixels
+    THUMBNAIL_CACHE_SIZE = 200 * 1024**2  # Bytes of thumbnails kept
+    RESULT_CACHE_SIZE = 5000  # Searches and documents kept as JSON
+    # Keep the result cache in a file, for several processes serving the same store
+    RESULT_CACHE_SHARED = False
+    # Behind a proxy, let it send stored files. USE_X_SENDFILE for Apache/lighttpd,
+    # or the internal location the store folder is served from for nginx.
+    USE_X_SENDFILE = False
+    X_ACCEL_REDIRECT_PREFIX = None
+    METRICS_ENABLED = False  # Time requests, SQL and ghostscript, served at /metrics
+    SLOW_REQUEST_SECONDS = None  # Log where the time went for slower requests
+
+
+def make_config(configname, store_path, **overrides):
+    new_config = type(configname, (Config,), {"STORE_PATH": store_path, **overrides})
 
     return new_config
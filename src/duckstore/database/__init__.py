@@ -1 +1,8 @@
-from .database import db_session, bind_session, create_db, cleanup_session
+from .database import (
+    db_session,
+    bind_session,
+    create_db,
+    upgrade_db,
+    checkpoint_db,
+    cleanup_session,
+)
@@ -1,28 +1,41 @@
 from logging.config import fileConfig
 
-from sqlalchemy import engine_from_config
+from sqlalchemy import create_engine
 from sqlalchemy import pool
 
 from alembic import context
 
+from duckstore.database.models import Base
+from duckstore.database.search import fts_name
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
-config = context.config_dict
+config = context.config
 
 # Interpret the config file for Python logging.
-# This line sets up loggers basically.
-fileConfig(config.config_file_name)
+# Only when run from the alembic command, the app sets up its own logging.
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
 
-# add your model's MetaData object here
-# for 'autogenerate' support
-# from myapp import mymodel
-# target_metadata = mymodel.Base.metadata
-target_metadata = None
 
-# other values from the config, defined by the needs of env.py,
-# can be acquired:
-# my_important_option = config.get_main_option("my_important_option")
-# ... etc.
+def get_url():
+    """
+    Database to migrate, from `alembic -x db=path/to/duckstore.db ...`
+    or sqlalchemy.url in the ini file.
+    """
+    db_path = context.get_x_argument(as_dictionary=True).get("db")
+    if db_path:
+        return f"sqlite:///{db_path}"
+    return config.get_main_option("sqlalchemy.url")
+
+
+def include_name(name, type_, parent_names):
+    # The search index is managed by search.py, not the models
+    if type_ == "table":
+        return not name.startswith(fts_name)
+    return True
 
 
 def run_migrations_offline():
@@ -37,12 +50,13 @@ def run_migrations_offline():
     script output.
 
     """
-    url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url,
+        url=get_url(),
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        render_as_batch=True,
+        include_name=include_name,
     )
 
     with context.begin_transaction():
@@ -52,21 +66,30 @@ def run_migrations_offline():
 def run_migrations_online():
     """Run migrations in 'online' mode.
 
-    In this scenario we need to create an Engine
-    and associate a connection with the context.
+    upgrade_db passes in its own connection, from the alembic command
+    an Engine is created for the database given.
 
     """
-    connectable = engine_from_config(
-        config.get_section(config.config_ini_section),
-        prefix="sqlalchemy.",
-        poolclass=pool.NullPool,
-    )
+    connection = config.attributes.get("connection")
+    if connection is None:
+        connectable = create_engine(get_url(), poolclass=pool.NullPool)
+        with connectable.connect() as connection:
+            _run_with_connection(connection)
+    else:
+        _run_with_connection(connection)
 
-    with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
 
-        with context.begin_transaction():
-            context.run_migrations()
+def _run_with_connection(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # SQLite can't alter most things in place, batch mode rebuilds the table
+        render_as_batch=True,
+        include_name=include_name,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
 
 
 if context.is_offline_mode():
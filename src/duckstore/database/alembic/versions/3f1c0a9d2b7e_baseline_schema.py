@@ -0,0 +1,85 @@
+"""Baseline schema
+
+The tables as they were before migrations were used. Stores made before then
+are stamped with this revision and upgraded from here.
+
+Revision ID: 3f1c0a9d2b7e
+Revises:
+Create Date: 2026-10-18 10:12:41.305518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3f1c0a9d2b7e"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "source",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("name"),
+    )
+    op.create_table(
+        "tag",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("name"),
+    )
+    op.create_table(
+        "document",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("title", sa.String(), nullable=False),
+        sa.Column("description", sa.String(), nullable=True),
+        sa.Column("location", sa.String(), nullable=True),
+        sa.Column(
+            "date_added",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=True,
+        ),
+        sa.Column("date_received", sa.Date(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "file",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("document_id", sa.Integer(), nullable=True),
+        sa.Column("path", sa.String(), nullable=True),
+        sa.Column("original_name", sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(["document_id"], ["document.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "associate_document_source",
+        sa.Column("document_id", sa.Integer(), nullable=False),
+        sa.Column("source_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["document_id"], ["document.id"]),
+        sa.ForeignKeyConstraint(["source_id"], ["source.id"]),
+        sa.PrimaryKeyConstraint("document_id", "source_id"),
+    )
+    op.create_table(
+        "associate_document_tag",
+        sa.Column("document_id", sa.Integer(), nullable=False),
+        sa.Column("tag_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["document_id"], ["document.id"]),
+        sa.ForeignKeyConstraint(["tag_id"], ["tag.id"]),
+        sa.PrimaryKeyConstraint("document_id", "tag_id"),
+    )
+
+
+def downgrade():
+    op.drop_table("associate_document_tag")
+    op.drop_table("associate_document_source")
+    op.drop_table("file")
+    op.drop_table("document")
+    op.drop_table("tag")
+    op.drop_table("source")
@@ -0,0 +1,32 @@
+"""File hash and extracted text
+
+Revision ID: 8a2d5e6f1c4b
+Revises: 3f1c0a9d2b7e
+Create Date: 2026-10-18 10:14:02.118254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8a2d5e6f1c4b"
+down_revision = "3f1c0a9d2b7e"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Stores made by development versions may already have these
+    existing = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("file")}
+    with op.batch_alter_table("file") as batch_op:
+        if "sha256" not in existing:
+            batch_op.add_column(sa.Column("sha256", sa.String(), nullable=True))
+        if "text" not in existing:
+            batch_op.add_column(sa.Column("text", sa.String(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("file") as batch_op:
+        batch_op.drop_column("text")
+        batch_op.drop_column("sha256")
@@ -0,0 +1,30 @@
+"""Hash of the contents text was extracted from
+
+Revision ID: b4d91c2e7a63
+Revises: e51b7f28c9d0
+Create Date: 2026-10-18 16:02:37.540118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b4d91c2e7a63"
+down_revision = "e51b7f28c9d0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("file") as batch_op:
+        batch_op.add_column(sa.Column("text_sha256", sa.String(), nullable=True))
+
+    # Text found when the file was added is current, files without any are
+    # left for the extraction queue to look at again
+    op.execute("UPDATE file SET text_sha256 = sha256 WHERE text IS NOT NULL")
+
+
+def downgrade():
+    with op.batch_alter_table("file") as batch_op:
+        batch_op.drop_column("text_sha256")
@@ -0,0 +1,30 @@
+"""Full text search index
+
+Revision ID: c7e94b0d3a15
+Revises: 8a2d5e6f1c4b
+Create Date: 2026-10-18 10:15:37.640921
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from duckstore.database.search import fts_name, create_search_index
+
+
+# revision identifiers, used by Alembic.
+revision = "c7e94b0d3a15"
+down_revision = "8a2d5e6f1c4b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Also fills the index from any documents already in the store
+    create_search_index(op.get_bind())
+
+
+def downgrade():
+    for trigger in ["insert", "update", "delete"]:
+        op.execute(f"DROP TRIGGER IF EXISTS {fts_name}_document_{trigger}")
+        op.execute(f"DROP TRIGGER IF EXISTS {fts_name}_file_{trigger}")
+    op.execute(f"DROP TABLE IF EXISTS {fts_name}")
@@ -0,0 +1,49 @@
+"""Write generation counter kept up to date by triggers
+
+Revision ID: d2a87f3c5e19
+Revises: b4d91c2e7a63
+Create Date: 2026-10-18 18:12:45.203871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d2a87f3c5e19"
+down_revision = "b4d91c2e7a63"
+branch_labels = None
+depends_on = None
+
+generation_tables = [
+    "document",
+    "file",
+    "tag",
+    "source",
+    "associate_document_source",
+    "associate_document_tag",
+]
+operations = ["insert", "update", "delete"]
+
+
+def upgrade():
+    op.create_table(
+        "write_generation", sa.Column("value", sa.Integer(), nullable=False)
+    )
+    op.execute("INSERT INTO write_generation (value) VALUES (0)")
+    for table_name in generation_tables:
+        for operation in operations:
+            op.execute(
+                f"CREATE TRIGGER IF NOT EXISTS write_generation_{table_name}_{operation} "
+                f"AFTER {operation.upper()} ON {table_name} BEGIN "
+                "UPDATE write_generation SET value = value + 1; END"
+            )
+
+
+def downgrade():
+    for table_name in generation_tables:
+        for operation in operations:
+            op.execute(
+                f"DROP TRIGGER IF EXISTS write_generation_{table_name}_{operation}"
+            )
+    op.drop_table("write_generation")
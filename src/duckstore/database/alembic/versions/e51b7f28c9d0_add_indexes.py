@@ -0,0 +1,42 @@
+"""Index foreign keys and searched columns
+
+Revision ID: e51b7f28c9d0
+Revises: c7e94b0d3a15
+Create Date: 2026-10-18 10:21:54.907316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e51b7f28c9d0"
+down_revision = "c7e94b0d3a15"
+branch_labels = None
+depends_on = None
+
+indexes = [
+    ("associate_document_source", "source_id"),
+    ("associate_document_tag", "tag_id"),
+    ("document", "date_received"),
+    ("document", "title"),
+    ("file", "document_id"),
+    ("file", "path"),
+    ("file", "sha256"),
+]
+
+
+def upgrade():
+    for table_name, column_name in indexes:
+        op.create_index(
+            op.f(f"ix_{table_name}_{column_name}"),
+            table_name,
+            [column_name],
+            unique=False,
+            if_not_exists=True,
+        )
+
+
+def downgrade():
+    for table_name, column_name in reversed(indexes):
+        op.drop_index(op.f(f"ix_{table_name}_{column_name}"), table_name=table_name)
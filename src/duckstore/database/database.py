@@ -1,8 +1,11 @@
+import time
 from pathlib import Path
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import scoped_session, sessionmaker
 
+from ..exceptions import CheckpointError
+
 try:
     from greenlet import getcurrent as _scope_func
 except ImportError:
@@ -10,9 +13,98 @@ except ImportError:
 
 db_session = scoped_session(sessionmaker(), scopefunc=_scope_func)
 
+alembic_folder = Path(__file__).parent / "alembic"
+
+# Revision matching the tables of stores made before migrations were used
+baseline_revision = "3f1c0a9d2b7e"
+
+
+# Engine profiles are the pragmas set on every new connection and the pool settings.
+# "tuned" lets readers carry on while a write is in progress (WAL) and waits for
+# locks instead of failing straight away. "compat" is SQLite's own defaults.
+engine_profiles = {
+    "tuned": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,  # ms
+            "foreign_keys": "ON",
+            "cache_size": -32000,  # negative values are in KiB
+            "mmap_size": 256 * 1024**2,
+            "temp_store": "MEMORY",
+        },
+        "pool": {"pool_size": 10, "max_overflow": 10},
+    },
+    "compat": {
+        "pragmas": {},
+        "pool": {},
+    },
+}
+
+
+def _set_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    return on_connect
+
+
+def get_engine(db_path, *args, profile="tuned", pool_size=None, **kwargs):
+    """
+    Create an engine for a database file
+
+    :param db_path: path to database
+    :param profile: name of the engine profile in engine_profiles
+    :param pool_size: connections kept in the pool, overrides the profile
+    :return: sqlalchemy engine
+    """
+    settings = engine_profiles[profile]
+    pool_kwargs = dict(settings["pool"])
+    if pool_size is not None:
+        pool_kwargs["pool_size"] = pool_size
+    if pool_kwargs:
+        # Pooled connections are shared between the server threads
+        kwargs.setdefault("connect_args", {})["check_same_thread"] = False
+
+    engine = create_engine(f"sqlite:///{db_path}", *args, **pool_kwargs, **kwargs)
+    if settings["pragmas"]:
+        event.listen(engine, "connect", _set_pragmas(settings["pragmas"]))
+    return engine
+
 
-def get_engine(db_path, *args, **kwargs):
-    return create_engine(f"sqlite:///{db_path}", *args, **kwargs)
+def checkpoint_db(db_path, attempts=5, delay=0.5):
+    """
+    Write everything in the write-ahead log back into the database file
+
+    Run this before copying the database file, otherwise recent changes
+    may only be in the -wal file beside it. A reader or writer in another
+    process can block the checkpoint, in which case it is tried again.
+
+    :param db_path: path to database
+    :param attempts: number of times to try the checkpoint
+    :param delay: seconds to wait between attempts
+    :raises CheckpointError: if the log still holds changes after every attempt
+    """
+    engine = get_engine(db_path, profile="compat")
+    try:
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(delay)
+            with engine.connect() as connection:
+                busy, log, checkpointed = connection.execute(
+                    text("PRAGMA wal_checkpoint(TRUNCATE)")
+                ).one()
+            if not busy and log == checkpointed:
+                return
+    finally:
+        engine.dispose()
+
+    raise CheckpointError(
+        f"Checkpoint of {db_path} blocked, {checkpointed} of {log} pages written back"
+    )
 
 
 # noinspection PyUnresolvedReferences
@@ -22,8 +114,6 @@ def create_db(db_path, *, replace=False):
     :param db_path: path to database
     :param replace: Delete a database if it exists
     """
-    from .models import Base
-
     db_path = Path(db_path)
 
     db_path.parent.mkdir(
@@ -31,21 +121,68 @@ def create_db(db_path, *, replace=False):
     )  # Make the folder for the DB if it doesn't exist
 
     if replace:
-        db_path.unlink(missing_ok=True)
+        # A leftover write-ahead log would be replayed into the new database
+        for suffix in ("", "-wal", "-shm"):
+            db_path.with_name(db_path.name + suffix).unlink(missing_ok=True)
+
+    # The tables are built by the migrations so new and upgraded stores match
+    upgrade_db(db_path)
+
+
+def _alembic_config(connection=None):
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option("script_location", str(alembic_folder))
+    config.attributes["connection"] = connection
+    return config
+
+
+def upgrade_db(db_path):
+    """
+    Bring a database up to date with the current version by running the migrations
+
+    Databases made before migrations were used have the tables of the baseline
+    revision, they are stamped with that and upgraded from there.
+
+    :param db_path: path to database
+    :return: (old revision, new revision) if the database was upgraded, else None
+    """
+    from alembic import command
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    head = ScriptDirectory.from_config(_alembic_config()).get_current_head()
+
+    # Migrations rebuild tables so foreign keys are left off while they run
+    engine = get_engine(db_path, profile="compat")
+    try:
+        with engine.begin() as connection:
+            current = MigrationContext.configure(connection).get_current_revision()
+            if current == head:
+                return None
+
+            config = _alembic_config(connection)
+            if current is None and inspect(connection).has_table("document"):
+                command.stamp(config, baseline_revision)
+            command.upgrade(config, "head")
+    finally:
+        engine.dispose()
 
-    engine = get_engine(db_path)
-    Base.metadata.create_all(engine)
-    engine.dispose()
+    return current, head
 
 
-def bind_session(db_path):
+def bind_session(db_path, **engine_kwargs):
     """
     Make the global session
 
     :param db_path:
+    :param engine_kwargs: passed on to get_engine
+    :return: the engine the session uses
     """
-    engine = get_engine(db_path)
+    engine = get_engine(db_path, **engine_kwargs)
     db_session.configure(bind=engine, autocommit=False, autoflush=False)
+    return engine
 
 
 def cleanup_session(resp_or_exc):
@@ -11,6 +11,7 @@ from sqlalchemy import (
     func,
     select,
 )
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import relationship, declarative_base
 
 
@@ -42,13 +43,22 @@ def make_association_table(source1, source2):
         f"associate_{source1}_{source2}",
         Base.metadata,
         Column(f"{source1}_id", ForeignKey(f"{source1}.id"), primary_key=True),
-        Column(f"{source2}_id", ForeignKey(f"{source2}.id"), primary_key=True),
+        # The primary key covers lookups from source1, this covers the reverse
+        Column(
+            f"{source2}_id", ForeignKey(f"{source2}.id"), primary_key=True, index=True
+        ),
     )
 
 
 associate_document_source = make_association_table("document", "source")
 associate_document_tag = make_association_table("document", "tag")
 
+# A single row counting writes to the store, triggers on every other table bump
+# it so cached data can tell it is stale whichever process made the change
+write_generation = Table(
+    "write_generation", Base.metadata, Column("value", Integer, nullable=False)
+)
+
 
 @add_repr
 class File(Base):
@@ -62,15 +72,23 @@ class File(Base):
     __tablename__ = "file"
 
     id = Column(Integer, primary_key=True)
-    document_id = Column(Integer, ForeignKey("document.id"))
-    path = Column(String)  # Relative to the store folder.
+    document_id = Column(Integer, ForeignKey("document.id"), index=True)
+    path = Column(String, index=True)  # Relative to the store folder.
     original_name = Column(String)  # The original filename in case it got changed
+    sha256 = Column(String, index=True)  # Hex digest of the file contents
+    text = Column(String)  # Text extracted from the file for searching
+    text_sha256 = Column(String)  # Hash of the contents the text was extracted from
 
     def __repr__(self):
         return self._repr(id=self.id, path=self.path, original_name=self.original_name)
 
     def to_dict(self):
-        return {"id": self.id, "path": self.path, "original_name": self.original_name}
+        return {
+            "id": self.id,
+            "path": self.path,
+            "original_name": self.original_name,
+            "sha256": self.sha256,
+        }
 
     def full_path(self, store_folder):
         return Path(store_folder, self.path)
@@ -113,6 +131,10 @@ class Tag(Base):
         return {"id": self.id, "name": self.name}
 
 
+def _format_date(value):
+    return value.strftime("%Y-%m-%d") if value else None
+
+
 @add_repr
 class Document(Base):
     """
@@ -122,11 +144,11 @@ class Document(Base):
     __tablename__ = "document"
 
     id = Column(Integer, primary_key=True)
-    title = Column(String, nullable=False)
+    title = Column(String, nullable=False, index=True)
     description = Column(String)
     location = Column(String)  # If there's a physical copy where did I put it.
     date_added = Column(DateTime, server_default=func.now())
-    date_received = Column(Date)
+    date_received = Column(Date, index=True)
 
     files = relationship("File", backref="document", cascade="all, delete-orphan")
     sources = relationship(
@@ -162,14 +184,48 @@ class Document(Base):
             "title": self.title,
             "description": self.description,
             "location": self.location,
-            "date_added": self.date_added.strftime("%Y-%m-%d"),
-            "date_received": self.date_received.strftime("%Y-%m-%d"),
+            "date_added": _format_date(self.date_added),
+            "date_received": _format_date(self.date_received),
             "tags": tags,
             "sources": sources,
             "files": files,
         }
 
 
+def get_or_create_named(db_session, model, names):
+    """
+    Get the Tag or Source objects for a list of names, creating any that are missing
+
+    Existing entries are found with a single query, missing entries are inserted
+    together and fetched back. The insert ignores names that another session has
+    added in the meantime so this doesn't fail on the unique constraint.
+
+    :param db_session: database session
+    :param model: Tag or Source
+    :param names: names to look up, surrounding whitespace and empty names are ignored
+    :return: list of model instances in the order of the names given
+    """
+    # Strip and remove duplicates while keeping the order
+    names = list(dict.fromkeys(name.strip() for name in names if name.strip()))
+    if not names:
+        return []
+
+    query = select(model).where(model.name.in_(names))
+    found = {item.name: item for item in db_session.execute(query).scalars()}
+
+    missing = [name for name in names if name not in found]
+    if missing:
+        db_session.execute(
+            insert(model)
+            .values([{"name": name} for name in missing])
+            .on_conflict_do_nothing(index_elements=["name"])
+        )
+        query = select(model).where(model.name.in_(missing))
+        found.update((item.name, item) for item in db_session.execute(query).scalars())
+
+    return [found[name] for name in names]
+
+
 def merge_tags(main_tag, *tags):
     """
     Merge tags into main_tag, designed to be used from the shell
@@ -193,17 +249,19 @@ def merge_tags(main_tag, *tags):
 def clear_unused(db_session):
     # Clean up unused tags and unused sources
     used_tags = select(associate_document_tag.c.tag_id)
-    unused_tags = db_session.execute(
-        select(Tag).where(~Tag.id.in_(used_tags))
-    ).scalars()
+    unused_tags = (
+        db_session.execute(select(Tag).where(~Tag.id.in_(used_tags))).scalars().all()
+    )
     for tag in unused_tags:
         db_session.delete(tag)
 
     print(f"Marked {len(unused_tags)} unused tags for deletion.")
     used_sources = select(associate_document_source.c.source_id)
-    unused_sources = db_session.execute(
-        select(Source).where(~Source.id.in_(used_sources))
-    ).scalars()
+    unused_sources = (
+        db_session.execute(select(Source).where(~Source.id.in_(used_sources)))
+        .scalars()
+        .all()
+    )
 
     for source in unused_sources:
         db_session.delete(source)
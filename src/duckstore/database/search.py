@@ -0,0 +1,564 @@
+"""
+Full text search over documents.
+
+Search is handled by an SQLite FTS5 table with one row per document (the rowid
+is the document id). Triggers on the document and file tables keep it in sync
+so anything that writes to the database - the web views, the shell or a script -
+keeps the index up to date without having to remember to do so.
+"""
+import re
+from collections import namedtuple
+from datetime import date
+
+from sqlalchemy import (
+    and_,
+    column,
+    distinct,
+    func,
+    literal,
+    literal_column,
+    or_,
+    select,
+    table,
+    text,
+    union_all,
+)
+from sqlalchemy.orm import Session, selectinload
+
+from .models import (
+    Document,
+    Source,
+    Tag,
+    associate_document_source,
+    associate_document_tag,
+)
+
+fts_name = "document_fts"
+
+# Column weights used by bm25 for ranking: title, description, location, file_text
+rank_weights = (10.0, 5.0, 2.0, 1.0)
+
+document_fts = table(
+    fts_name,
+    column("rowid"),
+    column("title"),
+    column("description"),
+    column("location"),
+    column("file_text"),
+    column("rank"),
+)
+
+ResultPage = namedtuple("ResultPage", ["documents", "next_cursor"])
+
+# Combined extracted text of all files attached to the document in a trigger
+_file_text = (
+    "coalesce((SELECT group_concat(text, ' ') FROM file "
+    "WHERE document_id = {doc}.document_id), '')"
+)
+
+_search_ddl = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {fts_name} USING fts5(
+        title, description, location, file_text, tokenize='porter unicode61'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {fts_name}_document_insert
+    AFTER INSERT ON document BEGIN
+        INSERT INTO {fts_name}(rowid, title, description, location, file_text)
+        VALUES (new.id, new.title, new.description, new.location, '');
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {fts_name}_document_update
+    AFTER UPDATE OF title, description, location ON document BEGIN
+        UPDATE {fts_name}
+        SET title = new.title, description = new.description, location = new.location
+        WHERE rowid = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {fts_name}_document_delete
+    AFTER DELETE ON document BEGIN
+        DELETE FROM {fts_name} WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {fts_name}_file_insert
+    AFTER INSERT ON file BEGIN
+        UPDATE {fts_name} SET file_text = {_file_text.format(doc="new")}
+        WHERE rowid = new.document_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {fts_name}_file_update
+    AFTER UPDATE OF text, document_id ON file BEGIN
+        UPDATE {fts_name} SET file_text = {_file_text.format(doc="old")}
+        WHERE rowid = old.document_id;
+        UPDATE {fts_name} SET file_text = {_file_text.format(doc="new")}
+        WHERE rowid = new.document_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {fts_name}_file_delete
+    AFTER DELETE ON file BEGIN
+        UPDATE {fts_name} SET file_text = {_file_text.format(doc="old")}
+        WHERE rowid = old.document_id;
+    END
+    """,
+]
+
+
+def create_search_index(connection):
+    """
+    Create the full text search table and the triggers that keep it in sync.
+
+    This is safe to run against a database that already has the index.
+
+    :param connection: SQLAlchemy connection
+    :return: True if the index table was newly created
+    """
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": fts_name},
+    ).first()
+
+    for statement in _search_ddl:
+        connection.execute(text(statement))
+
+    weights = ", ".join(str(w) for w in rank_weights)
+    connection.execute(
+        text(f"INSERT INTO {fts_name}({fts_name}, rank) VALUES ('rank', :rank)"),
+        {"rank": f"bm25({weights})"},
+    )
+
+    if not exists:
+        rebuild_search_index(connection)
+
+    return not exists
+
+
+def rebuild_search_index(connection):
+    """
+    Repopulate the search index from the document and file tables.
+
+    :param connection: SQLAlchemy connection
+    """
+    connection.execute(text(f"DELETE FROM {fts_name}"))
+    connection.execute(
+        text(
+            f"""
+            INSERT INTO {fts_name}(rowid, title, description, location, file_text)
+            SELECT document.id, document.title, document.description,
+                document.location, coalesce(file_text.text, '')
+            FROM document
+            LEFT JOIN (
+                SELECT document_id, group_concat(text, ' ') AS text
+                FROM file GROUP BY document_id
+            ) AS file_text ON file_text.document_id = document.id
+            """
+        )
+    )
+
+
+def make_match_expression(search_text):
+    """
+    Convert text from the search box into an FTS5 query.
+
+    Every word must appear (as a prefix) somewhere in the document.
+    Punctuation is dropped so user input can't be interpreted as FTS5 syntax.
+
+    :param search_text: raw search text
+    :return: FTS5 MATCH expression or None if there are no searchable words
+    """
+    words = re.findall(r"\w+", search_text or "")
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def match_documents(search_text):
+    """
+    Clause matching FTS rows to the search text.
+
+    Use together with a join of ``document_fts.c.rowid`` to ``Document.id``.
+
+    :param search_text: raw search text
+    :return: SQLAlchemy where clause or None if there are no searchable words
+    """
+    expression = make_match_expression(search_text)
+    if expression is None:
+        return None
+    return literal_column(fts_name).op("MATCH")(expression)
+
+
+def encode_cursor(sort_key, doc_id):
+    """
+    Make a cursor string for the position after a search result
+
+    :param sort_key: date received or search rank of the result
+    :param doc_id: id of the result
+    :return: cursor string
+    """
+    if sort_key is None:
+        key = ""
+    elif isinstance(sort_key, date):
+        key = sort_key.isoformat()
+    else:
+        key = repr(sort_key)
+    return f"{key}_{doc_id}"
+
+
+def decode_cursor(cursor, ranked):
+    """
+    Read a cursor produced by encode_cursor
+
+    :param cursor: cursor string
+    :param ranked: the cursor comes from a search ordered by rank
+    :return: (sort_key, doc_id) tuple
+    :raises ValueError: if the cursor is malformed
+    """
+    key, _, doc_id = cursor.rpartition("_")
+    doc_id = int(doc_id)
+    if ranked:
+        sort_key = float(key)
+    else:
+        sort_key = date.fromisoformat(key) if key else None
+    return sort_key, doc_id
+
+
+def _after_clause(sort_key, doc_id, ranked):
+    # Keyset condition matching the ordering used by search_query
+    if ranked:
+        rank = document_fts.c.rank
+        return or_(rank > sort_key, and_(rank == sort_key, Document.id < doc_id))
+
+    received = Document.date_received
+    if sort_key is None:
+        # Documents without a date are sorted last
+        return and_(received.is_(None), Document.id < doc_id)
+    return or_(
+        received < sort_key,
+        and_(received == sort_key, Document.id < doc_id),
+        received.is_(None),
+    )
+
+
+def _document_ids(association, model, names, match_all=False):
+    # Ids of documents linked to any of the names, or to all of them.
+    # Working on the association table keeps this one query however many names.
+    other_id = association.c[f"{model.__tablename__}_id"]
+    query = (
+        select(association.c.document_id)
+        .join(model, model.id == other_id)
+        .where(model.name.in_(names))
+    )
+    if match_all:
+        query = query.group_by(association.c.document_id).having(
+            func.count(distinct(other_id)) == len(names)
+        )
+    return query
+
+
+def search_query(
+    search_text=None,
+    sources=None,
+    tags=None,
+    *,
+    any_tags=None,
+    exclude_tags=None,
+    after=None,
+):
+    """
+    Build the query for documents matching the search criteria.
+
+    Text searches are ordered by relevance, otherwise the most recently
+    received documents come first. Ties are broken by id so the ordering is
+    stable for keyset pagination. Each row is (Document, sort_key).
+
+    :param search_text: text to match against the search index
+    :param sources: names of sources, documents must come from at least one
+    :param tags: names of tags the documents must all have
+    :param any_tags: names of tags, documents must have at least one
+    :param exclude_tags: names of tags the documents must not have
+    :param after: (sort_key, doc_id) of the last result already seen
+    :return: select statement for Document and its sort key
+    """
+    match = match_documents(search_text)
+    ranked = match is not None
+
+    query = select(Document)
+
+    if ranked:
+        query = query.join(document_fts, document_fts.c.rowid == Document.id)
+        query = query.where(match)
+    if sources:
+        source_ids = _document_ids(associate_document_source, Source, set(sources))
+        query = query.where(Document.id.in_(source_ids))
+    if tags:
+        all_ids = _document_ids(associate_document_tag, Tag, set(tags), match_all=True)
+        query = query.where(Document.id.in_(all_ids))
+    if any_tags:
+        any_ids = _document_ids(associate_document_tag, Tag, set(any_tags))
+        query = query.where(Document.id.in_(any_ids))
+    if exclude_tags:
+        excluded_ids = _document_ids(associate_document_tag, Tag, set(exclude_tags))
+        query = query.where(Document.id.not_in(excluded_ids))
+
+    if after is not None:
+        query = query.where(_after_clause(*after, ranked=ranked))
+
+    if ranked:
+        # Best matches first, bm25 ranks are lower for better matches
+        sort_key = document_fts.c.rank
+        query = query.order_by(sort_key, Document.id.desc())
+    else:
+        sort_key = Document.date_received
+        query = query.order_by(sort_key.desc(), Document.id.desc())
+
+    return query.add_columns(sort_key.label("sort_key"))
+
+
+def facet_counts(
+    session,
+    search_text=None,
+    sources=None,
+    tags=None,
+    *,
+    any_tags=None,
+    exclude_tags=None,
+):
+    """
+    Count the documents matching the search criteria for each tag and source.
+
+    Tag counts are the number of current results with that tag, the number
+    a search would find with it added to the tags. Choosing another source
+    widens the search instead, so source counts leave out the source filter.
+    Both are worked out in a single grouped query.
+
+    :param session: database session
+    :param search_text: text to match against the search index
+    :param sources: names of sources, documents must come from at least one
+    :param tags: names of tags the documents must all have
+    :param any_tags: names of tags, documents must have at least one
+    :param exclude_tags: names of tags the documents must not have
+    :return: {"tags": {name: count}, "sources": {name: count}} without zero counts
+    """
+
+    def matching_ids(source_names):
+        query = search_query(
+            search_text,
+            source_names,
+            tags,
+            any_tags=any_tags,
+            exclude_tags=exclude_tags,
+        )
+        return query.with_only_columns(Document.id).order_by(None)
+
+    def grouped_counts(kind, association, model, document_ids):
+        other_id = association.c[f"{model.__tablename__}_id"]
+        return (
+            select(literal(kind).label("kind"), model.name, func.count())
+            .select_from(association)
+            .join(model, model.id == other_id)
+            .where(association.c.document_id.in_(document_ids))
+            .group_by(model.name)
+        )
+
+    query = union_all(
+        grouped_counts("tags", associate_document_tag, Tag, matching_ids(sources)),
+        grouped_counts(
+            "sources", associate_document_source, Source, matching_ids(None)
+        ),
+    )
+
+    counts = {"tags": {}, "sources": {}}
+    for kind, name, count in session.execute(query):
+        counts[kind][name] = count
+    return counts
+
+
+def search_documents(
+    session,
+    search_text=None,
+    sources=None,
+    tags=None,
+    *,
+    any_tags=None,
+    exclude_tags=None,
+    cursor=None,
+    limit=None,
+):
+    """
+    Get a page of the documents matching the search criteria for display.
+
+    Files, sources and tags are loaded up front with one query each
+    rather than lazily per document when the results are rendered.
+
+    :param session: database session
+    :param search_text: text to match against the search index
+    :param sources: names of sources, documents must come from at least one
+    :param tags: names of tags the documents must all have
+    :param any_tags: names of tags, documents must have at least one
+    :param exclude_tags: names of tags the documents must not have
+    :param cursor: cursor from a previous page to continue from
+    :param limit: maximum number of documents to return, None for all of them
+    :return: ResultPage of the documents and the cursor for the next page
+    :raises ValueError: if the cursor is malformed
+    """
+    ranked = make_match_expression(search_text) is not None
+    after = decode_cursor(cursor, ranked) if cursor else None
+
+    query = search_query(
+        search_text,
+        sources,
+        tags,
+        any_tags=any_tags,
+        exclude_tags=exclude_tags,
+        after=after,
+    ).options(
+        selectinload(Document.files),
+        selectinload(Document.sources),
+        selectinload(Document.tags),
+    )
+    rows, next_cursor = _fetch_page(session, query, limit, lambda row: row.Document.id)
+    return ResultPage([row.Document for row in rows], next_cursor)
+
+
+def search_ids(
+    session,
+    search_text=None,
+    sources=None,
+    tags=None,
+    *,
+    any_tags=None,
+    exclude_tags=None,
+    cursor=None,
+    limit=None,
+):
+    """
+    Get the ids of a page of documents matching the search criteria.
+
+    Takes the same arguments as search_documents but only the ids are
+    fetched, for when the documents themselves come from a cache.
+
+    :return: ResultPage of document ids and the cursor for the next page
+    :raises ValueError: if the cursor is malformed
+    """
+    ranked = make_match_expression(search_text) is not None
+    after = decode_cursor(cursor, ranked) if cursor else None
+
+    query = search_query(
+        search_text,
+        sources,
+        tags,
+        any_tags=any_tags,
+        exclude_tags=exclude_tags,
+        after=after,
+    )
+    query = query.with_only_columns(Document.id, query.selected_columns.sort_key)
+
+    rows, next_cursor = _fetch_page(session, query, limit, lambda row: row.id)
+    return ResultPage([row.id for row in rows], next_cursor)
+
+
+def _fetch_page(session, query, limit, row_id):
+    # Rows of a page of results and the cursor for the next page, if there is one
+    if limit is not None:
+        # Fetch one extra to find out if there is another page
+        query = query.limit(limit + 1)
+
+    rows = session.execute(query).all()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].sort_key, row_id(rows[-1]))
+    return rows, next_cursor
+
+
+def iter_documents(
+    session,
+    search_text=None,
+    sources=None,
+    tags=None,
+    *,
+    any_tags=None,
+    exclude_tags=None,
+    cursor=None,
+    batch_size=500,
+):
+    """
+    Iterate over every document matching the search criteria.
+
+    Documents are fetched a page at a time in a separate session on the same
+    engine and released after each page, so memory use doesn't grow with
+    the size of the store.
+
+    :param session: database session, its engine is used
+    :param search_text: text to match against the search index
+    :param sources: names of sources, documents must come from at least one
+    :param tags: names of tags the documents must all have
+    :param any_tags: names of tags, documents must have at least one
+    :param exclude_tags: names of tags the documents must not have
+    :param cursor: cursor to start from
+    :param batch_size: number of documents to fetch per query
+    :return: generator of Document
+    """
+    # A session of its own, so nothing the caller holds is detached
+    with Session(session.get_bind()) as own_session:
+        while True:
+            page = search_documents(
+                own_session,
+                search_text,
+                sources,
+                tags,
+                any_tags=any_tags,
+                exclude_tags=exclude_tags,
+                cursor=cursor,
+                limit=batch_size,
+            )
+            yield from page.documents
+            own_session.expunge_all()
+
+            if page.next_cursor is None:
+                break
+            cursor = page.next_cursor
+
+
+def iter_document_ids(
+    session,
+    search_text=None,
+    sources=None,
+    tags=None,
+    *,
+    any_tags=None,
+    exclude_tags=None,
+    cursor=None,
+    batch_size=500,
+):
+    """
+    Iterate over the ids of every document matching the search criteria.
+
+    Takes the same arguments as iter_documents, the ids come a batch at a
+    time so the documents can be loaded together, see serialize.document_dicts.
+
+    :return: generator of lists of document ids
+    """
+    while True:
+        page = search_ids(
+            session,
+            search_text,
+            sources,
+            tags,
+            any_tags=any_tags,
+            exclude_tags=exclude_tags,
+            cursor=cursor,
+            limit=batch_size,
+        )
+        if page.documents:
+            yield page.documents
+
+        if page.next_cursor is None:
+            break
+        cursor = page.next_cursor
@@ -0,0 +1,118 @@
+"""
+Serialise many documents at once.
+
+Document.to_dict goes through the ORM one document at a time, loading three
+relationships and formatting the dates in Python. For lists of documents the
+same dictionaries are built here from a few flat queries instead: one for the
+document columns, one each for the tag and source names and one for the files,
+joined up by document id. SQLite formats the dates.
+"""
+from collections import defaultdict
+
+from sqlalchemy import func, select
+
+from .models import (
+    Document,
+    File,
+    Source,
+    Tag,
+    associate_document_source,
+    associate_document_tag,
+)
+
+# Ids per query, well under SQLite's limit on the number of parameters
+chunk_size = 500
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), chunk_size):
+        yield ids[start : start + chunk_size]
+
+
+def named_rows(session, association, model, ids):
+    """
+    Tags or sources of documents
+
+    :param session: database session
+    :param association: association table between documents and the model
+    :param model: Tag or Source
+    :param ids: document ids
+    :return: {document_id: [(id, name), ...]} sorted by name
+    """
+    other_id = association.c[f"{model.__tablename__}_id"]
+    named = defaultdict(list)
+    for chunk in _chunks(ids):
+        query = (
+            select(association.c.document_id, model.id, model.name)
+            .join(model, model.id == other_id)
+            .where(association.c.document_id.in_(chunk))
+            .order_by(model.name)
+        )
+        for document_id, item_id, name in session.execute(query):
+            named[document_id].append((item_id, name))
+    return named
+
+
+def file_rows(session, ids, text=False):
+    """
+    Files of documents
+
+    :param session: database session
+    :param ids: document ids
+    :param text: include the extracted text of the files
+    :return: {document_id: [file dict, ...]} in the order they were added
+    """
+    columns = [File.id, File.path, File.original_name, File.sha256]
+    if text:
+        columns.append(File.text)
+    names = [column.key for column in columns]
+
+    files = defaultdict(list)
+    for chunk in _chunks(ids):
+        query = (
+            select(File.document_id, *columns)
+            .where(File.document_id.in_(chunk))
+            .order_by(File.id)
+        )
+        for document_id, *values in session.execute(query):
+            files[document_id].append(dict(zip(names, values)))
+    return files
+
+
+def document_dicts(session, ids):
+    """
+    Document.to_dict for many documents from a few flat queries
+
+    :param session: database session
+    :param ids: document ids
+    :return: {id: dict} for the documents that exist
+    """
+    documents = {}
+    for chunk in _chunks(ids):
+        query = select(
+            Document.id,
+            Document.title,
+            Document.description,
+            Document.location,
+            func.date(Document.date_added),
+            func.date(Document.date_received),
+        ).where(Document.id.in_(chunk))
+        for row in session.execute(query):
+            documents[row[0]] = {
+                "id": row[0],
+                "title": row[1],
+                "description": row[2],
+                "location": row[3],
+                "date_added": row[4],
+                "date_received": row[5],
+            }
+
+    tags = named_rows(session, associate_document_tag, Tag, documents)
+    sources = named_rows(session, associate_document_source, Source, documents)
+    files = file_rows(session, documents)
+    for doc_id, data in documents.items():
+        data["tags"] = [{"id": i, "name": name} for i, name in tags[doc_id]]
+        data["sources"] = [{"id": i, "name": name} for i, name in sources[doc_id]]
+        data["files"] = files[doc_id]
+    return documents
@@ -7,5 +7,17 @@ class DatabaseNotFoundError(Exception):
     pass
 
 
+class CheckpointError(Exception):
+    """Write-ahead log could not be written back into the database file"""
+
+
 class FileTypeError(Exception):
-    """Error for attempting to compress the wrong file type"""
+    """Error for attempting to compress or preview the wrong file type"""
+
+
+class SnapshotChainError(Exception):
+    """Incremental snapshot does not follow on from the previous snapshot"""
+
+
+class CatalogueFormatError(Exception):
+    """Catalogue file is in an unknown format or needs a library that is missing"""
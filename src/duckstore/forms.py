@@ -4,7 +4,6 @@ from wtforms import (
     StringField,
     MultipleFileField,
     SelectMultipleField,
-    SelectField,
     SubmitField,
     BooleanField,
     TextAreaField,
@@ -21,10 +20,18 @@ class MultipleTagField(SelectMultipleField):
         pass
 
 
+class SearchChoiceField(SelectMultipleField):
+    def process_formdata(self, valuelist):
+        # Links from before sources could be combined send an empty source
+        super().process_formdata([value for value in valuelist if value])
+
+
 class SearchForm(FlaskForm):
-    title = StringField("Title")
-    source = SelectField("Source")
-    tags = SelectMultipleField("Tags")
+    query = StringField("Search")
+    source = SearchChoiceField("Sources")  # Documents from any of these
+    tags = SearchChoiceField("All of these tags")
+    any_tags = SearchChoiceField("Any of these tags")
+    exclude_tags = SearchChoiceField("None of these tags")
     search = SubmitField("Search")
 
 
@@ -39,5 +46,6 @@ class DocumentForm(FlaskForm):
     tags = MultipleTagField("Tags")
     sources = MultipleTagField("Sources")
     files = MultipleFileField("Files")
+    uploads = HiddenField("Uploads")  # ids of files sent through the upload API
     compress_pdf = BooleanField("Compress PDFs")
     submit = SubmitField()
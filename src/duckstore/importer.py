@@ -0,0 +1,247 @@
+"""
+Import a folder tree of existing files as documents.
+
+Each file becomes a document. Folder names become tags, or the source at a
+chosen depth, and a regular expression over the file name can pick out the
+date received, title, a tag and a source.
+
+Files are hashed and copied (or hard linked) into the store on a pool of
+threads. The documents are then added a batch at a time, one transaction per
+batch, and their files queued for text extraction. Files whose contents are
+already in the store are skipped, so an import that was interrupted can be
+run again.
+"""
+import os
+import re
+import shutil
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from pathlib import Path
+
+from sqlalchemy import select
+from werkzeug.utils import secure_filename
+
+from .database.models import Document, File, Source, Tag, get_or_create_named
+from .storage import store_file
+from .uploads import hash_file
+
+# Dates like 2021-03-04, 2021_03_04 or 20210304 anywhere in the name
+default_pattern = r"(?P<date>(?:19|20)\d{2}[-_.]?[01]\d[-_.]?[0-3]\d)"
+
+ImportItem = namedtuple(
+    "ImportItem", ["path", "title", "date_received", "tags", "sources"]
+)
+ImportResult = namedtuple("ImportResult", ["imported", "duplicates", "compress"])
+
+
+def _parse_date(text):
+    digits = re.sub(r"\D", "", text)
+    try:
+        return datetime.strptime(digits, "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def describe_file(root, path, pattern=None, folder_tags=True, source_depth=None):
+    """
+    Work out the document details for a file from its name and folders
+
+    :param root: folder being imported
+    :param path: path to the file
+    :param pattern: regular expression searched for in the file name (without
+                    the suffix), the named groups date, title, tag and source
+                    are used if they match
+    :param folder_tags: use the names of the folders the file is in as tags
+    :param source_depth: use the folder at this depth below root as the source,
+                         1 for the top level folders
+    :return: ImportItem
+    """
+    path = Path(path)
+    folders = list(path.relative_to(root).parts[:-1])
+
+    sources = []
+    if source_depth and len(folders) >= source_depth:
+        sources.append(folders.pop(source_depth - 1))
+    tags = folders if folder_tags else []
+
+    title = path.stem
+    date_received = None
+    match = re.search(pattern or default_pattern, path.stem)
+    if match:
+        groups = match.groupdict()
+        if groups.get("date"):
+            date_received = _parse_date(groups["date"])
+        if groups.get("tag"):
+            tags.append(groups["tag"])
+        if groups.get("source"):
+            sources.append(groups["source"])
+        if groups.get("title"):
+            title = groups["title"]
+        else:
+            title = path.stem[: match.start()] + path.stem[match.end() :]
+
+    title = " ".join(re.sub(r"[_\-.]+", " ", title).split()) or path.stem
+    if date_received is None:
+        # Scans usually keep the date they were made
+        date_received = date.fromtimestamp(path.stat().st_mtime)
+
+    return ImportItem(path, title, date_received, tags, sources)
+
+
+def plan_import(root, pattern=None, folder_tags=True, source_depth=None):
+    """
+    Describe every file in a folder tree, hidden files and folders are skipped
+
+    :param root: folder to import
+    :param pattern: see describe_file
+    :param folder_tags: see describe_file
+    :param source_depth: see describe_file
+    :return: generator of ImportItem
+    """
+    root = Path(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith("."))
+        for filename in sorted(filenames):
+            if filename.startswith("."):
+                continue
+            yield describe_file(
+                root, Path(dirpath, filename), pattern, folder_tags, source_depth
+            )
+
+
+def _copy(source, link, sha256, outpath):
+    tmp_path = outpath.with_name(f".{outpath.name}.importing")
+    try:
+        if link:
+            os.link(source, tmp_path)
+        else:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, outpath)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return sha256
+
+
+def import_files(
+    db_session,
+    items,
+    store_folder,
+    *,
+    link=False,
+    content_addressed=False,
+    batch_size=200,
+    workers=4,
+    text_queue=None,
+    progress=None,
+):
+    """
+    Add files to the store as new documents
+
+    :param db_session: database session
+    :param items: ImportItem for each file
+    :param store_folder: store folder
+    :param link: hard link the files into the store instead of copying them,
+                 the store has to be on the same drive
+    :param content_addressed: store the files as blobs named by their hash
+    :param batch_size: number of documents added in each transaction
+    :param workers: number of files copied at the same time
+    :param text_queue: TextExtractionQueue to extract the text of the new files
+    :param progress: function called with (done, total) bytes as files are added
+    :return: ImportResult with the number of documents imported, the paths
+             skipped as duplicates and (file_id, path) of the PDFs stored
+    """
+    items = list(items)
+    total = sum(item.path.stat().st_size for item in items)
+    done = 0
+    imported, duplicates, compress = 0, [], []
+    seen = set()
+
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="duckstore_import"
+    ) as executor:
+        for start in range(0, len(items), batch_size):
+            batch = items[start : start + batch_size]
+            hashes = list(executor.map(lambda item: hash_file(item.path), batch))
+
+            # Skip anything already in the store, or earlier in this import
+            query = select(File.sha256).where(File.sha256.in_(set(hashes)))
+            seen.update(db_session.execute(query).scalars())
+            new_items = []
+            for item, sha256 in zip(batch, hashes):
+                if sha256 in seen:
+                    duplicates.append(item.path)
+                else:
+                    seen.add(sha256)
+                    new_items.append((item, sha256))
+
+            def store(item_hash):
+                item, sha256 = item_hash
+                outpath, _, created = store_file(
+                    store_folder,
+                    secure_filename(item.path.name) or "file",
+                    lambda outpath: _copy(item.path, link, sha256, outpath),
+                    content_addressed,
+                )
+                return outpath, created
+
+            stored = list(executor.map(store, new_items))
+            try:
+                files = _add_documents(db_session, store_folder, new_items, stored)
+            except Exception:
+                db_session.rollback()
+                for outpath, created in stored:
+                    if created:
+                        outpath.unlink(missing_ok=True)
+                raise
+
+            imported += len(files)
+            if text_queue is not None:
+                for db_file in files:
+                    text_queue.submit(db_file.id)
+            compress.extend(
+                (db_file.id, outpath)
+                for db_file, (outpath, _) in zip(files, stored)
+                if outpath.suffix.lower() == ".pdf"
+            )
+            done += sum(item.path.stat().st_size for item in batch)
+            if progress:
+                progress(done, total)
+
+    return ImportResult(imported, duplicates, compress)
+
+
+def _lookup(named, names):
+    # Tags or sources for a list of names in order, without blanks or repeats
+    return list(dict.fromkeys(named[name.strip()] for name in names if name.strip()))
+
+
+def _add_documents(db_session, store_folder, new_items, stored):
+    # Add one batch of documents in a single transaction
+    tag_names = {name for item, _ in new_items for name in item.tags}
+    source_names = {name for item, _ in new_items for name in item.sources}
+    tags = {tag.name: tag for tag in get_or_create_named(db_session, Tag, tag_names)}
+    sources = {
+        source.name: source
+        for source in get_or_create_named(db_session, Source, source_names)
+    }
+
+    files = []
+    today = datetime.today()
+    for (item, sha256), (outpath, _) in zip(new_items, stored):
+        document = Document(
+            title=item.title, date_received=item.date_received, date_added=today
+        )
+        document.tags = _lookup(tags, item.tags)
+        document.sources = _lookup(sources, item.sources)
+        db_file = File(
+            path=str(outpath.relative_to(store_folder)),
+            original_name=secure_filename(item.path.name),
+            sha256=sha256,
+        )
+        document.files.append(db_file)
+        db_session.add(document)
+        files.append(db_file)
+
+    db_session.commit()
+    return files
@@ -0,0 +1,302 @@
+"""
+Background jobs that shouldn't hold up a request.
+
+PDF compression runs ghostscript which can take a while for large scans,
+so uploads are saved as-is and compressed in a worker pool afterwards.
+The compressed file replaces the upload in a single rename so a download
+never sees a partly written file.
+
+Text for the search index is extracted in another pool. Each file records the
+hash of the contents its text came from, so a file is only read again if its
+contents change, and files with the same contents share the text.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from flask import current_app
+from sqlalchemy import or_, select, update
+
+from .database import db_session
+from .database.models import File
+from .storage import rehash_file
+from .uploads import hash_file
+from .util.extract_text import extract_text
+from .util.optimize_pdf import compress_pdf
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """
+    Run jobs for stored files in a pool of worker threads, keeping their status
+
+    :param workers: maximum number of jobs run at the same time
+    :param keep_finished: number of finished job statuses to remember
+    :param name: name given to the worker threads
+    """
+
+    def __init__(self, workers=2, keep_finished=1000, name="duckstore_job"):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.keep_finished = keep_finished
+        self._lock = threading.Lock()
+        self._status = OrderedDict()
+
+    def status(self, file_id):
+        """
+        Get the state of the job for a file
+
+        :param file_id: id of the File row
+        :return: {"state": ..., "message": ...} or None if no job is known
+        """
+        with self._lock:
+            return self._status.get(file_id)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def _set_status(self, file_id, state, message=""):
+        with self._lock:
+            self._status[file_id] = {"state": state, "message": message}
+            self._status.move_to_end(file_id)
+
+            # Forget the oldest finished jobs, queued and running ones are kept
+            finished = [
+                key
+                for key, value in self._status.items()
+                if value["state"] in (DONE, FAILED)
+            ]
+            for key in finished[: max(len(finished) - self.keep_finished, 0)]:
+                del self._status[key]
+
+
+class CompressionQueue(JobQueue):
+    """
+    Compress stored PDFs in a pool of worker threads
+
+    The work happens in a ghostscript subprocess so threads are enough to
+    compress several files at once.
+
+    :param workers: maximum number of files to compress at the same time
+    :param keep_finished: number of finished job statuses to remember
+    :param on_replace: function called with (file_id, path) after a file
+                       has been replaced by its compressed version
+    """
+
+    def __init__(self, workers=2, keep_finished=1000, on_replace=None):
+        super().__init__(workers, keep_finished, name="duckstore_compress")
+        self.on_replace = on_replace
+
+    def submit(self, file_id, path, power=2, after=None):
+        """
+        Queue a stored file for compression
+
+        :param file_id: id of the File row, used to look up the status
+        :param path: full path to the stored PDF
+        :param power: compression level for compress_pdf
+        :param after: Future of another job on the file to wait for, such as
+                      reading its text, the file is only compressed once it's done
+        :return: Future for the job
+        """
+        self._set_status(file_id, QUEUED)
+        if after is None:
+            return self.executor.submit(self._compress, file_id, Path(path), power)
+
+        future = Future()
+
+        def start(_):
+            job = self.executor.submit(self._compress, file_id, Path(path), power)
+            job.add_done_callback(lambda done: future.set_result(done.result()))
+
+        after.add_done_callback(start)
+        return future
+
+    def _compress(self, file_id, path, power):
+        self._set_status(file_id, RUNNING)
+        # Write next to the original so the final rename stays on one filesystem
+        tmp_path = path.with_name(f".{path.name}.compressing")
+        try:
+            result = compress_pdf(path, tmp_path, power=power)
+            if result.returncode != 0:
+                self._set_status(
+                    file_id, FAILED, f"Ghostscript exited with {result.returncode}"
+                )
+            elif not path.is_file():
+                # Removed while it was being compressed, don't bring it back
+                self._set_status(file_id, FAILED, "File was removed")
+            else:
+                os.replace(tmp_path, path)
+                if self.on_replace:
+                    self.on_replace(file_id, path)
+                self._set_status(file_id, DONE)
+        except Exception as exc:
+            self._set_status(file_id, FAILED, str(exc))
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+
+class TextExtractionQueue(JobQueue):
+    """
+    Extract the text of stored files in a pool of worker threads
+
+    Only max_queued files wait for a worker, submitting more blocks until
+    there is room, so a large import can't queue up the whole store.
+
+    :param store_folder: store folder
+    :param workers: maximum number of files read at the same time
+    :param max_queued: number of files that can wait for a worker
+    :param ocr: read scanned pages and images with OCR, if it is available
+    :param keep_finished: number of finished job statuses to remember
+    """
+
+    def __init__(
+        self, store_folder, workers=2, max_queued=100, ocr=True, keep_finished=1000
+    ):
+        super().__init__(workers, keep_finished, name="duckstore_text")
+        self.store_folder = Path(store_folder)
+        self.ocr = ocr
+        self._slots = threading.BoundedSemaphore(workers + max_queued)
+        self._pending = 0
+        self._idle = threading.Condition()
+
+    def submit(self, file_id):
+        """
+        Queue a stored file for text extraction, waiting if the queue is full
+
+        :param file_id: id of the File row
+        :return: Future for the job
+        """
+        self._slots.acquire()
+        with self._idle:
+            self._pending += 1
+        self._set_status(file_id, QUEUED)
+        return self.executor.submit(self._extract, file_id)
+
+    def wait(self):
+        """
+        Wait until every submitted file has been handled
+        """
+        with self._idle:
+            self._idle.wait_for(lambda: self._pending == 0)
+
+    def _extract(self, file_id):
+        self._set_status(file_id, RUNNING)
+        try:
+            found = extract_file_text(db_session, self.store_folder, file_id, self.ocr)
+            if found is None:
+                self._set_status(file_id, FAILED, "File was removed")
+            else:
+                self._set_status(file_id, DONE)
+        except Exception as exc:
+            self._set_status(file_id, FAILED, str(exc))
+        finally:
+            db_session.remove()
+            self._slots.release()
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
+
+
+def extract_file_text(session, store_folder, file_id, ocr=True):
+    """
+    Store the text of a file, unless it is already known for its contents
+
+    Text is reused from any file with the same hash, otherwise the file is read.
+    The text is only saved if the file wasn't replaced in the meantime. If the
+    file can't be read nothing is saved, so it is tried again next time. Files
+    without a hash are hashed first and the hash is saved along with the text.
+
+    :param session: database session
+    :param store_folder: store folder
+    :param file_id: id of the File row
+    :param ocr: read scanned pages and images with OCR, if it is available
+    :return: True if text was stored, False if it was already current,
+             None if there is no such file
+    :raises OSError: if the file can't be read, or the other errors of extract_text
+    """
+    db_file = session.get(File, file_id)
+    if db_file is None:
+        return None
+
+    sha256 = db_file.sha256
+    if sha256 is None:
+        # Stored before files were hashed, the text needs a hash to belong to
+        unchanged = File.sha256.is_(None)
+        sha256 = hash_file(db_file.full_path(store_folder))
+    elif db_file.text_sha256 == sha256:
+        return False
+    else:
+        unchanged = File.sha256 == sha256
+
+    known = session.execute(
+        select(File.text)
+        .where(File.sha256 == sha256, File.text_sha256 == sha256)
+        .limit(1)
+    ).first()
+    if known is not None:
+        text = known.text
+    else:
+        text = extract_text(db_file.full_path(store_folder), ocr=ocr)
+
+    result = session.execute(
+        update(File)
+        .where(File.id == file_id, unchanged)
+        .values(sha256=sha256, text=text, text_sha256=sha256)
+    )
+    session.commit()
+    return bool(result.rowcount)
+
+
+def missing_text_ids(session):
+    """
+    Get the ids of files whose text hasn't been extracted from their contents
+
+    :param session: database session
+    :return: list of file ids
+    """
+    query = (
+        select(File.id)
+        .where(or_(File.text_sha256.is_(None), File.text_sha256 != File.sha256))
+        .order_by(File.id)
+    )
+    return session.execute(query).scalars().all()
+
+
+def get_compression_queue():
+    """
+    Get the compression queue for the current app
+    """
+    return current_app.extensions["duckstore_compression"]
+
+
+def get_text_queue():
+    """
+    Get the text extraction queue for the current app
+    """
+    return current_app.extensions["duckstore_text"]
+
+
+def update_file_hash(store_folder, file_id, path, results=None, text_queue=None):
+    """
+    Record the new hash of a stored file after it was compressed
+
+    :param store_folder: store folder
+    :param file_id: id of the File row
+    :param path: full path to the stored file
+    :param results: ResultCache holding the JSON of the documents using the file
+    :param text_queue: TextExtractionQueue to check the text of the file again,
+                       in case an extraction of the old contents was interrupted
+    """
+    try:
+        document_ids = rehash_file(db_session, store_folder, file_id)
+    finally:
+        db_session.remove()
+    if results is not None:
+        results.invalidate_documents(document_ids)
+    if text_queue is not None:
+        text_queue.submit(file_id)
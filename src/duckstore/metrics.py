@@ -0,0 +1,295 @@
+"""
+Where request time goes: SQL, templates and ghostscript.
+
+When METRICS_ENABLED is set every request is timed, along with the SQL
+statements it runs (through engine events), the templates it renders and any
+ghostscript subprocesses. Totals are served in the Prometheus text format at
+/metrics. Setting SLOW_REQUEST_SECONDS logs a breakdown of each request that
+takes longer, anything not covered by the other figures is disk and Python.
+
+Ghostscript mostly runs in the background compression threads, that time is
+counted in the subprocess totals but not against a request.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from flask import Response, before_render_template, request, template_rendered
+from sqlalchemy import event
+
+# Upper bounds of the request duration histogram in seconds
+duration_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+metric_info = {
+    "duckstore_requests_total": ("counter", "Requests handled"),
+    "duckstore_request_duration_seconds": ("histogram", "Time taken by requests"),
+    "duckstore_request_sql_statements_total": (
+        "counter",
+        "SQL statements run by requests",
+    ),
+    "duckstore_request_sql_seconds_total": ("counter", "Time requests spent in SQL"),
+    "duckstore_request_template_seconds_total": (
+        "counter",
+        "Time requests spent rendering templates",
+    ),
+    "duckstore_sql_statements_total": ("counter", "SQL statements run"),
+    "duckstore_sql_seconds_total": ("counter", "Time spent running SQL statements"),
+    "duckstore_subprocess_runs_total": ("counter", "Ghostscript runs"),
+    "duckstore_subprocess_seconds_total": ("counter", "Time spent in ghostscript"),
+}
+
+# Figures for the request being handled in the current thread
+_request_stats = ContextVar("duckstore_request_stats", default=None)
+
+
+class RequestStats:
+    """
+    Time spent by one request
+    """
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.subprocess_seconds = 0.0
+        self.template_start = None
+        self.status = None
+
+
+class Metrics:
+    """
+    Counters and histograms shared by every thread, with labels
+    """
+
+    def __init__(self, buckets=duration_buckets):
+        self.enabled = False
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            counts = self._histograms.get(key)
+            if counts is None:
+                # A count for each bucket then the sum and the total count
+                counts = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """
+        Everything recorded in the Prometheus text format
+
+        :return: str
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, list(v)) for k, v in self._histograms.items())
+
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described:
+                described.add(name)
+                kind, help_text = metric_info.get(name, ("untyped", name))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+        for (name, labels), counts in histograms:
+            describe(name)
+            for bound, count in zip(self.buckets, counts):
+                bucket_labels = _format_labels((*labels, ("le", f"{bound:g}")))
+                lines.append(f"{name}_bucket{bucket_labels} {count}")
+            lines.append(
+                f"{name}_bucket{_format_labels((*labels, ('le', '+Inf')))} {counts[-1]}"
+            )
+            lines.append(f"{name}_sum{_format_labels(labels)} {counts[-2]:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {counts[-1]}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def time_subprocess(task):
+    """
+    Count the time spent in a subprocess, if metrics are enabled
+
+    :param task: label for what the subprocess is doing
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        if metrics.enabled:
+            elapsed = perf_counter() - start
+            metrics.inc("duckstore_subprocess_runs_total", task=task)
+            metrics.inc("duckstore_subprocess_seconds_total", elapsed, task=task)
+            stats = _request_stats.get()
+            if stats is not None:
+                stats.subprocess_seconds += elapsed
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._duckstore_start = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - context._duckstore_start
+    metrics.inc("duckstore_sql_statements_total")
+    metrics.inc("duckstore_sql_seconds_total", elapsed)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.sql_statements += 1
+        stats.sql_seconds += elapsed
+
+
+def _before_render(sender, template, context, **extra):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.template_start = perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    stats = _request_stats.get()
+    if stats is not None and stats.template_start is not None:
+        stats.template_seconds += perf_counter() - stats.template_start
+        stats.template_start = None
+
+
+def _start_request():
+    _request_stats.set(RequestStats())
+
+
+def _set_status(response):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.status = response.status_code
+    return response
+
+
+def _finish_request(app):
+    # Runs when the request context ends, after any streamed response is sent
+    def finish(exc):
+        stats = _request_stats.get()
+        if stats is None:
+            return
+        _request_stats.set(None)
+
+        elapsed = perf_counter() - stats.start
+        endpoint = request.endpoint or "unknown"
+        status = stats.status or 500
+        metrics.inc(
+            "duckstore_requests_total",
+            endpoint=endpoint,
+            method=request.method,
+            status=status,
+        )
+        metrics.observe(
+            "duckstore_request_duration_seconds", elapsed, endpoint=endpoint
+        )
+        metrics.inc(
+            "duckstore_request_sql_statements_total",
+            stats.sql_statements,
+            endpoint=endpoint,
+        )
+        metrics.inc(
+            "duckstore_request_sql_seconds_total", stats.sql_seconds, endpoint=endpoint
+        )
+        metrics.inc(
+            "duckstore_request_template_seconds_total",
+            stats.template_seconds,
+            endpoint=endpoint,
+        )
+
+        slow = app.config["SLOW_REQUEST_SECONDS"]
+        if slow is not None and elapsed >= slow:
+            other = elapsed - (
+                stats.sql_seconds + stats.template_seconds + stats.subprocess_seconds
+            )
+            app.logger.warning(
+                "Slow request %s %s (%s) took %.3fs: "
+                "%d SQL statements %.3fs, templates %.3fs, "
+                "ghostscript %.3fs, other %.3fs",
+                request.method,
+                request.full_path.rstrip("?"),
+                status,
+                elapsed,
+                stats.sql_statements,
+                stats.sql_seconds,
+                stats.template_seconds,
+                stats.subprocess_seconds,
+                other,
+            )
+
+    return finish
+
+
+def metrics_view():
+    """
+    Prometheus text format of everything recorded so far
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def init_metrics(app, engine):
+    """
+    Instrument an app and its database engine
+
+    Does nothing unless METRICS_ENABLED or SLOW_REQUEST_SECONDS is set.
+    /metrics is only added with METRICS_ENABLED.
+
+    :param app: flask app
+    :param engine: sqlalchemy engine used by the app
+    """
+    enabled = app.config["METRICS_ENABLED"]
+    if not enabled and app.config["SLOW_REQUEST_SECONDS"] is None:
+        return
+
+    metrics.enabled = True
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    app.before_request(_start_request)
+    app.after_request(_set_status)
+    app.teardown_request(_finish_request(app))
+
+    if enabled:
+        app.add_url_rule("/metrics", "metrics", metrics_view)
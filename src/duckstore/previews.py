@@ -0,0 +1,157 @@
+"""
+Cache of thumbnail previews for stored files.
+
+Thumbnails are rendered the first time they are asked for and kept in a
+folder next to the store. They are named by the hash of the file they show,
+so a file that is replaced (by compression for instance) gets a new thumbnail
+and the old one ages out. The folder is kept under a size limit by removing
+the least recently used thumbnails, the modification time of each thumbnail
+is updated whenever it is used.
+"""
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+from flask import current_app
+
+from .exceptions import FileTypeError
+from .util.thumbnail import render_thumbnail
+
+thumbnail_folder_name = ".thumbnails"
+
+
+class ThumbnailCache:
+    """
+    Render and keep thumbnails of stored files within a size limit
+
+    :param folder: folder to keep the thumbnails in
+    :param max_bytes: total size of thumbnails to keep
+    :param width: width of the thumbnails in pixels
+    :param workers: number of thumbnails rendered at the same time in the background
+    :param render: function called with (input_path, output_path, width)
+    """
+
+    def __init__(
+        self, folder, max_bytes=200 * 1024**2, width=200, workers=1, render=None
+    ):
+        self.folder = Path(folder)
+        self.folder.mkdir(exist_ok=True)
+        self.max_bytes = max_bytes
+        self.width = width
+        self.render = render or render_thumbnail
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="duckstore_thumbnail"
+        )
+
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._failed = set()  # Keys of files that have no preview
+        self._total = sum(pth.stat().st_size for pth in self.folder.glob("*.png"))
+
+    def thumbnail_path(self, key):
+        return self.folder / f"{key}_{self.width}.png"
+
+    def get(self, path, key):
+        """
+        Get the thumbnail of a file, rendering it if it isn't cached
+
+        :param path: full path to the stored file
+        :param key: identifies the contents of the file, its SHA-256
+        :return: path to the PNG or None if the file has no preview
+        """
+        thumbnail = self.thumbnail_path(key)
+        if self._touch(thumbnail):
+            return thumbnail
+        if key in self._failed:
+            return None
+
+        # Only render each thumbnail once when it is asked for several times
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                if self._touch(thumbnail):
+                    return thumbnail
+                return self._render(path, key, thumbnail)
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+
+    def warm(self, path, key):
+        """
+        Render a thumbnail in the background so it's ready when first shown
+
+        :param path: full path to the stored file
+        :param key: identifies the contents of the file, its SHA-256
+        :return: Future for the job
+        """
+        return self.executor.submit(self.get, path, key)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def _touch(self, thumbnail):
+        # Mark a thumbnail as recently used, False if it doesn't exist
+        try:
+            os.utime(thumbnail)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _render(self, path, key, thumbnail):
+        with NamedTemporaryFile(
+            dir=self.folder, suffix=".rendering", delete=False
+        ) as tmp:
+            tmp_path = Path(tmp.name)
+        try:
+            self.render(path, tmp_path, self.width)
+            size = tmp_path.stat().st_size
+            os.replace(tmp_path, thumbnail)
+        except FileTypeError:
+            # Don't keep trying files that can't be previewed on every page
+            with self._lock:
+                if len(self._failed) > 10000:
+                    self._failed.clear()
+                self._failed.add(key)
+            return None
+        except (OSError, subprocess.CalledProcessError):
+            # Could be a file still being written or a full disk, try again later
+            return None
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+        with self._lock:
+            self._total += size
+            if self._total > self.max_bytes:
+                self._evict(keep=thumbnail)
+        return thumbnail
+
+    def _evict(self, keep):
+        # Remove the least recently used thumbnails until under the limit
+        thumbnails = []
+        for pth in self.folder.glob("*.png"):
+            try:
+                stat = pth.stat()
+            except FileNotFoundError:
+                continue
+            thumbnails.append((stat.st_mtime, stat.st_size, pth))
+        thumbnails.sort()
+
+        self._total = sum(size for _, size, _ in thumbnails)
+        for _, size, pth in thumbnails:
+            if self._total <= self.max_bytes:
+                break
+            if pth == keep:
+                continue
+            pth.unlink(missing_ok=True)
+            self._total -= size
+
+
+def get_thumbnail_cache():
+    """
+    Get the thumbnail cache for the current app
+    """
+    return current_app.extensions["duckstore_thumbnails"]
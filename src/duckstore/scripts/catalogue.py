@@ -0,0 +1,127 @@
+from pathlib import Path
+
+import click
+
+from duckstore.catalogue import (
+    catalogue_format,
+    export_catalogue,
+    import_catalogue,
+    read_catalogue,
+    write_catalogue,
+)
+from duckstore.config import db_name
+from duckstore.database import db_session, bind_session, create_db, upgrade_db
+from duckstore.exceptions import CatalogueFormatError
+
+format_option = click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(["jsonl", "parquet"]),
+    help="File format, defaults to the one matching the file's suffix.",
+)
+batch_size_option = click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=500,
+    show_default=True,
+    help="Number of documents handled at a time.",
+)
+
+
+def _check_format(path, fmt):
+    try:
+        return catalogue_format(path, fmt)
+    except CatalogueFormatError as exc:
+        raise click.ClickException(str(exc))
+
+
+@click.command("export")
+@click.argument(
+    "folder",
+    type=click.Path(
+        resolve_path=True, path_type=Path, dir_okay=True, file_okay=False, exists=True
+    ),
+)
+@click.argument(
+    "output", type=click.Path(resolve_path=True, path_type=Path, dir_okay=False)
+)
+@format_option
+@batch_size_option
+def export_command(folder, output, fmt, batch_size):
+    """
+    Export the catalogue of the duckstore FOLDER to OUTPUT.
+
+    OUTPUT is written as JSON Lines (.jsonl) or Parquet (.parquet), with
+    one record for each document. The stored files aren't included.
+    """
+    fmt = _check_format(output, fmt)
+    db_path = folder / db_name
+    if not db_path.is_file():
+        raise click.ClickException(f"Database not found at {db_path}")
+
+    upgrade_db(db_path)
+    bind_session(db_path)
+    try:
+        count = write_catalogue(
+            export_catalogue(db_session, batch_size), output, fmt, batch_size
+        )
+    finally:
+        db_session.remove()
+    click.echo(f"Exported {count} documents to {output}")
+
+
+@click.command("import-catalogue")
+@click.argument(
+    "folder",
+    type=click.Path(resolve_path=True, path_type=Path, dir_okay=True, file_okay=False),
+)
+@click.argument(
+    "catalogue",
+    type=click.Path(
+        resolve_path=True, path_type=Path, dir_okay=False, file_okay=True, exists=True
+    ),
+)
+@click.option(
+    "--create", is_flag=True, help="Create a new store at FOLDER if there isn't one."
+)
+@click.option(
+    "--new-ids",
+    is_flag=True,
+    help="Give the documents new ids, for adding them to a store that's in use. "
+    "Documents are then matched on their files, or on their title and dates if "
+    "they have none, to skip those already added.",
+)
+@format_option
+@batch_size_option
+def import_catalogue_command(folder, catalogue, create, new_ids, fmt, batch_size):
+    """
+    Add the documents in an exported CATALOGUE to the duckstore FOLDER.
+
+    Copy the files from the old store folder into the new one as well, the
+    catalogue only has their paths. Documents already in the store are
+    skipped so this can be run again after it is interrupted.
+    """
+    fmt = _check_format(catalogue, fmt)
+    db_path = folder / db_name
+    if db_path.is_file():
+        upgrade_db(db_path)
+    elif create:
+        folder.mkdir(parents=True, exist_ok=True)
+        create_db(db_path)
+    else:
+        raise click.ClickException(f"Database not found at {db_path}, use --create.")
+
+    bind_session(db_path)
+    try:
+        result = import_catalogue(
+            db_session,
+            read_catalogue(catalogue, fmt, batch_size),
+            keep_ids=not new_ids,
+            batch_size=batch_size,
+        )
+    finally:
+        db_session.remove()
+    click.echo(
+        f"Imported {result.imported} documents, "
+        f"skipped {result.skipped} already in the store."
+    )
@@ -0,0 +1,43 @@
+"""
+The duckstore command.
+
+Running duckstore without a subcommand launches the store, so the launch
+options can be given directly (duckstore --folder ...).
+"""
+import click
+
+from .catalogue import export_command, import_catalogue_command
+from .importer import import_folder
+from .launcher import launch
+from .snapshot import snapshot
+from .text import extract_text_command
+
+
+class DefaultGroup(click.Group):
+    """Group that runs a default command if no subcommand is given"""
+
+    def __init__(self, *args, default_command=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands and args[0] != "--help"):
+            args = [self.default_command, *args]
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultGroup, default_command="launch")
+def cli():
+    """Document store for personal documents"""
+
+
+cli.add_command(launch)
+cli.add_command(snapshot)
+cli.add_command(import_folder)
+cli.add_command(export_command)
+cli.add_command(import_catalogue_command)
+cli.add_command(extract_text_command)
+
+
+if __name__ == "__main__":
+    cli()
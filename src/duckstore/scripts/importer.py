@@ -0,0 +1,163 @@
+from functools import partial
+from pathlib import Path
+
+import click
+
+from duckstore.config import db_name, store_name
+from duckstore.database import db_session, bind_session, create_db, upgrade_db
+from duckstore.importer import import_files, plan_import
+from duckstore.jobs import (
+    CompressionQueue,
+    FAILED,
+    TextExtractionQueue,
+    update_file_hash,
+)
+from .progress import progress_printer
+from .text import ocr_option
+
+
+@click.command("import")
+@click.argument(
+    "folder",
+    type=click.Path(resolve_path=True, path_type=Path, dir_okay=True, file_okay=False),
+)
+@click.argument(
+    "source",
+    type=click.Path(
+        resolve_path=True, path_type=Path, dir_okay=True, file_okay=False, exists=True
+    ),
+)
+@click.option(
+    "--create", is_flag=True, help="Create a new store at FOLDER if there isn't one."
+)
+@click.option(
+    "--pattern",
+    help="Regular expression for file names, the named groups date, title, tag "
+    "and source are used. Defaults to finding a date like 2021-03-04.",
+)
+@click.option(
+    "--folder-tags/--no-folder-tags",
+    default=True,
+    show_default=True,
+    help="Tag documents with the names of the folders they are in.",
+)
+@click.option(
+    "--source-depth",
+    type=click.IntRange(min=1),
+    help="Use the folder at this depth as the source, 1 for the top level folders.",
+)
+@click.option(
+    "--link",
+    is_flag=True,
+    help="Hard link files into the store instead of copying, needs the same drive.",
+)
+@click.option(
+    "--content-addressed",
+    is_flag=True,
+    help="Store the files by content hash.",
+)
+@click.option("--compress", is_flag=True, help="Compress the imported PDFs.")
+@ocr_option
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of files copied, read or compressed at the same time.",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=200,
+    show_default=True,
+    help="Number of documents added in each transaction.",
+)
+@click.option("--dry-run", is_flag=True, help="Show what would be imported and stop.")
+def import_folder(
+    folder,
+    source,
+    create,
+    pattern,
+    folder_tags,
+    source_depth,
+    link,
+    content_addressed,
+    compress,
+    ocr,
+    workers,
+    batch_size,
+    dry_run,
+):
+    """
+    Import every file under SOURCE into the duckstore FOLDER as a document.
+
+    Files already in the store are skipped so an import can be run again
+    after it is interrupted.
+    """
+    items = list(plan_import(source, pattern, folder_tags, source_depth))
+
+    if dry_run:
+        for item in items:
+            click.echo(
+                f"{item.path.relative_to(source)}: {item.title} "
+                f"({item.date_received}) "
+                f"tags: {', '.join(item.tags) or '-'} "
+                f"sources: {', '.join(item.sources) or '-'}"
+            )
+        click.echo(f"{len(items)} files would be imported.")
+        return
+
+    db_path = folder / db_name
+    if db_path.is_file():
+        upgrade_db(db_path)
+    elif create:
+        create_db(db_path)
+    else:
+        raise click.ClickException(f"Database not found at {db_path}, use --create.")
+
+    store_folder = folder / store_name
+    store_folder.mkdir(exist_ok=True)
+    bind_session(db_path)
+
+    text_queue = TextExtractionQueue(store_folder, workers=workers, ocr=ocr)
+    result = import_files(
+        db_session,
+        items,
+        store_folder,
+        link=link,
+        content_addressed=content_addressed,
+        batch_size=batch_size,
+        workers=workers,
+        text_queue=text_queue,
+        progress=progress_printer("Importing"),
+    )
+    # Read the text before compressing, scans are clearer for OCR
+    click.echo("Waiting for text extraction to finish.")
+    text_queue.wait()
+    text_queue.shutdown()
+    click.echo(
+        f"Imported {result.imported} documents, "
+        f"skipped {len(result.duplicates)} files already in the store."
+    )
+
+    if compress and result.compress:
+        click.echo(f"Compressing {len(result.compress)} PDFs.")
+        queue = CompressionQueue(
+            workers=workers,
+            keep_finished=len(result.compress),
+            on_replace=partial(update_file_hash, store_folder),
+        )
+        for file_id, path in result.compress:
+            queue.submit(file_id, path)
+        queue.shutdown(wait=True)
+
+        failed = [
+            path
+            for file_id, path in result.compress
+            if queue.status(file_id)["state"] == FAILED
+        ]
+        for path in failed:
+            click.echo(f"Could not compress {path.name}")
+        click.echo(f"Compressed {len(result.compress) - len(failed)} PDFs.")
+
+    db_session.remove()
@@ -1,13 +1,74 @@
 from code import InteractiveConsole
 from pathlib import Path
 import sys
+import threading
 
 import click
 
 
-from duckstore.config import db_name
-from duckstore.util import get_archive_dialog, get_folder_dialog, extract_archive
+from duckstore.config import Config, db_name
+from duckstore.util import (
+    get_archive_dialog,
+    get_folder_dialog,
+    extract_database,
+    extract_files,
+)
 from duckstore.app import create_app
+from duckstore.database import upgrade_db
+from .progress import progress_printer
+
+
+def restore_store(archive, folder, password, deltas):
+    """
+    Extract the database from a snapshot, then the stored files in the background
+    so the store can be used while they are extracted.
+
+    :return: the thread extracting the files
+    """
+    chain = extract_database(
+        archive,
+        folder,
+        password,
+        deltas=deltas,
+        progress=progress_printer("Extracting database"),
+    )
+    click.echo(f"Extracted database to {folder}, extracting files in the background.")
+
+    def extract():
+        extract_files(chain, folder, password)
+        click.echo(f"Finished extracting files to {folder}")
+
+    thread = threading.Thread(target=extract, name="duckstore_extract")
+    thread.start()
+    return thread
+
+
+def run_server(app, host=None, port=None, threads=8):
+    """
+    Serve the app with waitress
+
+    One process with a pool of request threads. The caches, compression queue
+    and thumbnail renderer all live in the process, so it isn't split into
+    several worker processes. Ghostscript runs in subprocesses and SQLite
+    only allows one writer at a time, so threads are enough to keep requests
+    from waiting on each other.
+
+    :param app: flask app
+    :param host: address to listen on
+    :param port: port to listen on
+    :param threads: number of request threads
+    """
+    try:
+        from waitress import serve
+    except ImportError:
+        raise click.ClickException(
+            "waitress is needed for --serve, install it with pip install duckstore[serve]"
+        )
+
+    host = host or "127.0.0.1"
+    port = port or 5000
+    click.echo(f"Serving on http://{host}:{port} with {threads} threads")
+    serve(app, host=host, port=port, threads=threads)
 
 
 @click.command()
@@ -27,8 +88,61 @@ from duckstore.app import create_app
 @click.option(
     "--shell", is_flag=True, help="Launch into a shell instead of the web server."
 )
+@click.option(
+    "--delta",
+    "deltas",
+    multiple=True,
+    type=click.Path(resolve_path=True, path_type=Path, file_okay=True, exists=True),
+    help="Incremental snapshot to apply after the archive, repeat in order taken.",
+)
 @click.option("--password", help="Password if the 7z archive is encrypted.")
-def launch(folder, create, archive, shell, password):
+@click.option(
+    "--content-addressed",
+    is_flag=True,
+    help="Store new files by content hash so duplicate uploads are kept once.",
+)
+@click.option(
+    "--serve",
+    is_flag=True,
+    help="Run under the waitress server instead of the flask development server.",
+)
+@click.option("--host", help="Address to listen on, defaults to 127.0.0.1.")
+@click.option("--port", type=int, help="Port to listen on, defaults to 5000.")
+@click.option(
+    "--threads",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="Number of requests handled at the same time with --serve.",
+)
+@click.option(
+    "--metrics",
+    is_flag=True,
+    help="Time requests, SQL and ghostscript and serve the totals at /metrics.",
+)
+@click.option(
+    "--slow-request",
+    type=click.FloatRange(min=0),
+    help="Log where the time went for requests taking longer than this (seconds).",
+)
+def launch(
+    folder,
+    create,
+    archive,
+    deltas,
+    shell,
+    password,
+    content_addressed,
+    serve,
+    host,
+    port,
+    threads,
+    metrics,
+    slow_request,
+):
+    """
+    Launch the web interface for a duckstore folder (the default command).
+    """
     if folder:
         db_path = folder / db_name
     else:
@@ -63,8 +177,7 @@ def launch(folder, create, archive, shell, password):
                 )
                 if password == "":
                     password = None
-            extract_archive(archive, folder, password)
-            click.echo(f"Extracted project to {folder}")
+            restore_store(archive, folder, password, deltas)
         else:
             choice = click.prompt(
                 "Create new duckstore or load from archive: ",
@@ -88,8 +201,17 @@ def launch(folder, create, archive, shell, password):
                 )
                 if password == "":
                     password = None
-                extract_archive(archive, folder, password)
-                click.echo(f"Extracted project to {folder}")
+                restore_store(archive, folder, password, deltas)
+
+    if db_path.is_file():
+        # Bring stores made by older versions up to date before using them
+        upgraded = upgrade_db(db_path)
+        if upgraded:
+            old_revision, new_revision = upgraded
+            click.echo(
+                f"Database upgraded from revision {old_revision or 'unversioned'} "
+                f"to {new_revision}."
+            )
 
     if shell:
         # These imports are done to put things in locals for easier shell usage
@@ -114,8 +236,21 @@ def launch(folder, create, archive, shell, password):
         console = InteractiveConsole(locals=locals())
         console.interact()
     else:
-        app = create_app(folder, create=create)
-        app.run()
+        config = {"CONTENT_ADDRESSED": True} if content_addressed else {}
+        if metrics:
+            config["METRICS_ENABLED"] = True
+        if slow_request is not None:
+            config["SLOW_REQUEST_SECONDS"] = slow_request
+        if serve:
+            # Each request thread holds its own database connection
+            config["DB_POOL_SIZE"] = max(threads, Config.DB_POOL_SIZE)
+            # Reformatting the HTML takes several times longer than rendering it
+            config["PRETTIFY"] = False
+        app = create_app(folder, create=create, **config)
+        if serve:
+            run_server(app, host=host, port=port, threads=threads)
+        else:
+            app.run(host=host, port=port)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,34 @@
+"""
+Progress reporting for long running commands.
+"""
+import time
+
+import click
+
+
+def progress_printer(label, interval=0.5):
+    """
+    Make a progress callback that prints the bytes done and the rate
+
+    :param label: what is being done, shown before the numbers
+    :param interval: minimum seconds between updates
+    :return: function taking (done, total) in bytes
+    """
+    start = time.monotonic()
+    last_update = 0.0
+
+    def report(done, total):
+        nonlocal last_update
+        now = time.monotonic()
+        if now - last_update < interval and done < total:
+            return
+        last_update = now
+
+        rate = done / max(now - start, 1e-6)
+        click.echo(
+            f"\r{label}: {done / 1024**2:.1f}/{total / 1024**2:.1f} MB "
+            f"({rate / 1024**2:.1f} MB/s)",
+            nl=done >= total,
+        )
+
+    return report
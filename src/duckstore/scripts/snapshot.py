@@ -0,0 +1,64 @@
+from pathlib import Path
+
+import click
+
+from duckstore.exceptions import CheckpointError
+from duckstore.util.sevenzip import create_snapshot, read_manifest
+from .progress import progress_printer
+
+
+@click.command()
+@click.argument(
+    "folder",
+    type=click.Path(
+        resolve_path=True, path_type=Path, dir_okay=True, file_okay=False, exists=True
+    ),
+)
+@click.argument(
+    "archive", type=click.Path(resolve_path=True, path_type=Path, dir_okay=False)
+)
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Archive every file instead of only the changes since the last snapshot.",
+)
+@click.option("--password", help="Password to encrypt the archive with.")
+@click.option(
+    "--parts",
+    type=click.IntRange(min=1),
+    help="Number of part archives to compress in parallel, defaults to the CPU count.",
+)
+def snapshot(folder, archive, full, password, parts):
+    """
+    Archive the duckstore FOLDER to ARCHIVE.
+
+    If the folder has been archived before only the files that changed since
+    then are included. Restore with the full snapshot as --archive and each
+    incremental snapshot as --delta, in the order they were taken.
+    """
+    base = None if full else read_manifest(folder)
+    if password is None:
+        password = click.prompt(
+            "Password: ", hide_input=True, confirmation_prompt=True, default=""
+        )
+        if password == "":
+            password = None
+
+    try:
+        manifest = create_snapshot(
+            folder,
+            archive,
+            password=password,
+            base=base,
+            parts=parts,
+            progress=progress_printer("Archiving"),
+        )
+    except CheckpointError as exc:
+        raise click.ClickException(f"{exc}, close anything using the store.")
+
+    kind = "Incremental" if base else "Full"
+    click.echo(
+        f"{kind} snapshot written to {archive}: "
+        f"{len(manifest['archived'])} files archived, "
+        f"{len(manifest['deleted'])} removed."
+    )
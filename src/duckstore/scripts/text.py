@@ -0,0 +1,77 @@
+from pathlib import Path
+
+import click
+from sqlalchemy import update
+
+from duckstore.config import db_name, store_name
+from duckstore.database import db_session, bind_session, upgrade_db
+from duckstore.database.models import File
+from duckstore.jobs import FAILED, TextExtractionQueue, missing_text_ids
+
+ocr_option = click.option(
+    "--ocr/--no-ocr",
+    default=True,
+    show_default=True,
+    help="Read scanned pages and images with tesseract, needs duckstore[ocr].",
+)
+
+
+@click.command("extract-text")
+@click.argument(
+    "folder",
+    type=click.Path(
+        resolve_path=True, path_type=Path, dir_okay=True, file_okay=False, exists=True
+    ),
+)
+@ocr_option
+@click.option(
+    "--empty",
+    is_flag=True,
+    help="Also try files where no text was found before, after installing OCR.",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of files read at the same time.",
+)
+def extract_text_command(folder, ocr, empty, workers):
+    """
+    Extract the text of the files in the duckstore FOLDER for searching.
+
+    Only files changed since their text was extracted, or never extracted,
+    are read. The web server does this for new uploads, this catches up
+    stores made before text extraction, or files it didn't get to.
+    """
+    db_path = folder / db_name
+    if not db_path.is_file():
+        raise click.ClickException(f"Database not found at {db_path}")
+
+    upgrade_db(db_path)
+    bind_session(db_path)
+    try:
+        if empty:
+            db_session.execute(
+                update(File).where(File.text.is_(None)).values(text_sha256=None)
+            )
+            db_session.commit()
+        file_ids = missing_text_ids(db_session)
+    finally:
+        db_session.remove()
+
+    queue = TextExtractionQueue(
+        folder / store_name, workers=workers, ocr=ocr, keep_finished=len(file_ids)
+    )
+    with click.progressbar(file_ids, label="Extracting text") as bar:
+        for file_id in bar:
+            queue.submit(file_id)
+        queue.wait()
+    queue.shutdown()
+
+    failed = [
+        file_id for file_id in file_ids if queue.status(file_id)["state"] == FAILED
+    ]
+    for file_id in failed:
+        click.echo(f"Could not extract the text of file {file_id}")
+    click.echo(f"Checked the text of {len(file_ids) - len(failed)} files.")
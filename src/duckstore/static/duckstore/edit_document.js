@@ -27,15 +27,37 @@ function fillForm(data) {
         new_html += `
             <div class='row'><div class='col-lg'>
               <a href="download?file_id=${file['id']}">${file["original_name"]}</a>
+              <span id="job_${file['id']}" class="text-muted"></span>
             </div></div>
         `
     }
     filelist.innerHTML = new_html
     $("#filelist_parent").removeClass("hidden")
+    pollJobs(files.map(file => file['id']))
   }
 
 }
 
+function pollJobs(file_ids) {
+  // Show the state of any background compression until it finishes
+  $.get(
+    '/api/jobs',
+    $.param({'file_id': file_ids}, true),
+    function (statuses) {
+      let pending = []
+      for (let [file_id, status] of Object.entries(statuses)) {
+        $(`#job_${file_id}`).text(`(compression ${status['state']})`)
+        if (status['state'] === 'queued' || status['state'] === 'running') {
+          pending.push(file_id)
+        }
+      }
+      if (pending.length > 0) {
+        setTimeout(function () { pollJobs(pending) }, 2000)
+      }
+    }
+  )
+}
+
 function getDoc(docid) {
   $.post(
     '/docdata',
@@ -50,7 +72,82 @@ function getDoc(docid) {
   )
 }
 
+const CHUNK_SIZE = 8 * 1024 * 1024
+const MAX_RETRIES = 5
+
+async function uploadFile(file, progress) {
+  // Send a file in chunks through the resumable upload API
+  // If a chunk fails ask the server how much it has and carry on from there
+  let start = await fetch('/api/uploads', {
+    method: 'POST',
+    body: new URLSearchParams({'filename': file.name, 'size': file.size})
+  })
+  if (!start.ok) { throw new Error(`Could not start upload of ${file.name}`) }
+  let upload = await start.json()
+
+  let offset = 0
+  let retries = 0
+  while (offset < file.size) {
+    try {
+      let response = await fetch(`/api/uploads/${upload['id']}`, {
+        method: 'PATCH',
+        headers: {'Upload-Offset': offset},
+        body: file.slice(offset, offset + CHUNK_SIZE)
+      })
+      if (!response.ok && response.status !== 409) {
+        throw new Error(response.statusText)
+      }
+      offset = (await response.json())['offset']
+      retries = 0
+    } catch (err) {
+      if (++retries > MAX_RETRIES) { throw err }
+      await new Promise(resolve => setTimeout(resolve, 1000 * retries))
+      let status = await fetch(`/api/uploads/${upload['id']}`)
+      if (status.ok) { offset = (await status.json())['offset'] }
+    }
+    progress(offset)
+  }
+  return upload['id']
+}
+
+async function uploadFiles(form) {
+  let files_input = $('#files')[0]
+  let files = Array.from(files_input.files)
+  let total = files.reduce((sum, file) => sum + file.size, 0)
+  let done = 0
+  let submit = $('#submit')
+  let upload_ids = []
+
+  submit.prop('disabled', true)
+  try {
+    for (let file of files) {
+      upload_ids.push(await uploadFile(file, function (offset) {
+        let percent = total ? Math.floor(100 * (done + offset) / total) : 100
+        submit.val(`Uploading ${percent}%`)
+      }))
+      done += file.size
+    }
+  } catch (err) {
+    window.alert("Upload failed: " + err)
+    submit.prop('disabled', false)
+    submit.val('Submit')
+    return
+  }
+
+  // The files are on the server now, only send their upload ids with the form
+  $('#uploads').val(upload_ids.join(','))
+  files_input.value = ''
+  form.submit()
+}
+
 $(document).ready(function () {
+  $('#docform').on('submit', function (event) {
+    if ($('#files')[0].files.length > 0) {
+      event.preventDefault()
+      uploadFiles(this)
+    }
+  })
+
   // I couldn't figure out where the newlines were being added to the text
   // Of all the options so here just remove them?
   // This is kind of a hack until I can figure this out
@@ -3,6 +3,8 @@ $('html').addClass('hidden')
 $(document).ready(function () {
   $('#source').select2()
   $('#tags').select2()
+  $('#any_tags').select2()
+  $('#exclude_tags').select2()
   $('select').select2({ theme: 'bootstrap4' })
   $('html').removeClass('hidden')
 })
@@ -0,0 +1,159 @@
+"""
+Placement of files in the store folder.
+
+By default files keep their (sanitised) upload name with a date stamp added to
+avoid clashes. With CONTENT_ADDRESSED enabled new files are instead stored as
+blobs named by their SHA-256, so uploading the same file twice only keeps one
+copy. Several File rows may then share a path, a stored file is only removed
+once no File row refers to it any more.
+
+Both layouts can exist in the same store as each File row records its own path.
+"""
+import os
+import secrets
+from pathlib import Path
+
+from sqlalchemy import case, func, select, update
+
+from .database.models import File
+from .uploads import hash_file
+from .util.filename_deduper import prepare_storepath
+
+blob_folder_name = "blobs"
+
+
+def blob_path(sha256, suffix):
+    """
+    Location of a content addressed file relative to the store folder
+
+    The suffix is kept so the file type can still be recognised.
+
+    :param sha256: hex digest of the file
+    :param suffix: file suffix including the dot
+    :return: relative Path
+    """
+    return Path(blob_folder_name, sha256[:2], f"{sha256}{suffix.lower()}")
+
+
+def is_blob(path):
+    """
+    Check if a path relative to the store folder is a content addressed file
+    """
+    return Path(path).parts[0] == blob_folder_name
+
+
+def store_file(folder, filename, save, content_addressed=False):
+    """
+    Save a new file into the store folder
+
+    :param folder: store folder
+    :param filename: safe name of the uploaded file
+    :param save: function that writes the file to the path it's given, replacing
+                 anything there, and returns the SHA-256 hex digest
+    :param content_addressed: store the file as a blob named by its hash
+    :return: (path, sha256, created) where created is False if an identical
+             file was already stored
+    """
+    if not content_addressed:
+        # The save function replaces the empty file reserving the name
+        outpath = prepare_storepath(folder / filename, reserve=True)
+        try:
+            return outpath, save(outpath), True
+        except BaseException:
+            outpath.unlink(missing_ok=True)
+            raise
+
+    tmp_path = folder / f".incoming_{secrets.token_hex(8)}"
+    try:
+        sha256 = save(tmp_path)
+        outpath = folder / blob_path(sha256, Path(filename).suffix)
+        if outpath.is_file():
+            return outpath, sha256, False
+
+        outpath.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, outpath)
+        return outpath, sha256, True
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def release_files(db_session, folder, paths):
+    """
+    Remove stored files that no File row refers to any more
+
+    Call this after committing the removal of the File rows.
+
+    :param db_session: database session
+    :param folder: store folder
+    :param paths: paths relative to the store folder
+    :return: list of (path, state) where state is "deleted", "missing" or "shared"
+    """
+    paths = list(dict.fromkeys(paths))
+    query = (
+        select(File.path, func.count(File.id))
+        .where(File.path.in_(paths))
+        .group_by(File.path)
+    )
+    in_use = dict(db_session.execute(query).all())
+
+    results = []
+    for path in paths:
+        if in_use.get(path):
+            results.append((path, "shared"))
+            continue
+        try:
+            Path(folder, path).unlink()
+        except FileNotFoundError:
+            results.append((path, "missing"))
+        else:
+            results.append((path, "deleted"))
+    return results
+
+
+def rehash_file(db_session, folder, file_id):
+    """
+    Update the stored hash of a file after its contents have been replaced
+
+    Blobs are moved to the address of their new hash, along with every
+    File row that shares them.
+
+    :param db_session: database session
+    :param folder: store folder
+    :param file_id: id of the File row
+    :return: ids of the documents with the file
+    """
+    db_file = db_session.get(File, file_id)
+    if not db_file:
+        return []
+
+    old_path = db_file.path
+    full_path = db_file.full_path(folder)
+    sha256 = hash_file(full_path)
+
+    new_path = old_path
+    if is_blob(old_path):
+        relative_path = blob_path(sha256, full_path.suffix)
+        new_path = str(relative_path)
+        new_full_path = folder / relative_path
+        if new_full_path != full_path:
+            new_full_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(full_path, new_full_path)
+
+    document_ids = (
+        db_session.execute(select(File.document_id).where(File.path == old_path))
+        .scalars()
+        .all()
+    )
+    # Compression keeps the text, so text from the old contents stays current
+    text_sha256 = File.text_sha256
+    if db_file.sha256 is not None:
+        text_sha256 = case(
+            (File.text_sha256 == db_file.sha256, sha256), else_=File.text_sha256
+        )
+    db_session.execute(
+        update(File)
+        .where(File.path == old_path)
+        .values(path=new_path, sha256=sha256, text_sha256=text_sha256)
+    )
+    db_session.commit()
+    return document_ids
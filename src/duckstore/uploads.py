@@ -0,0 +1,293 @@
+"""
+Write uploaded files straight into the store.
+
+Form uploads are streamed by werkzeug into a temporary file in the upload folder,
+which sits next to the store so the finished file can be renamed into place
+instead of copied. The SHA-256 of the file is worked out while it is written.
+
+Large files can also be sent in chunks through the resumable upload API.
+Each chunk is appended to a partial file, if the connection drops the client
+asks for the current offset and carries on from there. The file is hashed as the
+chunks arrive, only an upload picked up by another process is read again at the end.
+"""
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+from flask import Request, current_app
+
+upload_folder_name = ".uploads"
+chunk_size = 1024**2
+
+_upload_id_re = re.compile(r"^[0-9a-f]{32}$")
+
+# Running hashes of resumable uploads by part file path, as (offset, hash)
+_upload_hashes = {}
+_upload_hashes_lock = threading.Lock()
+
+
+class UploadNotFoundError(Exception):
+    """Resumable upload does not exist"""
+
+
+class UploadOffsetError(Exception):
+    """Chunk does not start at the end of the partial upload"""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class UploadIncompleteError(Exception):
+    """Upload is smaller than the size declared when it was started"""
+
+    def __init__(self, offset, size):
+        super().__init__(f"Upload has {offset} of {size} bytes")
+        self.offset = offset
+        self.size = size
+
+
+class UploadTooLargeError(Exception):
+    """Upload is larger than its declared size or the configured maximum"""
+
+    def __init__(self, max_size):
+        super().__init__(f"Upload is limited to {max_size} bytes")
+        self.max_size = max_size
+
+
+def get_upload_folder():
+    """
+    Folder for uploads in progress for the current app
+    """
+    folder = Path(current_app.config["STORE_PATH"], upload_folder_name)
+    folder.mkdir(exist_ok=True)
+    return folder
+
+
+def hash_file(path):
+    """
+    Get the SHA-256 hex digest of a file
+
+    :param path: path to the file
+    :return: hex digest
+    """
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class HashingFile:
+    """
+    Temporary upload file that hashes everything written to it
+
+    Closing the file without calling commit deletes it.
+
+    :param folder: folder for the temporary file, must be on the same
+                   filesystem as the store
+    """
+
+    def __init__(self, folder):
+        self._file = NamedTemporaryFile(dir=folder, suffix=".part", delete=False)
+        self.path = Path(self._file.name)
+        self.hash = hashlib.sha256()
+        self.committed = False
+
+    def write(self, data):
+        self.hash.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, item):
+        # read, readline, seek etc. are passed through for werkzeug
+        return getattr(self._file, item)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def commit(self, outpath):
+        """
+        Move the file to its final location
+
+        :param outpath: path in the store
+        :return: SHA-256 hex digest of the file
+        """
+        self._file.close()
+        os.replace(self.path, outpath)
+        self.committed = True
+        return self.hash.hexdigest()
+
+    def close(self):
+        self._file.close()
+        if not self.committed:
+            self.path.unlink(missing_ok=True)
+
+
+class UploadRequest(Request):
+    """
+    Request that streams uploaded files into the upload folder
+    """
+
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        return HashingFile(get_upload_folder())
+
+
+def save_upload(file, outpath):
+    """
+    Save an uploaded file to the store
+
+    :param file: werkzeug FileStorage from the request
+    :param outpath: path in the store
+    :return: SHA-256 hex digest of the file
+    """
+    if isinstance(file.stream, HashingFile):
+        return file.stream.commit(outpath)
+
+    # Uploads that didn't come through UploadRequest get written out here
+    digest = hashlib.sha256()
+    with NamedTemporaryFile(dir=outpath.parent, delete=False) as tmp:
+        while chunk := file.stream.read(chunk_size):
+            digest.update(chunk)
+            tmp.write(chunk)
+    os.replace(tmp.name, outpath)
+    return digest.hexdigest()
+
+
+def _upload_paths(upload_id):
+    if not _upload_id_re.match(upload_id):
+        raise UploadNotFoundError(upload_id)
+    folder = get_upload_folder()
+    return folder / f"{upload_id}.part", folder / f"{upload_id}.json"
+
+
+def create_upload(filename, size=None):
+    """
+    Start a resumable upload
+
+    :param filename: original name of the file being uploaded
+    :param size: size of the file in bytes if the client knows it, chunks
+                 beyond it are refused
+    :return: upload id
+    :raises UploadTooLargeError: if size is over the MAX_UPLOAD_SIZE config value
+    """
+    max_size = current_app.config["MAX_UPLOAD_SIZE"]
+    if size is not None and size > max_size:
+        raise UploadTooLargeError(max_size)
+
+    upload_id = secrets.token_hex(16)
+    part_path, info_path = _upload_paths(upload_id)
+    part_path.touch()
+    info_path.write_text(json.dumps({"filename": filename, "size": size}))
+    with _upload_hashes_lock:
+        _upload_hashes[part_path] = (0, hashlib.sha256())
+    return upload_id
+
+
+def upload_info(upload_id):
+    """
+    Get details of a resumable upload
+
+    :param upload_id: upload id
+    :return: {"filename": ..., "size": ..., "offset": ...}
+    """
+    part_path, info_path = _upload_paths(upload_id)
+    try:
+        info = json.loads(info_path.read_text())
+        info["offset"] = part_path.stat().st_size
+    except FileNotFoundError:
+        raise UploadNotFoundError(upload_id)
+    return info
+
+
+def append_upload(upload_id, offset, stream):
+    """
+    Add a chunk to a resumable upload
+
+    :param upload_id: upload id
+    :param offset: position of the chunk in the file
+    :param stream: file-like object to read the chunk from
+    :return: new size of the upload
+    :raises UploadOffsetError: if offset is not the current size of the upload
+    :raises UploadTooLargeError: if the chunk takes the upload over its declared
+                                 size or the MAX_UPLOAD_SIZE config value, the
+                                 chunk is dropped
+    """
+    info = upload_info(upload_id)
+    max_size = current_app.config["MAX_UPLOAD_SIZE"]
+    if info.get("size") is not None:
+        max_size = min(max_size, info["size"])
+
+    part_path, _ = _upload_paths(upload_id)
+    try:
+        f = open(part_path, "r+b")
+    except FileNotFoundError:
+        raise UploadNotFoundError(upload_id)
+
+    with f:
+        current = f.seek(0, os.SEEK_END)
+        if offset != current:
+            raise UploadOffsetError(current)
+
+        with _upload_hashes_lock:
+            hashed_offset, digest = _upload_hashes.pop(part_path, (None, None))
+        if hashed_offset != current:
+            digest = None  # Started elsewhere or a chunk failed, hash it at the end
+
+        while chunk := stream.read(chunk_size):
+            if f.tell() + len(chunk) > max_size:
+                f.truncate(current)
+                raise UploadTooLargeError(max_size)
+            f.write(chunk)
+            if digest is not None:
+                digest.update(chunk)
+
+        if digest is not None:
+            with _upload_hashes_lock:
+                _upload_hashes[part_path] = (f.tell(), digest)
+        return f.tell()
+
+
+def finish_upload(upload_id, outpath):
+    """
+    Move a completed resumable upload into the store
+
+    :param upload_id: upload id
+    :param outpath: path in the store
+    :return: SHA-256 hex digest of the file
+    :raises UploadIncompleteError: if the upload is smaller than its declared size,
+                                   it is left in place to be carried on with
+    """
+    info = upload_info(upload_id)
+    if info.get("size") is not None and info["offset"] != info["size"]:
+        raise UploadIncompleteError(info["offset"], info["size"])
+
+    part_path, info_path = _upload_paths(upload_id)
+    with _upload_hashes_lock:
+        hashed_offset, digest = _upload_hashes.pop(part_path, (None, None))
+    if hashed_offset == info["offset"]:
+        sha256 = digest.hexdigest()
+    else:
+        sha256 = hash_file(part_path)
+    os.replace(part_path, outpath)
+    info_path.unlink(missing_ok=True)
+    return sha256
+
+
+def clean_uploads(folder, max_age=24 * 60 * 60):
+    """
+    Remove abandoned uploads
+
+    :param folder: upload folder
+    :param max_age: seconds since last modified after which an upload is abandoned
+    """
+    cutoff = time.time() - max_age
+    for pth in Path(folder).glob("*"):
+        if pth.is_file() and pth.stat().st_mtime < cutoff:
+            pth.unlink(missing_ok=True)
+            with _upload_hashes_lock:
+                _upload_hashes.pop(pth, None)
@@ -1,2 +1,7 @@
-from .sevenzip import create_archive, extract_archive
+from .sevenzip import (
+    create_archive,
+    extract_archive,
+    extract_database,
+    extract_files,
+)
 from .filedialog import get_archive_dialog, get_folder_dialog
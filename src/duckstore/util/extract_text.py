@@ -0,0 +1,159 @@
+"""
+Pull searchable text out of stored files.
+
+PDFs are handled by ghostscript's txtwrite device, plain text files are read directly.
+Scanned pages have no text layer, with OCR turned on those pages are rendered by
+ghostscript and read by tesseract, as are images. OCR needs pytesseract and the
+tesseract program (pip install duckstore[ocr]), without them it is skipped.
+Anything else has no text to extract.
+"""
+import subprocess
+from functools import cache
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from .optimize_pdf import get_ghostscript_path
+from .thumbnail import image_suffixes
+from ..metrics import time_subprocess
+
+try:
+    import pytesseract
+    from PIL import Image
+except ImportError:
+    pytesseract = None
+
+text_suffixes = {".txt", ".md", ".csv"}
+ocr_resolution = 300  # Dots per inch scanned pages are rendered at for OCR
+
+
+@cache
+def ocr_available():
+    """
+    Check if pytesseract and the tesseract program are installed
+    """
+    if pytesseract is None:
+        return False
+    try:
+        pytesseract.get_tesseract_version()
+    except pytesseract.TesseractNotFoundError:
+        return False
+    return True
+
+
+def ocr_image(image_path):
+    """
+    Read the text in an image with tesseract
+
+    :param image_path: path to the image
+    :return: text found
+    """
+    with Image.open(image_path) as image, time_subprocess("ocr"):
+        return pytesseract.image_to_string(image)
+
+
+def extract_pdf_pages(input_path, folder):
+    """
+    Extract the text layer of each page of a PDF using ghostscript
+
+    :param input_path: path to the PDF
+    :param folder: folder to write the text of the pages to
+    :return: list of the text of each page
+    """
+    gs = get_ghostscript_path()
+    with time_subprocess("extract_text"):
+        subprocess.run(
+            [
+                gs,
+                "-sDEVICE=txtwrite",
+                "-dNOPAUSE",
+                "-dQUIET",
+                "-dBATCH",
+                f"-sOutputFile={Path(folder, 'page-%d.txt')}",
+                input_path,
+            ],
+            capture_output=True,
+            check=True,
+        )
+    pages = sorted(
+        Path(folder).glob("page-*.txt"), key=lambda pth: int(pth.stem.split("-")[1])
+    )
+    return [pth.read_text(errors="replace") for pth in pages]
+
+
+def render_pdf_page(input_path, page, output_path):
+    """
+    Render one page of a PDF as a greyscale PNG for OCR
+
+    :param input_path: path to the PDF
+    :param page: page number, starting from 1
+    :param output_path: path of the PNG to write
+    """
+    gs = get_ghostscript_path()
+    with time_subprocess("ocr_render"):
+        subprocess.run(
+            [
+                gs,
+                "-sDEVICE=pnggray",
+                f"-r{ocr_resolution}",
+                f"-dFirstPage={page}",
+                f"-dLastPage={page}",
+                "-dNOPAUSE",
+                "-dQUIET",
+                "-dBATCH",
+                f"-sOutputFile={output_path}",
+                input_path,
+            ],
+            capture_output=True,
+            check=True,
+        )
+
+
+def extract_pdf_text(input_path, ocr=False):
+    """
+    Extract the text of a PDF, reading pages without a text layer with OCR
+
+    :param input_path: path to the PDF
+    :param ocr: use OCR for pages without any text, if it is available
+    :return: extracted text
+    """
+    with TemporaryDirectory() as folder:
+        pages = extract_pdf_pages(input_path, folder)
+        if ocr and ocr_available():
+            for number, text in enumerate(pages, 1):
+                if text.strip():
+                    continue
+                image_path = Path(folder, f"page-{number}.png")
+                try:
+                    render_pdf_page(input_path, number, image_path)
+                except subprocess.CalledProcessError:
+                    continue  # Ghostscript can report an extra blank page at the end
+                if image_path.is_file():
+                    pages[number - 1] = ocr_image(image_path)
+    return "\n".join(pages)
+
+
+def extract_text(input_path, ocr=False):
+    """
+    Extract whatever text is available from a file
+
+    :param input_path: path to the file
+    :param ocr: read scanned pages and images with OCR, if it is available
+    :return: extracted text or None if the file type isn't supported
+    :raises OSError: if the file can't be read
+    :raises subprocess.CalledProcessError: if ghostscript fails
+    :raises pytesseract.TesseractError: if tesseract fails
+    """
+    input_path = Path(input_path)
+    suffix = input_path.suffix.lower()
+
+    if suffix == ".pdf":
+        text = extract_pdf_text(input_path, ocr)
+    elif suffix in text_suffixes:
+        text = input_path.read_text(errors="replace")
+    elif ocr and suffix in image_suffixes and ocr_available():
+        text = ocr_image(input_path)
+    else:
+        return None
+
+    # Collapse the layout whitespace, the index only cares about the words
+    return " ".join(text.split()) or None
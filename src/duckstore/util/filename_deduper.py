@@ -6,20 +6,29 @@ from datetime import datetime
 from pathlib import Path
 
 
-def prepare_storepath(pth):
+def prepare_storepath(pth, reserve=False):
     """
     Prepare filename for server
     For our usecase we're going to append the date uploaded to the file.
     If there's still a clash add a random token until there is no longer a clash.
 
     :param pth: input filename
+    :param reserve: create an empty file at the path so files being saved at
+                    the same time can't be given the same name
     :return:
     """
     pth = Path(pth)
     stamp = datetime.today().strftime("%Y-%m-%d")
     pth = pth.with_stem(f"{pth.stem}_{stamp}")
 
-    while pth.is_file():
+    while True:
+        if reserve:
+            try:
+                open(pth, "x").close()
+                return pth
+            except FileExistsError:
+                pass
+        elif not pth.is_file():
+            return pth
         stem = f"{pth.stem}_{secrets.token_hex(4)}"
         pth = pth.with_stem(stem)
-    return pth
@@ -26,6 +26,7 @@ import shutil
 from pathlib import Path
 
 from ..exceptions import FileTypeError
+from ..metrics import time_subprocess
 
 
 def compress_pdf(input_path, output_path, power=2):
@@ -56,19 +57,20 @@ def compress_pdf(input_path, output_path, power=2):
     gs = get_ghostscript_path()
 
     # Perform the compression
-    result = subprocess.run(
-        [
-            gs,
-            "-sDEVICE=pdfwrite",
-            f"-dPDFSETTINGS={quality[power]}",
-            "-dCompatibilityLevel=1.4",
-            "-dNOPAUSE",
-            "-dQUIET",
-            "-dBATCH",
-            f"-sOutputFile={output_path}",
-            input_path,
-        ]
-    )
+    with time_subprocess("compress"):
+        result = subprocess.run(
+            [
+                gs,
+                "-sDEVICE=pdfwrite",
+                f"-dPDFSETTINGS={quality[power]}",
+                "-dCompatibilityLevel=1.4",
+                "-dNOPAUSE",
+                "-dQUIET",
+                "-dBATCH",
+                f"-sOutputFile={output_path}",
+                input_path,
+            ]
+        )
 
     return result
 
@@ -81,7 +83,13 @@ def get_ghostscript_path():
             return pth
 
     # If not on path, search program files
-    base_dir = Path(os.environ["ProgramFiles"]) / "gs"
+    program_files = os.environ.get("ProgramFiles")
+    base_dir = Path(program_files) / "gs" if program_files else None
+    if base_dir is None or not base_dir.is_dir():
+        raise FileNotFoundError(
+            f'No GhostScript executable was found on path ({"/".join(gs_names)})'
+        )
+
     for pth in sorted(base_dir.iterdir(), reverse=True):
         if pth.is_dir():
             for name in gs_names:
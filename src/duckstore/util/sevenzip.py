@@ -3,24 +3,407 @@ Handle the external py7zr library.
 
 This should do what is expected in every case. If I have to replace py7zr at some point
 with a different external library this should make it easier to do by concentrating it here.
+
+Archives are snapshots of a store folder. Each one contains a manifest listing every
+file in the store with its size, modification time and hash. An incremental snapshot
+only contains the files that changed since the snapshot it is based on, along with a
+list of the files that were removed. Restoring replays a full snapshot followed by
+each of its incremental snapshots in order.
+
+The database and manifest are kept in the snapshot archive itself, the stored files go
+in part archives beside it (<name>.part1.7z, ...) that are written and read in parallel.
+This also means the database can be restored first and the files filled in after.
 """
+import hashlib
+import json
+import os
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
+from tempfile import TemporaryDirectory
+
 from py7zr import SevenZipFile
+from py7zr.callbacks import ExtractCallback
 
+from ..config import db_name, result_cache_name
+from ..database.database import checkpoint_db
+from ..exceptions import SnapshotChainError
 
-def extract_archive(archive, destination, password=None):
-    destination = Path(destination)
-    destination.mkdir(exist_ok=True)
+manifest_name = ".duckstore_snapshot.json"
 
-    with SevenZipFile(archive, mode="r", password=password) as f:
-        f.extractall(destination)
+# Files in the store folder that are never archived. The write-ahead log
+# has to be checkpointed into the database before taking a snapshot.
+exclude_names = {
+    manifest_name,
+    ".uploads",
+    ".thumbnails",
+    f"{db_name}-wal",
+    f"{db_name}-shm",
+    result_cache_name,
+    f"{result_cache_name}-wal",
+    f"{result_cache_name}-shm",
+}
 
+# Files kept in the snapshot archive itself rather than its parts
+main_names = {db_name}
 
-def create_archive(source, archive, password=None, overwrite=False):
+
+def _hash_file(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def build_manifest(source, previous=None):
+    """
+    List the files in a store folder with their size, modification time and hash
+
+    Hashes are reused from the previous manifest for files whose size and
+    modification time haven't changed.
+
+    :param source: store folder
+    :param previous: manifest of the previous snapshot
+    :return: {relative posix path: {"size": ..., "mtime": ..., "sha256": ...}}
+    """
+    source = Path(source)
+    previous_files = previous["files"] if previous else {}
+
+    files = {}
+    for pth in sorted(source.rglob("*")):
+        relative = pth.relative_to(source)
+        if relative.parts[0] in exclude_names or not pth.is_file():
+            continue
+
+        key = relative.as_posix()
+        stat = pth.stat()
+        entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+        old_entry = previous_files.get(key)
+        if (
+            old_entry
+            and old_entry["size"] == entry["size"]
+            and old_entry["mtime"] == entry["mtime"]
+        ):
+            entry["sha256"] = old_entry["sha256"]
+        else:
+            entry["sha256"] = _hash_file(pth)
+        files[key] = entry
+    return files
+
+
+def read_manifest(folder):
+    """
+    Get the manifest of the last snapshot taken of, or restored to, a store folder
+
+    :param folder: store folder
+    :return: manifest or None if there isn't one
+    """
+    try:
+        return json.loads(Path(folder, manifest_name).read_text())
+    except FileNotFoundError:
+        return None
+
+
+def read_archive_manifest(archive, password=None):
+    """
+    Get the manifest stored in an archive
+
+    :param archive: path to the archive
+    :param password: archive password
+    :return: manifest or None for archives made without one
+    """
+    with TemporaryDirectory() as tmpdir:
+        with SevenZipFile(archive, mode="r", password=password) as f:
+            if manifest_name not in f.getnames():
+                return None
+            f.extract(tmpdir, targets=[manifest_name])
+        return read_manifest(tmpdir)
+
+
+class Progress:
+    """
+    Thread safe count of the bytes processed, reported to a callback
+
+    :param total: total number of bytes to process
+    :param callback: function called with (done, total) as bytes are processed
+    """
+
+    def __init__(self, total, callback=None):
+        self.total = total
+        self.done = 0
+        self.callback = callback
+        self._lock = threading.Lock()
+
+    def advance(self, nbytes):
+        with self._lock:
+            self.done += nbytes
+            if self.callback:
+                self.callback(self.done, self.total)
+
+
+class _ExtractProgress(ExtractCallback):
+    # Adapts py7zr's extraction callbacks to a Progress
+    def __init__(self, progress):
+        self.progress = progress
+
+    def report_end(self, processing_file_path, wrote_bytes):
+        self.progress.advance(int(wrote_bytes))
+
+    def report_start_preparation(self):
+        pass
+
+    def report_start(self, processing_file_path, processing_bytes):
+        pass
+
+    def report_update(self, decompressed_bytes):
+        pass
+
+    def report_warning(self, message):
+        pass
+
+    def report_postprocess(self):
+        pass
+
+
+def part_path(archive, index):
+    """
+    Path of one of the part archives that go with a snapshot archive
+    """
+    archive = Path(archive)
+    return archive.with_name(f"{archive.stem}.part{index}{archive.suffix}")
+
+
+def _split_parts(keys, files, parts):
+    # Spread the files over the parts so each has a similar number of bytes,
+    # placing the largest files first
+    bins = [[] for _ in range(parts)]
+    sizes = [0] * parts
+    for key in sorted(keys, key=lambda k: files[k]["size"], reverse=True):
+        smallest = sizes.index(min(sizes))
+        bins[smallest].append(key)
+        sizes[smallest] += files[key]["size"]
+    return [b for b in bins if b]
+
+
+def _write_archive(archive, source, keys, files, password, progress, extra=None):
+    with SevenZipFile(archive, mode="w", password=password) as f:
+        if password:
+            f.set_encrypted_header(True)
+        for key in keys:
+            f.write(source / key, arcname=key)
+            progress.advance(files[key]["size"])
+        for arcname, data in (extra or {}).items():
+            f.writestr(data, arcname)
+
+
+def create_snapshot(
+    source,
+    archive,
+    password=None,
+    base=None,
+    overwrite=False,
+    parts=None,
+    progress=None,
+):
+    """
+    Archive a store folder
+
+    The database goes in the archive itself along with the manifest so it can be
+    restored first, its write-ahead log is checkpointed beforehand so recent
+    changes are in the database file. Other files are spread over part archives beside it which are
+    compressed at the same time on separate threads.
+
+    :param source: store folder
+    :param archive: path of the archive to write
+    :param password: password to encrypt the archive with
+    :param base: manifest of the snapshot to build on, only files that differ
+                 from it are archived. None for a full snapshot.
+    :param overwrite: replace the archive if it exists
+    :param parts: maximum number of part archives, defaults to the number of CPUs
+    :param progress: function called with (done, total) bytes as files are archived
+    :return: manifest of the new snapshot
+    :raises CheckpointError: if the database log can't be checkpointed
+    """
     archive = Path(archive).resolve()
     source = Path(source).resolve()
     if not overwrite and archive.exists():
         raise FileExistsError("Archive file already exists")
 
-    with SevenZipFile(archive, mode="w", password=password) as f:
-        f.writeall(source)
+    # Changes still in the write-ahead log aren't in the database file yet
+    if (source / f"{db_name}-wal").is_file():
+        checkpoint_db(source / db_name)
+
+    files = build_manifest(source, previous=base)
+    base_files = base["files"] if base else {}
+
+    changed = [
+        key
+        for key, entry in files.items()
+        if base_files.get(key, {}).get("sha256") != entry["sha256"]
+    ]
+    main_keys = [key for key in changed if key in main_names]
+    part_keys = _split_parts(
+        [key for key in changed if key not in main_names],
+        files,
+        parts or os.cpu_count() or 1,
+    )
+    part_paths = [part_path(archive, i) for i in range(1, len(part_keys) + 1)]
+    if not overwrite and any(pth.exists() for pth in part_paths):
+        raise FileExistsError("Archive part file already exists")
+
+    manifest = {
+        "id": secrets.token_hex(8),
+        "parent": base["id"] if base else None,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "files": files,
+        "archived": changed,
+        "deleted": [key for key in base_files if key not in files],
+        "parts": [pth.name for pth in part_paths],
+    }
+    manifest_data = json.dumps(manifest, indent=1)
+
+    progress = Progress(sum(files[key]["size"] for key in changed), progress)
+    with ThreadPoolExecutor(max_workers=len(part_paths) + 1) as executor:
+        jobs = [
+            executor.submit(
+                _write_archive,
+                archive,
+                source,
+                main_keys,
+                files,
+                password,
+                progress,
+                {manifest_name: manifest_data},
+            )
+        ]
+        jobs.extend(
+            executor.submit(
+                _write_archive, pth, source, keys, files, password, progress
+            )
+            for pth, keys in zip(part_paths, part_keys)
+        )
+        for job in jobs:
+            job.result()
+
+    # Keep the manifest in the store for the next incremental snapshot
+    Path(source, manifest_name).write_text(manifest_data)
+    return manifest
+
+
+def _extract(archive, destination, password, progress):
+    with SevenZipFile(archive, mode="r", password=password) as f:
+        f.extractall(destination, callback=_ExtractProgress(progress))
+
+
+def extract_database(archive, destination, password=None, deltas=(), progress=None):
+    """
+    Restore the database of a snapshot and its incremental snapshots
+
+    Only the archives themselves are extracted, the part archives holding
+    the rest of the files are left for extract_files.
+
+    :param archive: full snapshot archive
+    :param destination: store folder to restore to
+    :param password: archive password, used for all the archives
+    :param deltas: incremental snapshot archives in the order they were taken
+    :param progress: function called with (done, total) bytes as files are extracted
+    :return: list of (archive, manifest) for each snapshot to pass to extract_files
+    """
+    destination = Path(destination)
+    destination.mkdir(exist_ok=True)
+
+    chain = []
+    previous = None
+    for snapshot in [archive, *deltas]:
+        manifest = read_archive_manifest(snapshot, password)
+        if chain and not (
+            manifest and previous and manifest["parent"] == previous["id"]
+        ):
+            raise SnapshotChainError(
+                f"{snapshot} is not the next snapshot after the ones already restored"
+            )
+        chain.append((Path(snapshot), manifest))
+        previous = manifest
+
+    total = sum(
+        manifest["files"][key]["size"]
+        for _, manifest in chain
+        if manifest
+        for key in manifest["archived"]
+        if key in main_names
+    )
+    tracker = Progress(total, progress)
+    for snapshot, _ in chain:
+        _extract(snapshot, destination, password, tracker)
+
+    return chain
+
+
+def extract_files(chain, destination, password=None, progress=None):
+    """
+    Restore the files held in the part archives of each snapshot
+
+    The parts of a snapshot are extracted at the same time on separate threads,
+    the snapshots themselves are restored in order.
+
+    :param chain: list of (archive, manifest) from extract_database
+    :param destination: store folder to restore to
+    :param password: archive password, used for all the archives
+    :param progress: function called with (done, total) bytes as files are extracted
+    """
+    destination = Path(destination)
+    total = sum(
+        manifest["files"][key]["size"]
+        for _, manifest in chain
+        if manifest
+        for key in manifest["archived"]
+        if key not in main_names
+    )
+    tracker = Progress(total, progress)
+
+    for snapshot, manifest in chain:
+        if manifest is None:
+            # Made before manifests, everything was in the one archive
+            continue
+
+        parts = [snapshot.with_name(name) for name in manifest.get("parts", [])]
+        if parts:
+            with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+                jobs = [
+                    executor.submit(_extract, pth, destination, password, tracker)
+                    for pth in parts
+                ]
+                for job in jobs:
+                    job.result()
+
+        for key in manifest["deleted"]:
+            Path(destination, key).unlink(missing_ok=True)
+
+
+def extract_archive(archive, destination, password=None, deltas=(), progress=None):
+    """
+    Restore a store folder from a snapshot and its incremental snapshots
+
+    :param archive: full snapshot archive
+    :param destination: store folder to restore to
+    :param password: archive password, used for all the archives
+    :param deltas: incremental snapshot archives in the order they were taken
+    :param progress: function called with (done, total) bytes as files are extracted
+    """
+    chain = extract_database(
+        archive, destination, password, deltas=deltas, progress=progress
+    )
+    extract_files(chain, destination, password, progress=progress)
+
+
+def create_archive(source, archive, password=None, overwrite=False):
+    """
+    Archive the whole of a store folder
+
+    :param source: store folder
+    :param archive: path of the archive to write
+    :param password: password to encrypt the archive with
+    :param overwrite: replace the archive if it exists
+    """
+    create_snapshot(source, archive, password=password, overwrite=overwrite)
@@ -0,0 +1,98 @@
+"""
+Render small PNG previews of stored files.
+
+PDFs are rendered by ghostscript. Images are scaled with Pillow if it is
+installed (pip install duckstore[previews]), otherwise they have no preview.
+"""
+import subprocess
+from pathlib import Path
+
+from .optimize_pdf import get_ghostscript_path
+from ..exceptions import FileTypeError
+from ..metrics import time_subprocess
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+image_suffixes = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tif", ".tiff", ".webp"}
+
+
+def has_preview(path):
+    """
+    Check if a preview can be made for a type of file
+
+    :param path: path or name of the file
+    """
+    suffix = Path(path).suffix.lower()
+    return suffix == ".pdf" or (Image is not None and suffix in image_suffixes)
+
+
+def render_pdf_thumbnail(input_path, output_path, width=200):
+    """
+    Render the first page of a PDF as a PNG using ghostscript
+
+    :param input_path: path to the PDF
+    :param output_path: path of the PNG to write
+    :param width: width of the PNG in pixels, the height keeps to A4 proportions
+    """
+    gs = get_ghostscript_path()
+    height = round(width * 297 / 210)
+    with time_subprocess("thumbnail"):
+        subprocess.run(
+            [
+                gs,
+                "-sDEVICE=png16m",
+                f"-g{width}x{height}",
+                "-dPDFFitPage",
+                "-dFirstPage=1",
+                "-dLastPage=1",
+                "-dTextAlphaBits=4",
+                "-dGraphicsAlphaBits=4",
+                "-dNOPAUSE",
+                "-dQUIET",
+                "-dBATCH",
+                f"-sOutputFile={output_path}",
+                input_path,
+            ],
+            capture_output=True,
+            check=True,
+        )
+
+
+def render_image_thumbnail(input_path, output_path, width=200):
+    """
+    Scale an image down to a PNG thumbnail with Pillow
+
+    :param input_path: path to the image
+    :param output_path: path of the PNG to write
+    :param width: maximum width of the PNG in pixels
+    """
+    if Image is None:
+        raise FileTypeError("Pillow is needed for image previews")
+
+    with Image.open(input_path) as img:
+        img.thumbnail((width, width * 4))
+        img.convert("RGB").save(output_path, format="PNG")
+
+
+def render_thumbnail(input_path, output_path, width=200):
+    """
+    Render a PNG preview of a file
+
+    :param input_path: path to the file
+    :param output_path: path of the PNG to write
+    :param width: width of the PNG in pixels
+    :raises FileTypeError: if the file type has no preview
+    :raises FileNotFoundError: if the file or ghostscript can't be found
+    :raises subprocess.CalledProcessError: if ghostscript fails
+    """
+    input_path = Path(input_path)
+    suffix = input_path.suffix.lower()
+    if suffix == ".pdf":
+        render_pdf_thumbnail(input_path, output_path, width)
+    elif suffix in image_suffixes:
+        render_image_thumbnail(input_path, output_path, width)
+    else:
+        raise FileTypeError(f"No preview for {suffix} files")
@@ -0,0 +1,76 @@
+"""
+Build zip files on the fly for streaming to the browser.
+
+zipfile can write to a stream it can't seek on, it then puts the sizes and
+checksums after each file instead of going back to fill them in. Everything
+written is collected and handed out in pieces as the zip is built, so only
+one chunk of a file is held in memory at a time.
+"""
+import io
+import zipfile
+from datetime import datetime
+
+chunk_size = 1024**2
+
+
+class ChunkWriter(io.RawIOBase):
+    """
+    Write only stream that keeps what was written until it is collected
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def collect(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries):
+    """
+    Generate the bytes of a zip file containing the given files
+
+    Files are stored without compression, most stored documents are PDFs and
+    images that are already compressed.
+
+    :param entries: iterable of (arcname, path) for files on disk or
+                    (arcname, bytes) for generated content
+    :return: generator of bytes
+    """
+    # Nothing is written while zipfile is between steps, leave out the empty pieces
+    yield from filter(None, _build_zip(entries))
+
+
+def _build_zip(entries):
+    output = ChunkWriter()
+    with zipfile.ZipFile(output, mode="w", compression=zipfile.ZIP_STORED) as zf:
+        for arcname, source in entries:
+            if isinstance(source, bytes):
+                zf.writestr(arcname, source)
+            else:
+                yield from _write_file(zf, output, arcname, source)
+            yield output.collect()
+    # The central directory is written on close
+    yield output.collect()
+
+
+def _write_file(zf, output, arcname, path):
+    stat = path.stat()
+    # Zip dates can't go back before 1980
+    modified = max(datetime.fromtimestamp(stat.st_mtime), datetime(1980, 1, 1))
+    info = zipfile.ZipInfo(arcname, modified.timetuple()[:6])
+    # Knowing the size lets zipfile switch to zip64 for large files
+    info.file_size = stat.st_size
+
+    with open(path, "rb") as f, zf.open(info, mode="w") as dest:
+        while chunk := f.read(chunk_size):
+            dest.write(chunk)
+            yield output.collect()
@@ -1,7 +1,9 @@
+import json
+import mimetypes
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-from tempfile import TemporaryDirectory
-import shutil
+from urllib.parse import quote
 
 from flask import (
     Blueprint,
@@ -10,69 +12,173 @@ from flask import (
     url_for,
     flash,
     request,
-    jsonify,
     current_app,
+    send_file,
     send_from_directory,
+    stream_with_context,
 )
 from werkzeug.utils import secure_filename
 from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
-
+from sqlalchemy.orm import Session, selectinload
+
+from .cache import (
+    get_choices,
+    get_facets,
+    get_document_data,
+    get_result_cache,
+    get_search_ids,
+)
 from .forms import SearchForm, DocumentForm
+from .jobs import get_compression_queue, get_text_queue
+from .previews import get_thumbnail_cache
 from .database import db_session
-from .database.models import Document, Tag, Source, File
-from .util.filename_deduper import prepare_storepath
-from .util.optimize_pdf import compress_pdf
+from .database.models import Document, Tag, Source, File, get_or_create_named
+from .database.search import iter_documents
+from .storage import store_file, release_files
+from .uploads import (
+    save_upload,
+    upload_info,
+    finish_upload,
+    UploadIncompleteError,
+    UploadNotFoundError,
+)
+from .util.thumbnail import has_preview
+from .util.zipstream import stream_zip
 
 duckstore = Blueprint(
     "duckstore", __name__, template_folder="templates", static_folder="static"
 )
 
 
-@duckstore.route("/", methods=["GET", "POST"])
-def store_main():
+duckstore.add_app_template_global(has_preview)
+
+
+def _facet_choices(names, counts, selected):
+    return [
+        (name, f"{name} ({counts.get(name, 0)})")
+        for name in names
+        if counts.get(name) or name in selected
+    ]
+
+
+def _read_search():
     """
-    Main page, shows a list of most recent documents + has a search form
-    :return:
+    Fill in the search form from the query string
+
+    :return: (searchform, search) where search holds the keyword arguments
+             for search_documents, empty if no search was given and None if
+             the search isn't valid, the form then holds the errors
     """
-    searchform = SearchForm()
+    searchform = SearchForm(request.args, meta={"csrf": False})
     # Set up the choices for tags and sources
-    tag_select = select(Tag).order_by(Tag.name)
-    tags = [(item.Tag.name, item.Tag.name) for item in db_session.execute(tag_select)]
-    searchform.tags.choices = tags
-
-    source_select = select(Source).order_by(Source.name)
-    sources = [("", "")]
-    sources.extend(
-        (item.Source.name, item.Source.name)
-        for item in db_session.execute(source_select)
+    choices, _ = get_choices(db_session)
+    tag_choices = [(name, name) for name in choices["tags"]]
+    searchform.tags.choices = tag_choices
+    searchform.any_tags.choices = tag_choices
+    searchform.exclude_tags.choices = tag_choices
+    searchform.source.choices = [(name, name) for name in choices["sources"]]
+
+    search = {}
+    if request.args:
+        if not searchform.validate():
+            # Keep every choice so the ones in error can be fixed
+            return searchform, None
+        search = {
+            "search_text": searchform.query.data,
+            "sources": searchform.source.data or None,
+            "tags": searchform.tags.data or None,
+            "any_tags": searchform.any_tags.data or None,
+            "exclude_tags": searchform.exclude_tags.data or None,
+        }
+
+    # Show how many results each choice would give, hiding those that give none.
+    # Choices already selected are kept so they can be removed again.
+    facets, _ = get_facets(db_session, **search)
+    selected_tags = set(search.get("tags") or [])
+    selected_tags.update(search.get("any_tags") or [], search.get("exclude_tags") or [])
+    tag_choices = _facet_choices(choices["tags"], facets["tags"], selected_tags)
+    searchform.tags.choices = tag_choices
+    searchform.exclude_tags.choices = tag_choices
+    # Choosing another of any_tags widens the results, so like sources these
+    # count as if none of them were chosen
+    if search.get("any_tags"):
+        any_facets, _ = get_facets(db_session, **{**search, "any_tags": None})
+        searchform.any_tags.choices = _facet_choices(
+            choices["tags"], any_facets["tags"], selected_tags
+        )
+    else:
+        searchform.any_tags.choices = tag_choices
+    searchform.source.choices = _facet_choices(
+        choices["sources"], facets["sources"], search.get("sources") or []
     )
-    searchform.source.choices = sources
+    return searchform, search
 
-    results = None
 
-    if searchform.validate_on_submit():
-        title = f"%{searchform.title.data}%" if searchform.title.data else None
-        tags = searchform.tags.data if searchform.tags.data else None
-        source = searchform.source.data if searchform.source.data else None
+def _search_args(args):
+    """
+    Read the search straight from the query string, without the form
 
-        query = select(Document)
+    Names that aren't in the store are kept, so they match nothing
+    instead of being dropped from the search.
 
-        if title:
-            query = query.where(Document.title.ilike(title))
-        if source:
-            query = query.join(Document.sources).where(Source.name == source)
-        if tags:
-            for tag in tags:
-                subquery = (
-                    select(Document.id).join(Document.tags).where(Tag.name == tag)
-                )
-                query = query.where(Document.id.in_(subquery))
+    :param args: query string arguments, as for the search page
+    :return: keyword arguments for search_documents
+    """
 
-        query = query.distinct().order_by(Document.date_received.desc())
-        results = db_session.execute(query).scalars().all()
+    def names(field):
+        return [name for name in args.getlist(field) if name] or None
 
-    return render_template("index.html", searchform=searchform, results=results)
+    return {
+        "search_text": args.get("query") or None,
+        "sources": names("source"),
+        "tags": names("tags"),
+        "any_tags": names("any_tags"),
+        "exclude_tags": names("exclude_tags"),
+    }
+
+
+@duckstore.route("/")
+def store_main():
+    """
+    Main page, shows a list of most recent documents + has a search form
+
+    Searches are submitted with GET so pages of results can be linked to.
+    The page is built from the result cache, so a repeated search doesn't
+    need the database.
+    :return:
+    """
+    searchform, search = _read_search()
+    if search is None:
+        return render_template("index.html", searchform=searchform, results=[])
+
+    try:
+        ids, next_cursor = get_search_ids(
+            db_session,
+            **search,
+            cursor=request.args.get("cursor"),
+            limit=current_app.config["RESULTS_PER_PAGE"],
+        )
+    except ValueError:
+        return "Invalid cursor", 400
+    results = [json.loads(data) for data in get_document_data(db_session, ids)]
+
+    page_args = request.args.to_dict(flat=False)
+    page_args.pop("cursor", None)
+    next_url, first_url = None, None
+    if next_cursor or "cursor" in request.args:
+        first_url = url_for(".store_main", **page_args)
+        if next_cursor:
+            next_url = url_for(".store_main", **page_args, cursor=next_cursor)
+
+    return render_template(
+        "index.html",
+        searchform=searchform,
+        results=results,
+        next_url=next_url,
+        first_url=first_url,
+        zip_url=url_for(".download_zip", **page_args),
+    )
 
 
 @duckstore.route("/edit", methods=["GET", "POST"], strict_slashes=False)
@@ -80,16 +186,9 @@ def edit_document():
     doc_id = request.args.get("doc_id", None)
 
     docform = DocumentForm()
-    source_select = select(Source).order_by(Source.name)
-    sources = [
-        (item.Source.name, item.Source.name)
-        for item in db_session.execute(source_select)
-    ]
-    docform.sources.choices = sources
-
-    tag_select = select(Tag).order_by(Tag.name)
-    tags = [(item.Tag.name, item.Tag.name) for item in db_session.execute(tag_select)]
-    docform.tags.choices = tags
+    choices, _ = get_choices(db_session)
+    docform.sources.choices = [(name, name) for name in choices["sources"]]
+    docform.tags.choices = [(name, name) for name in choices["tags"]]
 
     if docform.validate_on_submit():
         if doc_id:
@@ -107,53 +206,49 @@ def edit_document():
 
         document.description = docform.description.data
 
-        # TODO: rewrite so there's only 1 query for tags and 1 for sources
-        #  rather than 1 per tag/source
-        document.tags = []
-        for tagname in docform.tags.data:
-            tagname = tagname.strip()
-            # Ignore empty tags
-            if tagname == "":
-                continue
-            query = select(Tag).where(Tag.name == tagname)
-            tag = db_session.execute(query).scalars().one_or_none()
-            if not tag:
-                tag = Tag(name=tagname)
-                db_session.add(tag)
-            document.tags.append(tag)
-
-        document.sources = []
-        for sourcename in docform.sources.data:
-            sourcename = sourcename.strip()
-            # Ignore empty sources
-            if sourcename == "":
-                continue
-            query = select(Source).where(Source.name == sourcename)
-            source = db_session.execute(query).scalars().one_or_none()
-            if not source:
-                source = Source(name=sourcename)
-                db_session.add(source)
-            document.sources.append(source)
-
-        # Prepare the files here, but don't save them until the commit
+        document.tags = get_or_create_named(db_session, Tag, docform.tags.data)
+        document.sources = get_or_create_named(db_session, Source, docform.sources.data)
+
+        # Save the files into the store before the commit,
+        # content addressed files only get their path once they're hashed
         save_files = []
         folder = Path(
             current_app.config["STORE_PATH"], current_app.config["STORE_NAME"]
         )
+        content_addressed = current_app.config["CONTENT_ADDRESSED"]
+
+        def add_file(filename, save):
+            safe_name = secure_filename(filename)
+            outpath, sha256, created = store_file(
+                folder, safe_name, save, content_addressed
+            )
+
+            store_filepath = str(outpath.relative_to(folder))
+            db_file = File(path=store_filepath, original_name=safe_name, sha256=sha256)
+            document.files.append(db_file)
+
+            save_files.append((filename, outpath, db_file, created))
 
         # Check for 'files' which seems to actually always exist (why if no files are chosen!?)
         # Also check the first file has a filename
         # Flask seems to just get an empty file if no files are chosen
         if "files" in request.files and request.files["files"].filename:
             for file in request.files.getlist("files"):
-                safe_name = secure_filename(file.filename)
-                outpath = prepare_storepath(folder / safe_name)
-
-                store_filepath = str(outpath.relative_to(folder))
-                db_file = File(path=store_filepath, original_name=safe_name)
-                document.files.append(db_file)
-
-                save_files.append((file, outpath))
+                add_file(file.filename, partial(save_upload, file))
+
+        # Files that were sent ahead in chunks through the upload API
+        for upload_id in filter(None, (docform.uploads.data or "").split(",")):
+            try:
+                info = upload_info(upload_id)
+                add_file(info["filename"], partial(finish_upload, upload_id))
+            except UploadNotFoundError:
+                flash(f"Upload {upload_id} not found", "danger")
+            except UploadIncompleteError as exc:
+                flash(
+                    f"Upload of {info['filename']} is incomplete, only "
+                    f"{exc.offset} of {exc.size} bytes arrived",
+                    "danger",
+                )
 
         db_session.add(document)
         try:
@@ -161,7 +256,12 @@ def edit_document():
         except IntegrityError as exc:
             flash(f"Document addition failed: {exc}", "danger")
             db_session.rollback()
+            for _, outpath, _, created in save_files:
+                if created:
+                    outpath.unlink(missing_ok=True)
         else:
+            get_result_cache().invalidate_documents([document.id])
+
             # Send them to the new document
             if edit_type == "new":
                 success_message = f"Successfully added document: {document.title}"
@@ -169,27 +269,34 @@ def edit_document():
                 success_message = f"Successfully edited document: {document.title}"
             flash(success_message, "success")
 
-            for file, outpath in save_files:
-                if docform.compress_pdf.data and outpath.suffix == ".pdf":
-                    with TemporaryDirectory(prefix="temp_", dir=folder) as tmpdir:
-                        tmp_file = Path(tmpdir) / Path(outpath).name
-                        file.save(tmp_file)
-                        result = compress_pdf(tmp_file, outpath)
-                        if result.returncode == 0:
-                            flash(
-                                f"Uploaded & Compressed "
-                                f"{file.filename} as {outpath.name}"
-                            )
-                        else:
-                            shutil.copyfile(tmp_file, outpath)
-                            flash(
-                                f"Uploaded, Failed to Compress "
-                                f"{file.filename} as {outpath.name}"
-                            )
-
+            compress_files = []
+            for filename, outpath, db_file, created in save_files:
+                if not created:
+                    flash(f"Uploaded {filename}, an identical file is already stored")
+                elif docform.compress_pdf.data and outpath.suffix == ".pdf":
+                    compress_files.append((db_file.id, outpath))
+                    flash(f"Uploaded {filename} as {outpath.name}, compression queued")
                 else:
-                    file.save(outpath)
-                    flash(f"Uploaded {file.filename} as {outpath.name}")
+                    flash(f"Uploaded {filename} as {outpath.name}")
+
+            text_queue = get_text_queue()
+            text_jobs = {
+                db_file.id: text_queue.submit(db_file.id)
+                for _, _, db_file, _ in save_files
+            }
+
+            # Queue after the commit, compression updates the stored hash.
+            # Text is read first as scans are clearer for OCR before compression
+            compression = get_compression_queue()
+            for file_id, outpath in compress_files:
+                compression.submit(file_id, outpath, after=text_jobs[file_id])
+
+            # Files being compressed get a new hash, so a new thumbnail, later
+            thumbnails = get_thumbnail_cache()
+            compressing = {file_id for file_id, _ in compress_files}
+            for _, outpath, db_file, _ in save_files:
+                if db_file.id not in compressing:
+                    thumbnails.warm(outpath, _thumbnail_key(db_file, outpath))
 
             return redirect(url_for(".edit_document", doc_id=document.id))
 
@@ -215,21 +322,21 @@ def delete_document():
     store_folder = Path(
         current_app.config["STORE_PATH"], current_app.config["STORE_NAME"]
     )
-    pending_deletion = [
-        (file.original_name, file.full_path(store_folder)) for file in doc.files
-    ]
+    file_names = {file.path: file.original_name for file in doc.files}
 
     # Remove the document
     db_session.delete(doc)
     db_session.commit()
+    get_result_cache().invalidate_documents([doc.id])
     flash(f"Document: {doc.title} removed from the database.")
 
-    # Clean up the associated files
-    for fname, fpath in pending_deletion:
-        try:
-            fpath.unlink()
-        except FileNotFoundError:
+    # Clean up the associated files, unless another document shares them
+    for path, state in release_files(db_session, store_folder, file_names):
+        fname = file_names[path]
+        if state == "missing":
             flash(f"Could not delete: {fname}", "error")
+        elif state == "shared":
+            flash(f"Kept: {fname}, it is shared with another document")
         else:
             flash(f"Deleted: {fname}")
 
@@ -239,17 +346,22 @@ def delete_document():
 @duckstore.route("/docdata", methods=["POST"])
 def get_data():
     docid = int(request.form.get("docid"))
-    result = db_session.execute(select(Document).where(Document.id == docid))
-    document = result.scalars().one_or_none()
-    if document:
-        data = document.to_dict()
-        return jsonify(data)
+    data = get_document_data(db_session, [docid])
+    if data:
+        return current_app.response_class(data[0], mimetype="application/json")
     else:
         return "Document not found", 404
 
 
 @duckstore.route("/download")
 def download_file():
+    """
+    Send a stored file, as an attachment unless ?inline=1 is given for previews
+
+    Range requests are supported so large files can be viewed in the browser
+    without downloading the whole thing. The stored hash is used as the ETag
+    so an unchanged file is never sent twice.
+    """
     file_id = request.args.get("file_id", None)
     if file_id:
         file = (
@@ -261,14 +373,140 @@ def download_file():
             folder = Path(
                 current_app.config["STORE_PATH"], current_app.config["STORE_NAME"]
             )
+            as_attachment = not request.args.get("inline")
+            accel_prefix = current_app.config["X_ACCEL_REDIRECT_PREFIX"]
+            if accel_prefix:
+                return _accel_redirect(accel_prefix, folder, file, as_attachment)
+
             result = send_from_directory(
                 folder,
                 file.path,
                 download_name=file.original_name,
-                as_attachment=True,
+                as_attachment=as_attachment,
+                etag=file.sha256 or True,
             )
             return result
         else:
             return "File not found", 404
     else:
         return "File not found", 404
+
+
+def _accel_redirect(prefix, folder, file, as_attachment):
+    # Hand the file over to nginx, which deals with ranges and conditional requests
+    if not file.full_path(folder).is_file():
+        return "File not found", 404
+
+    response = current_app.response_class(
+        mimetype=mimetypes.guess_type(file.original_name)[0]
+        or "application/octet-stream"
+    )
+    location = f"{prefix.rstrip('/')}/{Path(file.path).as_posix()}"
+    response.headers["X-Accel-Redirect"] = quote(location)
+    response.headers.set(
+        "Content-Disposition",
+        "attachment" if as_attachment else "inline",
+        filename=file.original_name,
+    )
+    if file.sha256:
+        response.set_etag(file.sha256)
+    return response
+
+
+@duckstore.route("/download/zip")
+def download_zip():
+    """
+    Stream a zip of the files of every document in a search
+
+    Takes the same arguments as the search page, or doc_id repeated for
+    a list of documents. Each document gets a folder in the zip.
+    """
+    doc_ids = request.args.getlist("doc_id", type=int)
+    search = None if doc_ids else _search_args(request.args)
+    folder = Path(current_app.config["STORE_PATH"], current_app.config["STORE_NAME"])
+
+    engine = db_session.get_bind()
+
+    def find_documents(session):
+        if search is not None:
+            return iter_documents(session, **search)
+        query = (
+            select(Document)
+            .where(Document.id.in_(doc_ids))
+            .order_by(Document.id)
+            .options(selectinload(Document.files))
+        )
+        return session.execute(query).scalars()
+
+    def entries():
+        # The request's session is closed by the time the response is streamed,
+        # so the documents are looked up here in a session of their own
+        missing = []
+        with Session(engine) as session:
+            for document in find_documents(session):
+                doc_folder = secure_filename(f"{document.id} {document.title}")
+                used_names = set()
+                for file in document.files:
+                    path = file.full_path(folder)
+                    if not path.is_file():
+                        missing.append(f"{doc_folder}/{file.original_name}")
+                        continue
+                    name = _unique_name(secure_filename(file.original_name), used_names)
+                    yield f"{doc_folder}/{name}", path
+        if missing:
+            yield "missing_files.txt", "\n".join(missing).encode()
+
+    download_name = f"duckstore_{datetime.today():%Y-%m-%d}.zip"
+    return current_app.response_class(
+        stream_with_context(stream_zip(entries())),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={download_name}"},
+    )
+
+
+def _unique_name(name, used_names):
+    # Two files of a document can share an original name
+    stem, suffix = Path(name).stem, Path(name).suffix
+    number = 1
+    while name in used_names:
+        number += 1
+        name = f"{stem}_{number}{suffix}"
+    used_names.add(name)
+    return name
+
+
+def _thumbnail_key(file, path):
+    # Files stored before hashes were recorded go by their modification time
+    return file.sha256 or f"file{file.id}_{path.stat().st_mtime_ns}"
+
+
+@duckstore.route("/thumbnail/<int:file_id>")
+def thumbnail(file_id):
+    """
+    PNG preview of the first page of a stored file
+
+    Links include the file's hash as ?v= so the preview can be cached
+    by the browser for as long as it likes, a changed file gets a new link.
+    """
+    file = db_session.get(File, file_id)
+    if not file:
+        return "File not found", 404
+
+    folder = Path(current_app.config["STORE_PATH"], current_app.config["STORE_NAME"])
+    path = file.full_path(folder)
+    if not path.is_file():
+        return "File not found", 404
+
+    thumbnail_path = get_thumbnail_cache().get(path, _thumbnail_key(file, path))
+    if thumbnail_path is None:
+        return "No preview available", 404
+
+    versioned = file.sha256 and request.args.get("v") == file.sha256
+    response = send_file(
+        thumbnail_path,
+        mimetype="image/png",
+        max_age=365 * 24 * 60 * 60 if versioned else 0,
+    )
+    if versioned:
+        response.cache_control.immutable = True
+    return response
@@ -4,7 +4,7 @@ from tempfile import TemporaryDirectory
 
 import pytest
 from duckstore.app import create_app
-from duckstore.database import create_db
+from duckstore.database import create_db, db_session
 from duckstore.config import db_name
 
 src_folder = Path("./src").resolve()
@@ -39,6 +39,11 @@ def client():
 
     with TemporaryDirectory(dir=store_base) as folder:
         app = create_app(folder_path=folder, create=True)
+        # Flashing messages needs a key, and forms are posted directly
+        app.config.update(SECRET_KEY="testing", WTF_CSRF_ENABLED=False)
 
         with app.test_client() as client:
             yield client
+
+        # Tests may use the session outside of a request
+        db_session.remove()
@@ -0,0 +1,207 @@
+"""
+Test cached data is reused and invalidated when the store changes
+"""
+from datetime import date
+from pathlib import Path
+
+from sqlalchemy import event, func, insert, select
+
+from duckstore.cache import (
+    DiskBackend,
+    KeyedGenerationCache,
+    ResultCache,
+    get_choices,
+    get_facets,
+)
+from duckstore.database import db_session
+from duckstore.database.models import Document, Source, Tag, clear_unused
+
+
+def test_choices_follow_generation(client):
+    with client.application.app_context():
+        db_session.add_all([Tag(name="bills"), Tag(name="car"), Source(name="bank")])
+        db_session.commit()
+
+        choices, generation = get_choices(db_session)
+        assert choices == {"tags": ["bills", "car"], "sources": ["bank"]}
+        assert get_choices(db_session)[0] is choices
+
+        # Any commit is a new generation, even one made without the app
+        with db_session.get_bind().begin() as connection:
+            connection.execute(insert(Tag).values(name="annual"))
+        choices, new_generation = get_choices(db_session)
+        assert new_generation != generation
+        assert choices["tags"] == ["annual", "bills", "car"]
+
+        clear_unused(db_session)
+        assert get_choices(db_session)[0] == {"tags": [], "sources": []}
+
+
+def test_choices_etag(client):
+    response = client.get("/api/choices")
+    etag = response.headers["ETag"]
+    assert response.json == {"tags": [], "sources": []}
+
+    response = client.get("/api/choices", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    client.post(
+        "/edit",
+        data={"title": "Invoice", "date_received": "2022-03-01", "tags": ["work"]},
+    )
+    assert db_session.execute(select(func.count(Document.id))).scalar() == 1
+
+    response = client.get("/api/choices", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json == {"tags": ["work"], "sources": []}
+
+
+def test_facets_cached_by_search(client):
+    calls = []
+
+    def build(session, **search):
+        calls.append(search)
+        return len(calls)
+
+    cache = KeyedGenerationCache(build, maxsize=2)
+    assert cache.get("a", db_session, x=1)[0] == 1
+    assert cache.get("a", db_session, x=1)[0] == 1
+    assert cache.get("b", db_session)[0] == 2
+    assert cache.get("c", db_session)[0] == 3
+    # Least recently used value was dropped
+    assert cache.get("a", db_session)[0] == 4
+    db_session.add(Tag(name="new"))
+    db_session.commit()
+    assert cache.get("a", db_session)[0] == 5
+
+    # Equivalent searches share the same entry
+    with client.application.app_context():
+        first, generation = get_facets(db_session, "Gas bill", tags=["b", "a"])
+        again = get_facets(db_session, "gas, bill!", tags=["a", "b", "a"])
+    assert again[0] is first
+
+
+def test_repeated_search_skips_database(client):
+    for i in range(3):
+        client.post(
+            "/edit",
+            data={
+                "title": f"Invoice {i}",
+                "date_received": "2022-03-01",
+                "tags": ["work"],
+            },
+        )
+
+    statements = []
+    engine = db_session.get_bind()
+    record = lambda *args: statements.append(args[2])  # noqa: E731
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        first = client.get("/", query_string={"query": "invoice", "tags": "work"})
+        assert statements
+        statements.clear()
+        again = client.get("/", query_string={"query": "INVOICE!", "tags": "work"})
+        # Only the write generation is read, to check the cache is current
+        assert all("write_generation" in statement for statement in statements)
+        assert b"Invoice 0" in again.data and b"Invoice 2" in again.data
+        statements.clear()
+        assert client.post("/docdata", data={"docid": 1}).json["title"] == "Invoice 0"
+        assert statements == []
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    # Editing a document replaces its cached JSON and the search results
+    client.post(
+        "/edit?doc_id=1",
+        data={"title": "Receipt", "date_received": "2022-03-01", "tags": ["work"]},
+    )
+    assert client.post("/docdata", data={"docid": 1}).json["title"] == "Receipt"
+    client.get("/edit?doc_id=1")  # Show the flashed message
+    response = client.get("/", query_string={"query": "invoice", "tags": "work"})
+    assert b"Receipt" not in response.data
+    assert b"Invoice 2" in response.data
+
+    client.get("/delete?doc_id=2")
+    assert client.post("/docdata", data={"docid": 2}).status_code == 404
+
+
+def test_result_cache_skips_invalidated_loads():
+    cache = ResultCache()
+
+    def load(ids):
+        # A change is committed while the documents are being read
+        cache.invalidate_documents(ids)
+        return {doc_id: f"old {doc_id}" for doc_id in ids}
+
+    assert cache.documents([1, 2], load) == ["old 1", "old 2"]
+    assert cache.documents([2], lambda ids: {2: "new 2"}) == ["new 2"]
+    assert cache.documents([2, 3], lambda ids: {}) == ["new 2"]
+
+
+def test_disk_backend_is_shared(tmp_path):
+    path = tmp_path / "results.db"
+    first, second = ResultCache(DiskBackend(path)), ResultCache(DiskBackend(path))
+    calls = []
+
+    def build():
+        calls.append(1)
+        return [3, 2, 1], "cursor"
+
+    assert first.search(["gas"], 1, build) == ([3, 2, 1], "cursor")
+    assert second.search(["gas"], 1, build) == ([3, 2, 1], "cursor")
+    assert len(calls) == 1
+
+    # A write in any process moves the store to a new generation
+    second.search(["gas"], 2, build)
+    assert len(calls) == 2
+
+    assert first.documents([1], lambda ids: {1: '{"id": 1}'}) == ['{"id": 1}']
+    assert second.documents([1], lambda ids: {}) == ['{"id": 1}']
+    second.invalidate_documents([1])
+    assert first.documents([1], lambda ids: {1: '{"id": 2}'}) == ['{"id": 2}']
+
+    # Opening the file again starts afresh
+    backend = DiskBackend(path, maxsize=10)
+    assert backend.get('search:1:["gas"]') is None
+    assert first.documents([1], lambda ids: {1: '{"id": 3}'}) == ['{"id": 3}']
+
+    # Least recently used entries are trimmed
+    for i in range(100):
+        backend.set(f"key {i}", "value")
+    assert backend.get("key 99") == "value"
+    assert backend.get("key 0") is None
+
+
+def test_caches_are_per_store(tmp_path):
+    from duckstore.app import create_app
+
+    for name, tag in [("first", "bills"), ("second", "car")]:
+        (tmp_path / name).mkdir()
+        app = create_app(tmp_path / name, create=True)
+        with app.app_context():
+            db_session.add(Tag(name=tag))
+            db_session.commit()
+            # Both stores are at the same generation, each has its own cache
+            assert get_choices(db_session)[0]["tags"] == [tag]
+        app.extensions["duckstore_compression"].shutdown()
+        app.extensions["duckstore_text"].shutdown()
+        app.extensions["duckstore_thumbnails"].shutdown()
+
+
+def test_writes_from_other_processes_are_seen(client):
+    from duckstore.config import db_name
+    from duckstore.database.database import get_engine
+
+    client.post("/edit", data={"title": "Gas invoice", "date_received": "2022-03-01"})
+    client.get("/")  # Show the flashed message
+    assert b"Water invoice" not in client.get("/?query=invoice").data
+
+    # As a command line import would, with its own engine
+    engine = get_engine(Path(client.application.config["STORE_PATH"], db_name))
+    with engine.begin() as connection:
+        connection.execute(
+            insert(Document).values(title="Water invoice", date_received=date.today())
+        )
+    engine.dispose()
+
+    assert b"Water invoice" in client.get("/?query=invoice").data
@@ -0,0 +1,147 @@
+"""
+Test exporting the catalogue and importing it into another store
+"""
+import json
+from datetime import date, datetime
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+from duckstore.catalogue import export_catalogue, import_catalogue
+from duckstore.config import db_name
+from duckstore.database import bind_session, db_session
+from duckstore.database.models import Document, File, Source, Tag
+from duckstore.jobs import missing_text_ids
+from duckstore.scripts.catalogue import export_command, import_catalogue_command
+
+
+def fill_store(folder):
+    bind_session(Path(folder) / db_name)
+    bank, council = Source(name="Bank"), Source(name="Council")
+    bills, tax = Tag(name="Bills"), Tag(name="Tax")
+    for i in range(7):
+        document = Document(
+            title=f"Letter {i}",
+            description="Tax bill" if i % 2 else None,
+            date_added=datetime(2022, 1, 1, 12, 30),
+            date_received=date(2021, 3, i + 1) if i else None,
+        )
+        document.sources = [bank] if i % 2 else [council]
+        document.tags = [bills, tax] if i % 3 else [bills]
+        document.files = [
+            File(
+                path=f"letter_{i}.pdf",
+                original_name="letter.pdf",
+                sha256=f"{i:064x}",
+                text=f"letter {i}",
+            )
+        ]
+        if i == 3:
+            document.files.append(File(path="notes.txt", sha256="f" * 64, text="notes"))
+        db_session.add(document)
+    db_session.commit()
+    records = list(export_catalogue(db_session, batch_size=3))
+    db_session.remove()
+    return records
+
+
+@pytest.mark.parametrize("suffix", [".jsonl", ".parquet"])
+def test_catalogue_round_trip(db_folder, tmp_path, suffix):
+    if suffix == ".parquet":
+        pytest.importorskip("pyarrow")
+
+    records = fill_store(db_folder)
+    assert len(records) == 7
+    assert records[0]["date_received"] is None
+    assert records[1]["tags"] == ["Bills", "Tax"]
+    assert [file["text"] for file in records[3]["files"]] == ["letter 3", "notes"]
+
+    runner = CliRunner()
+    output = tmp_path / f"catalogue{suffix}"
+    result = runner.invoke(
+        export_command, [db_folder, str(output), "--batch-size", "2"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "Exported 7 documents" in result.output
+
+    new_folder = tmp_path / "new_store"
+    args = [str(new_folder), str(output), "--batch-size", "3"]
+    result = runner.invoke(import_catalogue_command, args)
+    assert result.exit_code != 0
+    assert "use --create" in result.output
+
+    result = runner.invoke(import_catalogue_command, [*args, "--create"])
+    assert result.exit_code == 0, result.output
+    assert "Imported 7 documents, skipped 0" in result.output
+
+    bind_session(new_folder / db_name)
+    assert list(export_catalogue(db_session)) == records
+    # Imported text is kept, nothing needs reading again
+    assert missing_text_ids(db_session) == []
+    db_session.remove()
+
+    # Running it again finds everything already there
+    result = runner.invoke(import_catalogue_command, args)
+    assert "Imported 0 documents, skipped 7" in result.output
+
+
+def test_import_new_ids(db_folder):
+    records = fill_store(db_folder)
+    bind_session(Path(db_folder) / db_name)
+
+    # Same files are skipped, the rest are added after the existing documents
+    records[0]["files"][0]["sha256"] = "e" * 64
+    result = import_catalogue(db_session, records, keep_ids=False, batch_size=4)
+    assert result == (1, 6)
+
+    added = db_session.get(Document, 8)
+    assert added.title == "Letter 0"
+    assert [tag.name for tag in added.tags] == ["Bills"]
+    assert [source.name for source in added.sources] == ["Council"]
+    assert added.files[0].id == 9
+
+    # Files without a hash are matched on their path
+    records[5]["files"][0]["sha256"] = None
+    db_session.get(Document, 6).files[0].sha256 = None
+    db_session.commit()
+    assert import_catalogue(db_session, records, keep_ids=False) == (0, 7)
+
+    # Documents without files are matched on their title and dates
+    records[2]["files"] = []
+    records[2]["title"] = "Letter without files"
+    assert import_catalogue(db_session, records, keep_ids=False) == (1, 6)
+    assert import_catalogue(db_session, records, keep_ids=False) == (0, 7)
+
+    # Keeping ids, documents whose file ids are taken are skipped too
+    records[0]["id"] = 20
+    assert import_catalogue(db_session, records[:1]) == (0, 1)
+    records[0]["files"][0]["id"] = 20
+    assert import_catalogue(db_session, records[:1]) == (1, 0)
+    db_session.remove()
+
+
+def test_export_endpoint(client):
+    response = client.post(
+        "/edit",
+        data={
+            "title": "Statement",
+            "date_received": "2022-03-01",
+            "tags": ["Bank"],
+            "files": (BytesIO(b"statement"), "statement.txt"),
+        },
+    )
+    assert response.status_code == 302
+
+    response = client.get("/api/export")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert "duckstore_catalogue.jsonl" in response.headers["Content-Disposition"]
+    (record,) = [json.loads(line) for line in response.text.splitlines()]
+    assert record["title"] == "Statement"
+    assert record["date_received"] == "2022-03-01"
+    assert record["tags"] == ["Bank"]
+    assert record["files"][0]["original_name"] == "statement.txt"
+
+    assert client.get("/api/export?format=csv").status_code == 400
@@ -0,0 +1,176 @@
+"""
+Test the database helper functions
+"""
+import sqlite3
+from pathlib import Path
+
+import pytest
+from sqlalchemy import func, select, text
+
+from duckstore.config import db_name
+from duckstore.database import db_session, checkpoint_db, upgrade_db
+from duckstore.database.database import get_engine
+from duckstore.exceptions import CheckpointError
+from duckstore.database.models import Tag, get_or_create_named
+
+
+def test_get_or_create_named(client):
+    db_session.add(Tag(name="bills"))
+    db_session.commit()
+
+    tags = get_or_create_named(db_session, Tag, ["car ", "bills", "", "car", "tax"])
+    db_session.commit()
+
+    assert [tag.name for tag in tags] == ["car", "bills", "tax"]
+    assert all(tag.id is not None for tag in tags)
+    assert db_session.execute(select(func.count(Tag.id))).scalar() == 3
+
+    # Names already in the database are reused
+    again = get_or_create_named(db_session, Tag, ["tax", "car"])
+    assert again == [tags[2], tags[0]]
+    assert get_or_create_named(db_session, Tag, [" "]) == []
+
+
+def test_engine_profile(db_folder):
+    db_path = Path(db_folder, db_name)
+
+    engine = get_engine(db_path)
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA foreign_keys")).scalar() == 1
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        connection.execute(text("INSERT INTO tag (name) VALUES ('unsaved')"))
+        connection.commit()
+    engine.dispose()
+
+    # Nothing is left in the log once it has been checkpointed
+    checkpoint_db(db_path)
+    wal_path = Path(db_folder, f"{db_name}-wal")
+    assert not wal_path.exists() or wal_path.stat().st_size == 0
+
+    # A reader still on an older snapshot keeps the checkpoint from finishing
+    reader = sqlite3.connect(db_path, isolation_level=None)
+    reader.execute("BEGIN")
+    reader.execute("SELECT name FROM tag").fetchall()
+    engine = get_engine(db_path)
+    with engine.connect() as connection:
+        connection.execute(text("INSERT INTO tag (name) VALUES ('pending')"))
+        connection.commit()
+        with pytest.raises(CheckpointError):
+            checkpoint_db(db_path, attempts=2, delay=0)
+        reader.close()
+        checkpoint_db(db_path)
+    engine.dispose()
+
+    engine = get_engine(db_path, profile="compat")
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA foreign_keys")).scalar() == 0
+        names = connection.execute(text("SELECT name FROM tag")).scalars().all()
+        assert names == ["unsaved", "pending"]
+    engine.dispose()
+
+
+def test_migrations_match_models(db_folder):
+    from alembic.autogenerate import compare_metadata
+    from alembic.migration import MigrationContext
+
+    from duckstore.database.models import Base
+    from duckstore.database.search import fts_name
+
+    def include_name(name, type_, parent_names):
+        return type_ != "table" or not name.startswith(fts_name)
+
+    engine = get_engine(Path(db_folder, db_name))
+    with engine.connect() as connection:
+        context = MigrationContext.configure(
+            connection, opts={"include_name": include_name}
+        )
+        assert compare_metadata(context, Base.metadata) == []
+
+        # Listing by date reads the index instead of sorting the table
+        plan = connection.execute(
+            text(
+                "EXPLAIN QUERY PLAN SELECT id FROM document "
+                "ORDER BY date_received DESC, id DESC"
+            )
+        ).all()
+        assert "ix_document_date_received" in plan[0][-1]
+    engine.dispose()
+
+
+def test_upgrade_unversioned_store(tmp_path):
+    from alembic import command
+
+    from duckstore.database.database import _alembic_config, baseline_revision
+
+    # A store made before migrations were used has the baseline tables
+    # but no alembic_version table
+    db_path = tmp_path / db_name
+    engine = get_engine(db_path, profile="compat")
+    with engine.begin() as connection:
+        command.upgrade(_alembic_config(connection), baseline_revision)
+        connection.execute(text("DROP TABLE alembic_version"))
+        connection.execute(
+            text("INSERT INTO document (id, title) VALUES (1, 'Old letter')")
+        )
+    engine.dispose()
+
+    old_revision, new_revision = upgrade_db(db_path)
+    assert old_revision is None
+    assert upgrade_db(db_path) is None
+
+    engine = get_engine(db_path)
+    with engine.connect() as connection:
+        index_names = {
+            row[0]
+            for row in connection.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'index'")
+            )
+        }
+        assert {
+            "ix_file_document_id",
+            "ix_associate_document_tag_tag_id",
+        } <= index_names
+
+        # Documents already in the store are added to the search index
+        found = connection.execute(
+            text("SELECT rowid FROM document_fts WHERE document_fts MATCH 'letter'")
+        ).scalars()
+        assert list(found) == [1]
+    engine.dispose()
+
+
+def test_document_dicts_match_to_dict(client):
+    from datetime import date
+
+    from duckstore.database.models import Document, File, Source
+    from duckstore.database.serialize import document_dicts
+
+    bills, car = Tag(name="bills"), Tag(name="car")
+    documents = [
+        Document(
+            title="Car insurance",
+            date_received=date(2022, 3, 1),
+            tags=[car, bills],
+            sources=[Source(name="Insurer")],
+            files=[
+                File(path="policy.pdf", original_name="policy.pdf", sha256="ab"),
+                File(path="schedule.pdf", original_name="schedule.pdf"),
+            ],
+        ),
+        # No date received, tags, sources or files
+        Document(title="Unknown letter", location="Drawer"),
+    ]
+    db_session.add_all(documents)
+    db_session.commit()
+
+    ids = [document.id for document in documents]
+    dicts = document_dicts(db_session, ids + [999])
+    assert list(dicts) == ids
+    for document in documents:
+        expected = document.to_dict()
+        expected["tags"].sort(key=lambda tag: tag["name"])
+        assert dicts[document.id] == expected
+
+    assert dicts[ids[1]]["date_received"] is None
+    assert dicts[ids[1]]["files"] == []
@@ -0,0 +1,117 @@
+"""
+Test stored files are sent with ranges and conditional requests
+"""
+import hashlib
+import io
+import zipfile
+from datetime import date
+from pathlib import Path
+
+from duckstore.database import db_session
+from duckstore.database.models import Document, File
+
+
+def add_file(client, content):
+    config = client.application.config
+    folder = Path(config["STORE_PATH"], config["STORE_NAME"])
+    Path(folder, "scan.pdf").write_bytes(content)
+
+    sha256 = hashlib.sha256(content).hexdigest()
+    document = Document(title="Scan")
+    document.files.append(
+        File(path="scan.pdf", original_name="scan.pdf", sha256=sha256)
+    )
+    db_session.add(document)
+    db_session.commit()
+    return document.files[0].id, sha256
+
+
+def test_download_conditional_and_range(client):
+    content = bytes(range(256)) * 40
+    file_id, sha256 = add_file(client, content)
+
+    response = client.get("/download", query_string={"file_id": file_id})
+    assert response.data == content
+    assert response.headers["ETag"] == f'"{sha256}"'
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.headers["Content-Disposition"].startswith("attachment")
+
+    response = client.get(
+        "/download",
+        query_string={"file_id": file_id},
+        headers={"If-None-Match": f'"{sha256}"'},
+    )
+    assert response.status_code == 304
+
+    response = client.get(
+        "/download",
+        query_string={"file_id": file_id, "inline": 1},
+        headers={"Range": "bytes=100-199"},
+    )
+    assert response.status_code == 206
+    assert response.data == content[100:200]
+    assert response.headers["Content-Range"] == f"bytes 100-199/{len(content)}"
+    assert response.headers["Content-Disposition"].startswith("inline")
+
+    # A range against an old version of the file gets the whole new file
+    response = client.get(
+        "/download",
+        query_string={"file_id": file_id},
+        headers={"Range": "bytes=0-9", "If-Range": '"outdated"'},
+    )
+    assert response.status_code == 200
+    assert response.data == content
+
+
+def test_download_accel_redirect(client):
+    client.application.config["X_ACCEL_REDIRECT_PREFIX"] = "/protected/"
+    file_id, sha256 = add_file(client, b"%PDF-1.4")
+
+    response = client.get("/download", query_string={"file_id": file_id})
+    assert response.status_code == 200
+    assert response.data == b""
+    assert response.headers["X-Accel-Redirect"] == "/protected/scan.pdf"
+    assert response.headers["ETag"] == f'"{sha256}"'
+    assert response.mimetype == "application/pdf"
+
+
+def test_download_zip(client):
+    config = client.application.config
+    folder = Path(config["STORE_PATH"], config["STORE_NAME"])
+    for name in ["a.pdf", "b.pdf", "c.txt"]:
+        Path(folder, name).write_bytes(name.encode() * 1000)
+
+    tax = Document(title="Tax return", date_received=date(2022, 4, 5))
+    tax.files = [
+        File(path="a.pdf", original_name="return.pdf"),
+        File(path="b.pdf", original_name="return.pdf"),
+        File(path="gone.pdf", original_name="gone.pdf"),
+    ]
+    letter = Document(title="Letter", date_received=date(2022, 1, 1))
+    letter.files = [File(path="c.txt", original_name="letter.txt")]
+    db_session.add_all([tax, letter])
+    db_session.commit()
+    tax_folder = f"{tax.id}_Tax_return"
+    letter_id = letter.id
+
+    response = client.get("/download/zip", query_string={"query": "tax"})
+    assert response.mimetype == "application/zip"
+    assert response.is_streamed
+
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+        assert zf.namelist() == [
+            f"{tax_folder}/return.pdf",
+            f"{tax_folder}/return_2.pdf",
+            "missing_files.txt",
+        ]
+        assert zf.read(f"{tax_folder}/return_2.pdf") == b"b.pdf" * 1000
+        assert zf.read("missing_files.txt") == f"{tax_folder}/gone.pdf".encode()
+
+    response = client.get("/download/zip", query_string={"doc_id": [letter_id]})
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+        assert zf.namelist() == [f"{letter_id}_Letter/letter.txt"]
+
+    # Names that aren't in the store match nothing, rather than being ignored
+    response = client.get("/download/zip", query_string={"tags": "Nope"})
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+        assert zf.namelist() == []
@@ -0,0 +1,127 @@
+"""
+Test importing a folder tree of files
+"""
+from datetime import date
+from pathlib import Path
+
+from click.testing import CliRunner
+from sqlalchemy import select
+
+from duckstore.config import db_name, store_name
+from duckstore.database import bind_session, db_session
+from duckstore.database.models import Document, File
+from duckstore.importer import describe_file, import_files, plan_import
+from duckstore.jobs import TextExtractionQueue
+from duckstore.scripts.importer import import_folder
+
+
+def make_tree(root):
+    files = {
+        "Bank/Statements/statement_2021-03-04.pdf": b"march statement",
+        "Bank/Statements/statement_2021-04-04.pdf": b"april statement",
+        "Bank/letter 20200102.txt": b"letter",
+        "Council/tax bill.pdf": b"tax bill",
+        "Council/tax bill copy.pdf": b"tax bill",
+        ".hidden/secret.pdf": b"secret",
+    }
+    for name, content in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+
+def test_describe_file(tmp_path):
+    path = tmp_path / "Bank" / "Statements" / "statement_2021-03-04.pdf"
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"")
+
+    item = describe_file(tmp_path, path)
+    assert item.title == "statement"
+    assert item.date_received == date(2021, 3, 4)
+    assert item.tags == ["Bank", "Statements"]
+    assert item.sources == []
+
+    item = describe_file(tmp_path, path, folder_tags=False, source_depth=1)
+    assert item.tags == []
+    assert item.sources == ["Bank"]
+
+    pattern = r"(?P<tag>[a-z]+)_(?P<date>\d{4}-\d{2}-\d{2})"
+    item = describe_file(tmp_path, path, pattern, source_depth=2)
+    assert item.tags == ["Bank", "statement"]
+    assert item.sources == ["Statements"]
+
+    # Without a date in the name the file modification date is used
+    other = tmp_path / "tax_bill.pdf"
+    other.write_bytes(b"")
+    item = describe_file(tmp_path, other)
+    assert item.title == "tax bill"
+    assert item.date_received == date.fromtimestamp(other.stat().st_mtime)
+
+
+def test_import_files(db_folder, tmp_path):
+    make_tree(tmp_path)
+    folder = Path(db_folder)
+    store_folder = folder / store_name
+    store_folder.mkdir()
+    bind_session(folder / db_name)
+
+    items = list(plan_import(tmp_path, source_depth=1))
+    assert len(items) == 5
+
+    # A short queue, so adding the files waits for the workers
+    text_queue = TextExtractionQueue(store_folder, workers=1, max_queued=1)
+    result = import_files(
+        db_session, items, store_folder, batch_size=2, workers=2, text_queue=text_queue
+    )
+    text_queue.wait()
+    text_queue.shutdown()
+    assert result.imported == 4
+    assert [path.name for path in result.duplicates] == ["tax bill.pdf"]
+    assert len(result.compress) == 3
+
+    documents = db_session.execute(select(Document)).scalars().all()
+    assert len(documents) == 4
+    march = next(doc for doc in documents if doc.date_received == date(2021, 3, 4))
+    assert [tag.name for tag in march.tags] == ["Statements"]
+    assert [source.name for source in march.sources] == ["Bank"]
+    assert (store_folder / march.files[0].path).read_bytes() == b"march statement"
+    letter = next(doc for doc in documents if doc.title == "letter")
+    assert letter.date_received == date(2020, 1, 2)
+    assert letter.files[0].text == "letter"
+
+    # Running again skips everything already imported
+    result = import_files(db_session, items, store_folder, batch_size=2)
+    assert result.imported == 0
+    assert len(result.duplicates) == 5
+    assert len(db_session.execute(select(File)).scalars().all()) == 4
+
+    db_session.remove()
+
+
+def test_import_command_links(tmp_path):
+    source = tmp_path / "source"
+    make_tree(source)
+    folder = tmp_path / "store"
+    folder.mkdir()
+
+    runner = CliRunner()
+    result = runner.invoke(import_folder, [str(folder), str(source), "--dry-run"])
+    assert result.exit_code == 0
+    assert "5 files would be imported." in result.output
+    assert not (folder / db_name).exists()
+
+    result = runner.invoke(import_folder, [str(folder), str(source)])
+    assert result.exit_code != 0
+    assert "use --create" in result.output
+
+    result = runner.invoke(
+        import_folder, [str(folder), str(source), "--create", "--link"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "Imported 4 documents, skipped 1 files" in result.output
+
+    db_session.remove()
+    original = source / "Council" / "tax bill copy.pdf"
+    stored = list((folder / store_name).glob("tax_bill*.pdf"))
+    assert len(stored) == 1
+    assert stored[0].samefile(original)
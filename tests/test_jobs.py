@@ -0,0 +1,168 @@
+"""
+Test the background compression and text extraction queues
+"""
+import hashlib
+from concurrent.futures import Future
+from io import BytesIO
+from pathlib import Path
+from subprocess import CompletedProcess
+from unittest.mock import patch
+
+from sqlalchemy import select, update
+
+from duckstore.database import db_session
+from duckstore.database.models import File
+from duckstore.jobs import (
+    CompressionQueue,
+    DONE,
+    FAILED,
+    QUEUED,
+    extract_file_text,
+    missing_text_ids,
+)
+from duckstore.storage import rehash_file
+
+
+def fake_compress(input_path, output_path, power=2):
+    Path(output_path).write_bytes(b"small")
+    return CompletedProcess(args=[], returncode=0)
+
+
+def fake_failure(input_path, output_path, power=2):
+    return CompletedProcess(args=[], returncode=1)
+
+
+def test_compression_replaces_file(tmp_path):
+    pdf = tmp_path / "scan.pdf"
+    pdf.write_bytes(b"a much larger original file")
+    queue = CompressionQueue(workers=1)
+
+    with patch("duckstore.jobs.compress_pdf", fake_compress):
+        queue.submit(1, pdf).result()
+
+    assert queue.status(1)["state"] == DONE
+    assert pdf.read_bytes() == b"small"
+    assert list(tmp_path.iterdir()) == [pdf]
+
+    with patch("duckstore.jobs.compress_pdf", fake_failure):
+        queue.submit(2, pdf).result()
+
+    assert queue.status(2)["state"] == FAILED
+    assert pdf.read_bytes() == b"small"
+    assert queue.status(3) is None
+
+    # A file isn't compressed until the job it waits for is done
+    text_job = Future()
+    with patch("duckstore.jobs.compress_pdf", fake_compress):
+        pdf.write_bytes(b"a much larger original file")
+        job = queue.submit(4, pdf, after=text_job)
+        assert queue.status(4)["state"] == QUEUED
+        assert pdf.read_bytes() == b"a much larger original file"
+        text_job.set_result(True)
+        job.result()
+    assert queue.status(4)["state"] == DONE
+    assert pdf.read_bytes() == b"small"
+    queue.shutdown()
+
+
+def test_text_extracted_once_per_contents(client):
+    config = client.application.config
+    folder = Path(config["STORE_PATH"], config["STORE_NAME"])
+    queue = client.application.extensions["duckstore_text"]
+    read = []
+
+    def fake_extract(path, ocr=False):
+        read.append(path)
+        return "dear customer"
+
+    with patch("duckstore.jobs.extract_text", fake_extract):
+        for title in ["First", "Second"]:
+            client.post(
+                "/edit",
+                data={
+                    "title": title,
+                    "date_received": "2022-03-01",
+                    "files": (BytesIO(b"same letter"), "letter.txt"),
+                },
+            )
+            queue.wait()
+
+        # The second copy gets the text of the first
+        files = db_session.execute(select(File).order_by(File.id)).scalars().all()
+        assert read == [folder / files[0].path]
+        assert [db_file.text for db_file in files] == ["dear customer"] * 2
+        assert all(db_file.text_sha256 == db_file.sha256 for db_file in files)
+        assert missing_text_ids(db_session) == []
+        assert b"First" in client.get("/?query=customer").data
+
+        # Compression keeps the text, nothing is read again
+        (folder / files[0].path).write_bytes(b"compressed letter")
+        rehash_file(db_session, folder, files[0].id)
+        queue.submit(files[0].id).result()
+        assert len(read) == 1
+
+        # Other changes to the contents are read again
+        db_session.execute(
+            update(File).where(File.id == files[1].id).values(sha256="changed")
+        )
+        db_session.commit()
+        assert missing_text_ids(db_session) == [files[1].id]
+        queue.submit(files[1].id).result()
+        assert len(read) == 2
+        assert queue.status(files[1].id)["state"] == DONE
+
+    # A file that can't be read is left to be tried again
+    db_session.execute(
+        update(File).where(File.id == files[1].id).values(sha256="changed again")
+    )
+    db_session.commit()
+    (folder / files[1].path).unlink()
+    queue.submit(files[1].id).result()
+    assert queue.status(files[1].id)["state"] == FAILED
+    assert missing_text_ids(db_session) == [files[1].id]
+
+
+def test_hashless_file_read_once(client):
+    config = client.application.config
+    folder = Path(config["STORE_PATH"], config["STORE_NAME"])
+    (folder / "old.txt").write_text("old letter")
+    db_file = File(path="old.txt", original_name="old.txt")
+    db_session.add(db_file)
+    db_session.commit()
+    file_id = db_file.id
+
+    # Files stored before hashes were kept get one along with their text
+    assert extract_file_text(db_session, folder, file_id) is True
+    db_file = db_session.get(File, file_id)
+    assert db_file.sha256 == hashlib.sha256(b"old letter").hexdigest()
+    assert db_file.text_sha256 == db_file.sha256
+    assert missing_text_ids(db_session) == []
+    assert extract_file_text(db_session, folder, file_id) is False
+
+
+def test_ocr_for_pages_without_text(tmp_path):
+    from duckstore.util import extract_text as module
+
+    pdf = tmp_path / "scan.pdf"
+    pdf.write_bytes(b"%PDF")
+    rendered = []
+
+    def fake_render(input_path, page, output_path):
+        rendered.append(page)
+        Path(output_path).write_bytes(b"png")
+
+    with (
+        patch.object(module, "extract_pdf_pages", return_value=["Cover  page", " \n"]),
+        patch.object(module, "render_pdf_page", fake_render),
+        patch.object(module, "ocr_image", return_value="scanned\nletter"),
+        patch.object(module, "ocr_available", return_value=True),
+    ):
+        assert module.extract_text(pdf) == "Cover page"
+        assert module.extract_text(pdf, ocr=True) == "Cover page scanned letter"
+        assert rendered == [2]
+        assert module.extract_text(tmp_path / "photo.jpg", ocr=True) == (
+            "scanned letter"
+        )
+
+    with patch.object(module, "ocr_available", return_value=False):
+        assert module.extract_text(tmp_path / "photo.jpg", ocr=True) is None
@@ -5,6 +5,7 @@ Test the launcher runs the correct commands given the correct input
 from pathlib import Path
 from unittest.mock import patch, MagicMock
 
+import pytest
 from click.testing import CliRunner
 
 from duckstore.config import db_name
@@ -22,9 +23,10 @@ def test_launch_loads_db(db_folder):
 
     assert db_path.is_file()
 
-    with (patch(f"{launcher_mod}.create_app") as mock,
-          patch.object(Path, "cwd") as cwd_mock):
-
+    with (
+        patch(f"{launcher_mod}.create_app") as mock,
+        patch.object(Path, "cwd") as cwd_mock,
+    ):
         cwd_mock.return_value = db_folder_path
         run_mock = mock.return_value
 
@@ -34,9 +36,7 @@ def test_launch_loads_db(db_folder):
         run_mock.run.assert_called()
 
     assert result.exit_code == 0
-    assert result.output == (
-        f"Database found at {db_path}. Loading from folder.\n"
-    )
+    assert result.output == f"Database found at {db_path}. Loading from folder.\n"
 
 
 def test_launch_nofolder_selected():
@@ -54,3 +54,26 @@ def test_launch_nofolder_selected():
 
     assert result.exit_code == 1
     assert result.output == "Folder not selected - Exiting.\n"
+
+
+def test_launch_serve(db_folder):
+    pytest.importorskip("waitress")
+    runner = CliRunner()
+    db_folder_path = Path(db_folder)
+
+    with (
+        patch(f"{launcher_mod}.create_app") as mock,
+        patch("waitress.serve") as serve_mock,
+    ):
+        result = runner.invoke(  # noqa
+            launch, args=["--folder", db_folder, "--serve", "--threads", "16"]
+        )
+
+        mock.assert_called_once_with(
+            db_folder_path, create=False, DB_POOL_SIZE=16, PRETTIFY=False
+        )
+        serve_mock.assert_called_once_with(
+            mock.return_value, host="127.0.0.1", port=5000, threads=16
+        )
+
+    assert result.exit_code == 0
@@ -0,0 +1,94 @@
+"""
+Test the request, SQL and ghostscript timings
+"""
+import logging
+import re
+
+import pytest
+
+from duckstore.app import create_app
+from duckstore.database import db_session
+from duckstore.metrics import Metrics, metrics, time_subprocess
+
+
+@pytest.fixture
+def metrics_client(tmp_path):
+    metrics.clear()
+    app = create_app(
+        folder_path=tmp_path,
+        create=True,
+        METRICS_ENABLED=True,
+        SLOW_REQUEST_SECONDS=0,
+    )
+
+    @app.route("/ghostscript")
+    def ghostscript():
+        with time_subprocess("compress"):
+            pass
+        return "done"
+
+    with app.test_client() as client:
+        yield client
+
+    db_session.remove()
+    metrics.enabled = False
+    metrics.clear()
+
+
+def metric_value(text, name, **labels):
+    label_text = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    if label_text:
+        name = f"{name}{{{label_text}}}"
+    match = re.search(rf"^{re.escape(name)} (\S+)$", text, re.MULTILINE)
+    assert match, f"{name} not found"
+    return float(match.group(1))
+
+
+def test_metrics_endpoint(metrics_client, caplog):
+    with caplog.at_level(logging.WARNING):
+        assert metrics_client.get("/").status_code == 200
+        assert metrics_client.get("/ghostscript").status_code == 200
+
+    text = metrics_client.get("/metrics").text
+    main = "duckstore.store_main"
+    assert (
+        metric_value(
+            text, "duckstore_requests_total", endpoint=main, method="GET", status=200
+        )
+        == 1
+    )
+    assert metric_value(text, "duckstore_request_sql_statements_total", endpoint=main)
+    assert metric_value(text, "duckstore_request_sql_seconds_total", endpoint=main) > 0
+    assert (
+        metric_value(text, "duckstore_request_template_seconds_total", endpoint=main)
+        > 0
+    )
+    assert (
+        metric_value(text, "duckstore_request_duration_seconds_count", endpoint=main)
+        == 1
+    )
+    assert metric_value(text, "duckstore_subprocess_runs_total", task="compress") == 1
+    assert "# TYPE duckstore_request_duration_seconds histogram" in text
+
+    slow = [record.getMessage() for record in caplog.records]
+    assert any(message.startswith("Slow request GET / (200)") for message in slow)
+    assert any(message.startswith("Slow request GET /ghostscript") for message in slow)
+
+
+def test_metrics_disabled(client):
+    assert client.get("/metrics").status_code == 404
+
+
+def test_histogram_buckets():
+    registry = Metrics(buckets=(0.1, 1.0))
+    registry.observe("duration", 0.05, endpoint="a")
+    registry.observe("duration", 0.5, endpoint="a")
+    registry.observe("duration", 5, endpoint="a")
+    registry.inc("count", endpoint='say "hi"')
+
+    text = registry.render()
+    assert 'duration_bucket{endpoint="a",le="0.1"} 1' in text
+    assert 'duration_bucket{endpoint="a",le="1"} 2' in text
+    assert 'duration_bucket{endpoint="a",le="+Inf"} 3' in text
+    assert 'duration_sum{endpoint="a"} 5.55' in text
+    assert 'count{endpoint="say \\"hi\\""} 1' in text
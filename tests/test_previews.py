@@ -0,0 +1,84 @@
+"""
+Test thumbnails are cached, evicted and served with long cache headers
+"""
+import os
+from pathlib import Path
+
+from duckstore.database import db_session
+from duckstore.database.models import Document, File
+from duckstore.exceptions import FileTypeError
+from duckstore.previews import ThumbnailCache, get_thumbnail_cache
+
+
+def fake_render(input_path, output_path, width):
+    if Path(input_path).suffix != ".pdf":
+        raise FileTypeError("No preview")
+    fake_render.calls += 1
+    Path(output_path).write_bytes(b"\x89PNG" + b"x" * 96)
+
+
+def test_thumbnail_cache_lru(tmp_path):
+    fake_render.calls = 0
+    cache = ThumbnailCache(tmp_path / "thumbs", max_bytes=250, render=fake_render)
+    source = tmp_path / "scan.pdf"
+    source.write_bytes(b"%PDF")
+
+    first = cache.get(source, "a")
+    assert first.read_bytes().startswith(b"\x89PNG")
+    assert cache.get(source, "a") == first
+    assert fake_render.calls == 1
+
+    # Make "a" older than "b", then use it so "b" is the least recently used
+    cache.get(source, "b")
+    os.utime(first, (0, 0))
+    os.utime(cache.thumbnail_path("b"), (1, 1))
+    cache.get(source, "a")
+
+    cache.get(source, "c")
+    assert cache.thumbnail_path("a").exists()
+    assert not cache.thumbnail_path("b").exists()
+    assert cache.thumbnail_path("c").exists()
+
+    # Files without a preview aren't tried again
+    text_file = tmp_path / "notes.txt"
+    text_file.write_text("notes")
+    assert cache.get(text_file, "d") is None
+    assert cache.get(text_file, "d") is None
+    assert list(cache.folder.glob("*.rendering")) == []
+
+    # Other failures may pass, so the file is tried again next time
+    missing = tmp_path / "missing.pdf"
+    cache.render = lambda *args: missing.read_bytes()
+    assert cache.get(missing, "e") is None
+    cache.render = fake_render
+    missing.write_bytes(b"%PDF")
+    assert cache.get(missing, "e") is not None
+    cache.shutdown()
+
+
+def test_thumbnail_route(client):
+    fake_render.calls = 0
+    with client.application.app_context():
+        get_thumbnail_cache().render = fake_render
+
+    config = client.application.config
+    folder = Path(config["STORE_PATH"], config["STORE_NAME"])
+    Path(folder, "scan.pdf").write_bytes(b"%PDF")
+    document = Document(title="Scan")
+    document.files.append(File(path="scan.pdf", original_name="scan.pdf", sha256="ab"))
+    db_session.add(document)
+    db_session.commit()
+    file_id = document.files[0].id
+
+    response = client.get(f"/thumbnail/{file_id}", query_string={"v": "ab"})
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    assert response.cache_control.max_age == 365 * 24 * 60 * 60
+    assert response.cache_control.immutable
+
+    # Without the current version the browser has to check back
+    response = client.get(f"/thumbnail/{file_id}")
+    assert response.cache_control.max_age == 0
+    assert fake_render.calls == 1
+
+    assert client.get("/thumbnail/999").status_code == 404
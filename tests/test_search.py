@@ -0,0 +1,276 @@
+"""
+Test the full text search index and the search page
+"""
+import json
+from contextlib import contextmanager
+from datetime import date
+
+from sqlalchemy import event, select, text
+
+from duckstore.database import db_session
+from duckstore.database.models import Document, File, Source, Tag
+from duckstore.database.search import (
+    document_fts,
+    facet_counts,
+    iter_documents,
+    make_match_expression,
+    match_documents,
+    search_documents,
+)
+
+
+def add_document(title, description=None, file_text=None, received=date(2021, 1, 1)):
+    document = Document(title=title, description=description, date_received=received)
+    if file_text:
+        document.files.append(File(path="x.pdf", original_name="x.pdf", text=file_text))
+    db_session.add(document)
+    db_session.commit()
+    return document.id
+
+
+def search_ids(search_text):
+    query = (
+        select(Document.id)
+        .join(document_fts, document_fts.c.rowid == Document.id)
+        .where(match_documents(search_text))
+        .order_by(document_fts.c.rank)
+    )
+    return db_session.execute(query).scalars().all()
+
+
+@contextmanager
+def count_statements():
+    """Count the SQL statements sent to the database inside the block"""
+    engine = db_session.get_bind()
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def test_match_expression():
+    assert make_match_expression("") is None
+    assert make_match_expression('"; DROP') == '"DROP"*'
+    assert make_match_expression("gas bill") == '"gas"* "bill"*'
+
+
+def test_index_follows_documents(client):
+    gas = add_document("Gas Bill", description="Quarterly statement")
+    water = add_document("Water", description="Annual gas summary")
+    letter = add_document("Letter", file_text="Your electricity account")
+
+    # Title matches rank above description matches
+    assert search_ids("gas") == [gas, water]
+    assert search_ids("electric") == [letter]
+    assert search_ids("quarter statement") == [gas]
+
+    document = db_session.get(Document, water)
+    document.title = "Water Rates"
+    db_session.commit()
+    assert search_ids("rates") == [water]
+
+    db_session.delete(db_session.get(Document, letter))
+    db_session.commit()
+    assert search_ids("electricity") == []
+
+    count = db_session.execute(text("SELECT count(*) FROM document_fts")).scalar()
+    assert count == 2
+
+
+def test_search_page(client):
+    add_document("Car Insurance", description="Renewal documents")
+    add_document("Home Insurance")
+    add_document("Payslip")
+
+    response = client.get("/", query_string={"query": "insurance", "source": ""})
+    assert response.status_code == 200
+    assert b"Car Insurance" in response.data
+    assert b"Home Insurance" in response.data
+    assert b"Payslip" not in response.data
+
+
+def test_search_query_count_is_fixed(client):
+    """Rendering results must not lazy load relationships per document"""
+    search = {"query": "statement", "source": ""}
+
+    def add_documents(start, stop):
+        for i in range(start, stop):
+            document = Document(title=f"Statement {i}", date_received=date.today())
+            document.tags = [Tag(name=f"tag_{i}_a"), Tag(name=f"tag_{i}_b")]
+            document.sources = [Source(name=f"source_{i}")]
+            document.files.append(File(path=f"{i}.pdf", original_name=f"{i}.pdf"))
+            db_session.add(document)
+        db_session.commit()
+        db_session.remove()
+
+    add_documents(0, 2)
+    with count_statements() as small_search:
+        response = client.get("/", query_string=search)
+    assert b"Statement 1" in response.data
+
+    add_documents(2, 30)
+    with count_statements() as large_search:
+        response = client.get("/", query_string=search)
+    assert b"Statement 29" in response.data
+
+    assert len(large_search) == len(small_search)
+
+
+def test_search_pages(client):
+    client.application.config["RESULTS_PER_PAGE"] = 2
+    # Matching dates check the id is used to break ties
+    received = [date(2020, 1, 1), date(2021, 1, 1), date(2021, 1, 1), None, None]
+    doc_ids = [add_document(f"Bill {i}", received=d) for i, d in enumerate(received)]
+    expected = [doc_ids[2], doc_ids[1], doc_ids[0], doc_ids[4], doc_ids[3]]
+
+    for search_text in [None, "bill"]:
+        seen = []
+        cursor = None
+        while True:
+            page = search_documents(db_session, search_text, cursor=cursor, limit=2)
+            seen.extend(document.id for document in page.documents)
+            if page.next_cursor is None:
+                break
+            cursor = page.next_cursor
+
+        if search_text:
+            assert sorted(seen) == sorted(doc_ids)
+        else:
+            assert seen == expected
+
+    response = client.get("/")
+    assert b"Bill 2" in response.data
+    assert b"Bill 0" not in response.data
+    assert b"Next Page" in response.data
+
+
+def test_iter_documents_keeps_other_objects(client):
+    for i in range(5):
+        add_document(f"Letter {i}")
+    held = db_session.execute(select(Document).where(Document.id == 1)).scalar_one()
+    db_session.add(Tag(name="pending"))
+
+    titles = [document.title for document in iter_documents(db_session, batch_size=2)]
+    assert len(titles) == 5
+    # Objects loaded or added before iterating are still in the session
+    assert held in db_session
+    assert [tag.name for tag in db_session.new] == ["pending"]
+    db_session.rollback()
+
+
+def test_api_documents(client):
+    doc_ids = [add_document(f"Receipt {i}") for i in range(5)]
+    add_document("Payslip")
+
+    response = client.get("/api/documents", query_string={"query": "receipt"})
+    assert response.mimetype == "application/x-ndjson"
+
+    lines = response.get_data(as_text=True).splitlines()
+    documents = [json.loads(line) for line in lines]
+    assert sorted(document["id"] for document in documents) == doc_ids
+
+    response = client.get("/api/documents", query_string={"cursor": "nonsense"})
+    assert response.status_code == 400
+
+
+def test_api_documents_deleted_meanwhile(client, monkeypatch):
+    from duckstore import api
+    from duckstore.database.serialize import document_dicts
+
+    doc_ids = [add_document(f"Receipt {i}") for i in range(3)]
+
+    def delete_first(session, ids):
+        found = document_dicts(session, ids)
+        found.pop(doc_ids[0], None)
+        return found
+
+    monkeypatch.setattr(api, "document_dicts", delete_first)
+    lines = client.get("/api/documents").get_data(as_text=True).splitlines()
+    assert sorted(json.loads(line)["id"] for line in lines) == doc_ids[1:]
+
+
+def test_tag_and_source_filters(client):
+    tags = {name: Tag(name=name) for name in ["car", "tax", "bill", "old"]}
+    sources = {name: Source(name=name) for name in ["bank", "council", "garage"]}
+
+    def add_tagged(title, tag_names, source_names):
+        document = Document(title=title, date_received=date(2021, 1, 1))
+        document.tags = [tags[name] for name in tag_names]
+        document.sources = [sources[name] for name in source_names]
+        db_session.add(document)
+        db_session.commit()
+        return document.id
+
+    car_tax = add_tagged("Car tax", ["car", "tax", "bill"], ["council"])
+    service = add_tagged("Service", ["car", "bill"], ["garage"])
+    council_tax = add_tagged("Council tax", ["tax", "bill", "old"], ["council", "bank"])
+    statement = add_tagged("Statement", [], ["bank"])
+
+    def found(**search):
+        documents = search_documents(db_session, **search).documents
+        return sorted(document.id for document in documents)
+
+    assert found(tags=["car", "bill"]) == [car_tax, service]
+    assert found(tags=["car", "tax", "bill"]) == [car_tax]
+    assert found(tags=["car", "car"]) == [car_tax, service]
+    assert found(tags=["car", "missing"]) == []
+    assert found(any_tags=["car", "old"]) == [car_tax, service, council_tax]
+    assert found(exclude_tags=["car"]) == [council_tax, statement]
+    assert found(tags=["bill"], exclude_tags=["old", "tax"]) == [service]
+    assert found(sources=["bank", "garage"]) == [service, council_tax, statement]
+    assert found(sources=["council"], any_tags=["car"]) == [car_tax]
+    assert found(search_text="tax", tags=["old"]) == [council_tax]
+
+    response = client.get(
+        "/",
+        query_string={"source": ["garage", "council"], "exclude_tags": "tax"},
+    )
+    assert b"Service" in response.data
+    assert b"Car tax" not in response.data
+    assert b"Statement" not in response.data
+    # Tags count within the results, sources count as if they were all allowed
+    counts = facet_counts(db_session, sources=["council"], tags=["bill"])
+    assert counts["tags"] == {"car": 1, "tax": 2, "bill": 2, "old": 1}
+    assert counts["sources"] == {"council": 2, "bank": 1, "garage": 1}
+    assert facet_counts(db_session, search_text="service")["tags"] == {
+        "car": 1,
+        "bill": 1,
+    }
+
+    # Options with no results are hidden unless they are selected
+    response = client.get("/", query_string={"tags": "car"})
+    assert b"tax (1)" in response.data
+    assert b"car (2)" in response.data
+    assert b"old (" not in response.data
+    assert b"bank (1)" not in response.data
+
+    # Any of the tags can add more, so those options aren't limited by each other
+    response = client.get("/", query_string={"any_tags": "old"})
+    any_tags = response.data.split(b'name="any_tags"')[1].split(b"</select>")[0]
+    assert b"car (2)" in any_tags
+    assert b"old (1)" in any_tags
+
+
+def test_tag_filter_is_one_subquery():
+    """Each kind of tag filter adds one subquery however many tags are chosen"""
+    from duckstore.database.search import search_query
+
+    few = str(search_query(tags=["a", "b"], exclude_tags=["c"]))
+    many = str(search_query(tags=list("abcdefgh"), exclude_tags=list("ijkl")))
+
+    assert few.count("SELECT") == many.count("SELECT") == 3
+    assert many.count("HAVING") == 1
+
+
+def test_invalid_filters_find_nothing(client):
+    add_document("Gas bill")
+    response = client.get("/", query_string={"tags": "Nope"})
+    assert response.status_code == 200
+    assert b"Gas bill" not in response.data
+    assert b"not a valid choice" in response.data
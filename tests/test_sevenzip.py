@@ -0,0 +1,85 @@
+"""
+Test full and incremental snapshots restore the store folder
+"""
+import pytest
+
+from duckstore.exceptions import SnapshotChainError
+from duckstore.util.sevenzip import (
+    create_snapshot,
+    extract_archive,
+    extract_database,
+    extract_files,
+    read_manifest,
+    manifest_name,
+)
+
+
+def folder_contents(folder):
+    return {
+        pth.relative_to(folder).as_posix(): pth.read_bytes()
+        for pth in folder.rglob("*")
+        if pth.is_file() and pth.name != manifest_name
+    }
+
+
+def test_incremental_snapshots(tmp_path):
+    store = tmp_path / "store"
+    (store / "store").mkdir(parents=True)
+    (store / "duckstore.db").write_bytes(b"database")
+    (store / "store" / "a.pdf").write_bytes(b"first file")
+    (store / "store" / "b.pdf").write_bytes(b"second file")
+
+    reports = []
+    base = create_snapshot(
+        store,
+        tmp_path / "base.7z",
+        password="secret",
+        parts=2,
+        progress=lambda done, total: reports.append((done, total)),
+    )
+    assert sorted(base["archived"]) == ["duckstore.db", "store/a.pdf", "store/b.pdf"]
+    assert base["parts"] == ["base.part1.7z", "base.part2.7z"]
+    assert reports[-1] == (29, 29)
+
+    (store / "duckstore.db").write_bytes(b"database v2")
+    (store / "store" / "b.pdf").unlink()
+    (store / "store" / "c.pdf").write_bytes(b"third file")
+
+    delta = create_snapshot(
+        store, tmp_path / "delta.7z", password="secret", base=read_manifest(store)
+    )
+    assert delta["parent"] == base["id"]
+    assert sorted(delta["archived"]) == ["duckstore.db", "store/c.pdf"]
+    assert delta["deleted"] == ["store/b.pdf"]
+
+    restored = tmp_path / "restored"
+    extract_archive(
+        tmp_path / "base.7z", restored, "secret", deltas=[tmp_path / "delta.7z"]
+    )
+    assert folder_contents(restored) == folder_contents(store)
+    assert read_manifest(restored)["id"] == delta["id"]
+
+    # Deltas must be applied in order on top of their own base
+    with pytest.raises(SnapshotChainError):
+        extract_archive(
+            tmp_path / "delta.7z",
+            tmp_path / "wrong",
+            "secret",
+            deltas=[tmp_path / "delta.7z"],
+        )
+
+
+def test_database_restored_first(tmp_path):
+    store = tmp_path / "store"
+    (store / "store").mkdir(parents=True)
+    (store / "duckstore.db").write_bytes(b"database")
+    (store / "store" / "a.pdf").write_bytes(b"first file")
+    create_snapshot(store, tmp_path / "base.7z")
+
+    restored = tmp_path / "restored"
+    chain = extract_database(tmp_path / "base.7z", restored)
+    assert (restored / "duckstore.db").read_bytes() == b"database"
+    assert not (restored / "store").exists()
+
+    extract_files(chain, restored)
+    assert folder_contents(restored) == folder_contents(store)
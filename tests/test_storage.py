@@ -0,0 +1,71 @@
+"""
+Test the content addressed store layout
+"""
+from io import BytesIO
+from pathlib import Path
+
+from sqlalchemy import select
+
+from duckstore.database import db_session
+from duckstore.database.models import Document, File
+from duckstore.storage import is_blob, rehash_file
+from duckstore.uploads import hash_file
+
+
+def add_document(client, title, content):
+    response = client.post(
+        "/edit",
+        data={
+            "title": title,
+            "date_received": "2022-03-01",
+            "files": (BytesIO(content), "statement.pdf"),
+        },
+    )
+    assert response.status_code == 302
+    query = select(Document).where(Document.title == title)
+    document = db_session.execute(query).scalars().one()
+    return document.id, document.files[0].path
+
+
+def test_duplicate_uploads_share_a_blob(client):
+    client.application.config["CONTENT_ADDRESSED"] = True
+    config = client.application.config
+    folder = Path(config["STORE_PATH"], config["STORE_NAME"])
+
+    first_id, first_path = add_document(client, "First", b"same statement")
+    second_id, second_path = add_document(client, "Second", b"same statement")
+    _, other_path = add_document(client, "Other", b"different statement")
+
+    blob = folder / first_path
+    assert is_blob(first_path)
+    assert first_path == second_path
+    assert first_path != other_path
+    assert blob.read_bytes() == b"same statement"
+    assert len(list(folder.glob("blobs/*/*"))) == 2
+
+    # The blob stays until the last document using it is removed
+    client.get("/delete", query_string={"doc_id": first_id})
+    assert blob.is_file()
+    client.get("/delete", query_string={"doc_id": second_id})
+    assert not blob.exists()
+
+    assert len(db_session.execute(select(File)).scalars().all()) == 1
+
+
+def test_rehash_moves_blob(client):
+    client.application.config["CONTENT_ADDRESSED"] = True
+    config = client.application.config
+    folder = Path(config["STORE_PATH"], config["STORE_NAME"])
+
+    _, path = add_document(client, "Scan", b"uncompressed")
+    db_file = db_session.execute(select(File)).scalars().one()
+
+    # As if the compression job had replaced the contents
+    (folder / path).write_bytes(b"compressed")
+    rehash_file(db_session, folder, db_file.id)
+
+    db_file = db_session.get(File, db_file.id)
+    assert db_file.sha256 == hash_file(folder / db_file.path)
+    assert db_file.path != path
+    assert not (folder / path).exists()
+    assert (folder / db_file.path).read_bytes() == b"compressed"
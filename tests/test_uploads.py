@@ -0,0 +1,148 @@
+"""
+Test uploaded files are streamed into the store with their hashes
+"""
+import hashlib
+from io import BytesIO
+from pathlib import Path
+
+from sqlalchemy import select
+
+from duckstore.database import db_session
+from duckstore.database.models import File
+
+
+def store_folder(client):
+    config = client.application.config
+    return Path(config["STORE_PATH"], config["STORE_NAME"])
+
+
+def test_form_upload(client):
+    content = b"statement " * 100_000
+
+    response = client.post(
+        "/edit",
+        data={
+            "title": "Statement",
+            "date_received": "2022-03-01",
+            "files": (BytesIO(content), "statement.txt"),
+        },
+    )
+    assert response.status_code == 302
+
+    db_file = db_session.execute(select(File)).scalars().one()
+    assert db_file.sha256 == hashlib.sha256(content).hexdigest()
+    assert db_file.full_path(store_folder(client)).read_bytes() == content
+
+    # Nothing is left behind in the upload folder
+    upload_folder = Path(client.application.config["STORE_PATH"], ".uploads")
+    assert list(upload_folder.iterdir()) == []
+
+
+def test_resumable_upload(client):
+    content = b"0123456789" * 1000
+
+    response = client.post("/api/uploads", data={"filename": "scan.pdf"})
+    assert response.status_code == 201
+    upload_id = response.json["id"]
+    url = f"/api/uploads/{upload_id}"
+
+    response = client.patch(url, data=content[:4000], headers={"Upload-Offset": 0})
+    assert response.json["offset"] == 4000
+
+    # A chunk sent again after a dropped connection is refused with the offset
+    response = client.patch(url, data=content[:4000], headers={"Upload-Offset": 0})
+    assert response.status_code == 409
+    assert response.json["offset"] == 4000
+
+    response = client.patch(url, data=content[4000:], headers={"Upload-Offset": 4000})
+    assert response.json["offset"] == len(content)
+    assert client.get(url).json == {
+        "id": upload_id,
+        "filename": "scan.pdf",
+        "size": None,
+        "offset": len(content),
+    }
+
+    client.post(
+        "/edit",
+        data={"title": "Scan", "date_received": "2022-03-01", "uploads": upload_id},
+    )
+
+    db_file = db_session.execute(select(File)).scalars().one()
+    assert db_file.original_name == "scan.pdf"
+    assert db_file.sha256 == hashlib.sha256(content).hexdigest()
+    assert db_file.full_path(store_folder(client)).read_bytes() == content
+    assert client.get(url).status_code == 404
+    assert client.get("/api/uploads/..%2Fduckstore").status_code == 404
+
+
+def test_resumable_upload_size_limit(client):
+    client.application.config["MAX_UPLOAD_SIZE"] = 5000
+
+    response = client.post("/api/uploads", data={"filename": "a.pdf", "size": 6000})
+    assert response.status_code == 413
+
+    # Without a declared size the configured maximum applies
+    upload_id = client.post("/api/uploads", data={"filename": "a.pdf"}).json["id"]
+    url = f"/api/uploads/{upload_id}"
+    response = client.patch(url, data=b"x" * 3000, headers={"Upload-Offset": 0})
+    assert response.json["offset"] == 3000
+    response = client.patch(url, data=b"x" * 3000, headers={"Upload-Offset": 3000})
+    assert response.status_code == 413
+    assert client.get(url).json["offset"] == 3000
+
+    # A declared size caps the upload below the maximum
+    response = client.post("/api/uploads", data={"filename": "b.pdf", "size": 10})
+    upload_id = response.json["id"]
+    url = f"/api/uploads/{upload_id}"
+    response = client.patch(url, data=b"x" * 11, headers={"Upload-Offset": 0})
+    assert response.status_code == 413
+    assert client.get(url).json == {
+        "id": upload_id,
+        "filename": "b.pdf",
+        "size": 10,
+        "offset": 0,
+    }
+
+
+def test_resumable_upload_hashed_as_sent(client, monkeypatch):
+    from duckstore import uploads
+
+    content = b"abcdefghij" * 100
+    with client.application.test_request_context():
+        upload_id = uploads.create_upload("notes.txt")
+        uploads.append_upload(upload_id, 0, BytesIO(content[:300]))
+        uploads.append_upload(upload_id, 300, BytesIO(content[300:]))
+
+        monkeypatch.setattr(uploads, "hash_file", None)
+        outpath = Path(client.application.config["STORE_PATH"], "notes.txt")
+        assert uploads.finish_upload(upload_id, outpath) == (
+            hashlib.sha256(content).hexdigest()
+        )
+        monkeypatch.undo()
+
+        # An upload this process didn't see from the start is read back to hash it
+        upload_id = uploads.create_upload("notes.txt")
+        uploads.append_upload(upload_id, 0, BytesIO(content))
+        uploads._upload_hashes.clear()
+        assert uploads.finish_upload(upload_id, outpath) == (
+            hashlib.sha256(content).hexdigest()
+        )
+
+
+def test_incomplete_upload_not_stored(client):
+    response = client.post("/api/uploads", data={"filename": "scan.pdf", "size": 100})
+    upload_id = response.json["id"]
+    url = f"/api/uploads/{upload_id}"
+    client.patch(url, data=b"x" * 10, headers={"Upload-Offset": 0})
+
+    response = client.post(
+        "/edit",
+        data={"title": "Scan", "date_received": "2022-03-01", "uploads": upload_id},
+        follow_redirects=True,
+    )
+    assert b"only 10 of 100 bytes arrived" in response.data
+    assert db_session.execute(select(File)).scalars().all() == []
+
+    # The upload can still be finished
+    assert client.get(url).json["offset"] == 10